@@ -0,0 +1,59 @@
+'''Backs up a large database while a writer commits small writes, and reports how long the slowest write took, and how the backup went, backing up in one step against in small steps.
+
+In rollback journal mode a backup step's read lock keeps the writer from committing, and every write restarts a stepped backup, which after 3 restarts copies the rest in one step. With WAL, the backup copies a snapshot and the writer never waits.
+
+Run with `python -m benchmarks.bench_backup`.'''
+import os
+import sqlite3
+import threading
+import time
+
+from incontext.backup import backup_database
+from incontext.db import get_db
+
+from benchmarks.common import make_app, seed_master_list
+
+ITEM_COUNT = 50000
+DETAIL_COUNT = 5
+WRITE_INTERVAL = 0.01 # seconds between the writer's commits
+CONFIGS = (
+    ('rollback journal, one step', 'DELETE', -1),
+    ('rollback journal, steps', 'DELETE', 256),
+    ('WAL, one step', 'WAL', -1),
+    ('WAL, steps', 'WAL', 256),
+)
+
+
+def main():
+    print(f'{"":>28} {"backup s":>9} {"restarts":>9} {"longest step ms":>16} {"writes":>7} {"max write ms":>13}')
+    for label, journal_mode, pages in CONFIGS:
+        app = make_app(DATABASE_PRAGMAS={'journal_mode': journal_mode, 'busy_timeout': 30000})
+        with app.app_context():
+            seed_master_list(get_db(), ITEM_COUNT, DETAIL_COUNT)
+        path = app.config['DATABASE']
+        done = threading.Event()
+        latencies = []
+
+        def write():
+            db = sqlite3.connect(path, timeout=30)
+            while not done.is_set():
+                start = time.perf_counter()
+                db.execute("UPDATE users SET password = ? WHERE id = 1", (str(start),))
+                db.commit()
+                latencies.append(time.perf_counter() - start)
+                time.sleep(WRITE_INTERVAL)
+            db.close()
+
+        writer = threading.Thread(target=write)
+        writer.start()
+        stats = backup_database(path, os.path.join(os.path.dirname(path), 'backup.sqlite'), pages, 0.005, 3)
+        done.set()
+        writer.join()
+        print(
+            f'{label:>28} {stats["seconds"]:>9.2f} {stats["restarts"]:>9} {stats["longest_step"] * 1000:>16.1f}'
+            f' {len(latencies):>7} {max(latencies) * 1000:>13.1f}'
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+'''Compares requests per second with a new connection per request against pooled connections, with and without the tuned pragmas.
+
+Reads view one master item; writes edit one. The mixed run has reader threads and a writer thread going at the same time, where the rollback journal makes readers wait for the writer.
+
+Run with `python -m benchmarks.bench_connections`.'''
+import threading
+import time
+
+from incontext.db import get_db
+
+from benchmarks.common import login, make_app, seed_master_list
+
+CONFIGS = (
+    ('per request, rollback journal', {'DATABASE_REUSE_CONNECTIONS': False, 'DATABASE_PRAGMAS': {'journal_mode': 'DELETE'}}),
+    ('per request, tuned pragmas', {'DATABASE_REUSE_CONNECTIONS': False}),
+    ('pooled, tuned pragmas', {'DATABASE_REUSE_CONNECTIONS': True}),
+)
+DURATION = 2.0 # seconds per measurement
+READER_THREADS = 3
+
+
+def requests_per_second(fn, duration=DURATION):
+    count = 0
+    end = time.perf_counter() + duration
+    while time.perf_counter() < end:
+        fn()
+        count += 1
+    return count / duration
+
+
+def main():
+    print(f'{"":>30} {"reads/s":>9} {"writes/s":>9} {"mixed reads/s":>14} {"mixed writes/s":>15}')
+    for label, config in CONFIGS:
+        app = make_app(**config)
+        with app.app_context():
+            db = get_db()
+            master_list_id = seed_master_list(db, 1000, 10)
+            master_item_id = db.execute(
+                'SELECT MIN(master_item_id) FROM master_list_item_relations WHERE master_list_id = ?', (master_list_id,)
+            ).fetchone()[0]
+            master_detail_ids = [
+                row[0] for row in db.execute(
+                    'SELECT master_detail_id FROM master_list_detail_relations WHERE master_list_id = ?', (master_list_id,)
+                )
+            ]
+        item_url = f'/master-lists/{master_list_id}/master-items/{master_item_id}'
+        form = {'name': 'edited', **{str(master_detail_id): 'edited' for master_detail_id in master_detail_ids}}
+
+        def read(client):
+            assert client.get(f'{item_url}/view').status_code == 200
+
+        def write(client):
+            assert client.post(f'{item_url}/edit', data=form).status_code == 302
+
+        client = login(app.test_client())
+        reads = requests_per_second(lambda: read(client))
+        writes = requests_per_second(lambda: write(client))
+
+        results = {}
+
+        def run(name, fn, client):
+            results[name] = requests_per_second(lambda: fn(client))
+
+        threads = [
+            threading.Thread(target=run, args=(f'read {n}', read, login(app.test_client())))
+            for n in range(READER_THREADS)
+        ]
+        threads.append(threading.Thread(target=run, args=('write', write, login(app.test_client()))))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        mixed_reads = sum(rate for name, rate in results.items() if name.startswith('read'))
+        print(f'{label:>30} {reads:>9.0f} {writes:>9.0f} {mixed_reads:>14.0f} {results["write"]:>15.0f}')
+
+
+if __name__ == '__main__':
+    main()
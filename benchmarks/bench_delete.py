@@ -0,0 +1,54 @@
+'''Times deleting a large master list: the single cascading DELETE of the delete route against the old six-statement cleanup.
+
+Run with `python -m benchmarks.bench_delete`.'''
+import time
+
+from incontext.db import get_db
+
+from benchmarks.common import login, make_app, seed_master_list
+
+ITEM_COUNT = 100000
+DETAIL_COUNT = 5
+
+LEGACY_DELETE = (
+    'DELETE FROM master_details WHERE id IN'
+    ' (SELECT master_detail_id FROM master_list_detail_relations WHERE master_list_id = ?)',
+    'DELETE FROM master_items WHERE id IN'
+    ' (SELECT master_item_id FROM master_list_item_relations WHERE master_list_id = ?)',
+    'DELETE FROM master_item_detail_relations WHERE master_item_id IN'
+    ' (SELECT master_item_id FROM master_list_item_relations WHERE master_list_id = ?)',
+    'DELETE FROM master_list_item_relations WHERE master_list_id = ?',
+    'DELETE FROM master_list_detail_relations WHERE master_list_id = ?',
+    'DELETE FROM master_lists WHERE id = ?',
+)
+
+
+def main():
+    app = make_app()
+    with app.app_context():
+        db = get_db()
+        # a second list of the same size, so deletes also have to skip unrelated rows
+        seed_master_list(db, ITEM_COUNT, DETAIL_COUNT)
+        cascade_list_id = seed_master_list(db, ITEM_COUNT, DETAIL_COUNT)
+        legacy_list_id = seed_master_list(db, ITEM_COUNT, DETAIL_COUNT)
+    client = login(app.test_client())
+    start = time.perf_counter()
+    assert client.post(f'/master-lists/{cascade_list_id}/delete').status_code == 302
+    cascade_seconds = time.perf_counter() - start
+    with app.app_context():
+        db = get_db()
+        start = time.perf_counter()
+        for sql in LEGACY_DELETE:
+            db.execute(sql, (legacy_list_id,))
+        db.commit()
+        legacy_seconds = time.perf_counter() - start
+        remaining = db.execute('SELECT COUNT(*) FROM master_item_detail_relations').fetchone()[0]
+    cells = ITEM_COUNT * DETAIL_COUNT
+    print(f'deleting a list of {ITEM_COUNT} items and {cells} cells')
+    print(f'  cascade route: {cascade_seconds:.2f} s')
+    print(f'  six statements: {legacy_seconds:.2f} s')
+    print(f'  cells left (the untouched list): {remaining}')
+
+
+if __name__ == '__main__':
+    main()
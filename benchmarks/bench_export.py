@@ -0,0 +1,52 @@
+'''Times the streaming master list exports: time to first byte, total time and peak Python memory.
+
+The first byte should arrive in milliseconds and peak memory should stay flat as the list grows.
+
+Run with `python -m benchmarks.bench_export`.'''
+import time
+import tracemalloc
+
+from incontext.db import get_db
+
+from benchmarks.common import login, make_app, seed_master_list
+
+DETAIL_COUNT = 20
+ITEM_COUNTS = (5000, 50000)
+
+
+def main():
+    app = make_app()
+    with app.app_context():
+        master_list_ids = {item_count: seed_master_list(get_db(), item_count, DETAIL_COUNT) for item_count in ITEM_COUNTS}
+    client = login(app.test_client())
+    print(f'{"format":>7} {"cells":>9} {"first byte ms":>14} {"total s":>8} {"MB":>7} {"peak MB":>8}')
+    for file_format in ('csv', 'ndjson'):
+        for item_count, master_list_id in master_list_ids.items():
+            url = f'/master-lists/{master_list_id}/export.{file_format}'
+            first_byte, total, size = stream(client, url)
+            # second pass under tracemalloc, which slows things down too much to time
+            tracemalloc.start()
+            stream(client, url)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(
+                f'{file_format:>7} {item_count * DETAIL_COUNT:>9} {first_byte * 1000:>14.1f} {total:>8.2f}'
+                f' {size / 2**20:>7.1f} {peak / 2**20:>8.1f}'
+            )
+
+
+def stream(client, url):
+    '''Reads a streamed response chunk by chunk. Returns the time to the first chunk, the total time and the size.'''
+    start = time.perf_counter()
+    response = client.get(url, buffered=False)
+    chunks = iter(response.response)
+    size = len(next(chunks))
+    first_byte = time.perf_counter() - start
+    for chunk in chunks:
+        size += len(chunk)
+    total = time.perf_counter() - start
+    response.close()
+    return first_byte, total, size
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+'''Times sorted and filtered pages of the master list view on a large list.
+
+Filters should cost about as much as the rows they select, not the size of the list. Sorting by a cell is a top-N sort over the whole list (missing cells have no index entries to walk), so it grows with the list.
+
+Run with `python -m benchmarks.bench_grid_query`.'''
+from incontext.db import get_db
+
+from benchmarks.common import best_of, login, make_app, seed_master_list
+
+ITEM_COUNT = 100000
+DETAIL_COUNT = 5
+
+
+def main():
+    app = make_app()
+    with app.app_context():
+        db = get_db()
+        # scrambled numbers in the first detail and words in the others, so sorting by a cell doesn't follow item order
+        first_detail_id = db.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM master_details').fetchone()[0]
+        master_list_id = seed_master_list(
+            db, ITEM_COUNT, DETAIL_COUNT,
+            content=lambda item_id, detail_id: (
+                str if detail_id == first_detail_id else 'x{:05x}'.format
+            )((item_id * 7919 + detail_id) % ITEM_COUNT)
+        )
+        detail_id, word_detail_id = first_detail_id, first_detail_id + 1
+        # the item in the middle of the list sorted by that detail
+        middle_item_id = db.execute(
+            'SELECT master_item_id FROM master_item_detail_relations WHERE master_detail_id = ?'
+            ' ORDER BY master_content, master_item_id LIMIT 1 OFFSET ?',
+            (detail_id, ITEM_COUNT // 2)
+        ).fetchone()[0]
+    client = login(app.test_client())
+    view = f'/master-lists/{master_list_id}/view'
+    queries = (
+        ('unsorted', ''),
+        ('sort', f'?sort={detail_id}'),
+        ('sort, deep', f'?sort={detail_id}&after={middle_item_id}'),
+        ('sort desc, deep', f'?sort=-{detail_id}&after={middle_item_id}'),
+        ('equals', f'?column={detail_id}&op=eq&value=4242'),
+        ('text range', f'?column={word_detail_id}&op=min&value=x0a&column={word_detail_id}&op=max&value=x0b'),
+        ('numeric range', f'?column={detail_id}&op=min&value=500&column={detail_id}&op=max&value=600'),
+        ('wide range', f'?column={detail_id}&op=min&value=500'),
+        ('contains', f'?column={detail_id}&op=contains&value=4242'),
+        ('name contains', '?column=name&op=contains&value=4242'),
+    )
+    print(f'{ITEM_COUNT} items x {DETAIL_COUNT} details')
+    print(f'{"query":>16} {"ms":>8}')
+    for label, query in queries:
+        assert client.get(view + query).status_code == 200
+        seconds = best_of(lambda: client.get(view + query))
+        print(f'{label:>16} {seconds * 1000:>8.1f}')
+
+
+if __name__ == '__main__':
+    main()
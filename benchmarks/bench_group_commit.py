@@ -0,0 +1,56 @@
+'''Compares new-item writes per second from concurrent request threads, each committing on its own, against group commit.
+
+Runs with `synchronous=FULL`, so that every commit waits for an fsync; with WAL and `synchronous=NORMAL` commits don't sync at all and there is little for group commit to save.
+
+Run with `python -m benchmarks.bench_group_commit`.'''
+import threading
+import time
+
+from incontext.db import get_db
+
+from benchmarks.common import login, make_app, seed_master_list
+
+THREAD_COUNTS = (1, 8, 32)
+DURATION = 3.0 # seconds per run
+PRAGMAS = {'journal_mode': 'WAL', 'synchronous': 'FULL', 'busy_timeout': 5000}
+
+
+def main():
+    print(f'{"":>16} {"threads":>8} {"writes/s":>9}')
+    for label, group_commit in (('own commits', False), ('group commit', True)):
+        for thread_count in THREAD_COUNTS:
+            app = make_app(DATABASE_PRAGMAS=PRAGMAS, DATABASE_GROUP_COMMIT=group_commit)
+            with app.app_context():
+                db = get_db()
+                master_list_id = seed_master_list(db, 0, 3)
+                form = {'name': 'new item', **{
+                    str(row[0]): 'cell' for row in db.execute(
+                        'SELECT master_detail_id FROM master_list_detail_relations WHERE master_list_id = ?', (master_list_id,)
+                    )
+                }}
+            counts = []
+
+            def write():
+                client = login(app.test_client())
+                count = 0
+                end = time.perf_counter() + DURATION
+                while time.perf_counter() < end:
+                    client.post(f'/master-lists/{master_list_id}/master-items/new', data=form)
+                    count += 1
+                counts.append(count)
+
+            threads = [threading.Thread(target=write) for _ in range(thread_count)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            with app.app_context():
+                item_count = get_db().execute(
+                    'SELECT COUNT(*) FROM master_list_item_relations WHERE master_list_id = ?', (master_list_id,)
+                ).fetchone()[0]
+            assert item_count == sum(counts)
+            print(f'{label:>16} {thread_count:>8} {sum(counts) / DURATION:>9.0f}')
+
+
+if __name__ == '__main__':
+    main()
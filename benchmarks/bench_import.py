@@ -0,0 +1,52 @@
+'''Times `flask import-list` style bulk imports and reports cells per second and peak Python memory.
+
+Peak memory should stay flat as the file grows, since rows are streamed and written in chunks. Timings include tracemalloc overhead.
+
+Run with `python -m benchmarks.bench_import`.'''
+import os
+import tempfile
+import time
+import tracemalloc
+
+from incontext.db import get_db
+from incontext.master_lists import get_master_list, import_rows, read_import_rows
+
+from benchmarks.common import make_app
+
+DETAIL_COUNT = 20
+ROW_COUNTS = (5000, 20000, 50000)
+
+
+def write_csv(path, row_count):
+    with open(path, 'w', newline='') as f:
+        f.write(','.join(['name'] + [f'detail {n}' for n in range(DETAIL_COUNT)]) + '\n')
+        for row in range(row_count):
+            f.write(','.join([f'item {row}'] + [f'value {row}/{n}' for n in range(DETAIL_COUNT)]) + '\n')
+
+
+def main():
+    app = make_app()
+    tmpdir = tempfile.mkdtemp(prefix='incontext-bench-')
+    print(f'{"rows":>8} {"cells":>9} {"seconds":>8} {"cells/s":>10} {"peak MB":>8}')
+    for row_count in ROW_COUNTS:
+        path = os.path.join(tmpdir, f'{row_count}.csv')
+        write_csv(path, row_count)
+        with app.app_context():
+            master_list_id = get_db().execute(
+                "INSERT INTO master_lists (creator_id, name, description) VALUES (2, 'import', '')"
+            ).lastrowid
+            get_db().commit()
+            master_list = get_master_list(master_list_id, check_access=False, with_master_items=False)
+            with open(path, newline='') as f:
+                tracemalloc.start()
+                start = time.perf_counter()
+                counts = import_rows(master_list, read_import_rows(f, 'csv'))
+                seconds = time.perf_counter() - start
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+        cells = counts['master_contents']
+        print(f'{row_count:>8} {cells:>9} {seconds:>8.2f} {cells / seconds:>10.0f} {peak / 2**20:>8.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+'''Deletes one of two large master lists, then gives the freed pages back with `maintain_database` (incremental vacuum in slices) or with a full VACUUM, while a thread keeps writing. Prints the file size, the time taken, and the slowest write.
+
+Run with `python -m benchmarks.bench_maintenance`.'''
+import os
+import sqlite3
+import threading
+import time
+
+from incontext.db import get_db
+from incontext.maintenance import maintain_database
+
+from benchmarks.common import make_app, seed_master_list
+
+ITEM_COUNT = 20000
+DETAIL_COUNT = 10
+
+
+def write_while(fn, path):
+    '''Runs `fn` while another thread inserts rows one transaction at a time. Returns fn's seconds and the slowest insert.'''
+    done = threading.Event()
+    latencies = []
+
+    def write():
+        db = sqlite3.connect(path, isolation_level=None, timeout=30)
+        while not done.is_set():
+            start = time.perf_counter()
+            db.execute("INSERT INTO master_lists (creator_id, name, description) VALUES (2, 'w', '')")
+            latencies.append(time.perf_counter() - start)
+            time.sleep(0.001)
+        db.close()
+
+    thread = threading.Thread(target=write)
+    thread.start()
+    start = time.perf_counter()
+    fn()
+    seconds = time.perf_counter() - start
+    done.set()
+    thread.join()
+    return seconds, max(latencies)
+
+
+def main():
+    print(f'{"":>12} {"MiB before":>10} {"MiB after":>10} {"seconds":>8} {"slowest write ms":>17}')
+    for label in ('incremental', 'VACUUM'):
+        app = make_app()
+        with app.app_context():
+            db = get_db()
+            master_list_id = seed_master_list(db, ITEM_COUNT, DETAIL_COUNT)
+            seed_master_list(db, ITEM_COUNT, DETAIL_COUNT)
+            db.execute('DELETE FROM master_lists WHERE id = ?', (master_list_id,))
+            db.commit()
+            db.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        path = app.config['DATABASE']
+        size_before = os.path.getsize(path)
+        if label == 'incremental':
+            fn = lambda: maintain_database(path, time_limit=60)
+        else:
+            fn = lambda: sqlite3.connect(path, isolation_level=None, timeout=30).execute('VACUUM')
+        seconds, slowest = write_while(fn, path)
+        sqlite3.connect(path).execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        size_after = os.path.getsize(path)
+        print(f'{label:>12} {size_before / 2 ** 20:>10.1f} {size_after / 2 ** 20:>10.1f} {seconds:>8.2f} {slowest * 1000:>17.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+'''Times master list loading for growing lists.
+
+The full grid (`get_master_list`) should cost roughly constant time per cell (linear scaling), and a page of the view route should cost the same however big the list is and however deep the page.
+
+Run with `python -m benchmarks.bench_master_list_view`.'''
+from incontext.db import get_db
+from incontext.master_lists import get_master_list
+
+from benchmarks.common import best_of, login, make_app, seed_master_list
+
+DETAIL_COUNT = 20
+ITEM_COUNTS = (250, 500, 1000, 2000, 8000)
+
+
+def main():
+    app = make_app()
+    with app.app_context():
+        db = get_db()
+        master_list_ids = {item_count: seed_master_list(db, item_count, DETAIL_COUNT) for item_count in ITEM_COUNTS}
+    client = login(app.test_client())
+    print(f'{"items":>8} {"cells":>8} {"grid ms":>10} {"us/cell":>10} {"page 1 ms":>10} {"last page ms":>13}')
+    for item_count, master_list_id in master_list_ids.items():
+        with app.app_context():
+            grid_seconds = best_of(lambda: get_master_list(master_list_id, check_access=False))
+        first_page = f'/master-lists/{master_list_id}/view'
+        with app.app_context():
+            last_item_id = get_db().execute(
+                'SELECT MAX(master_item_id) FROM master_list_item_relations WHERE master_list_id = ?',
+                (master_list_id,)
+            ).fetchone()[0]
+        last_page = f'{first_page}?after={last_item_id - 50}'
+        assert client.get(first_page).status_code == 200
+        first_page_seconds = best_of(lambda: client.get(first_page))
+        last_page_seconds = best_of(lambda: client.get(last_page))
+        cells = item_count * DETAIL_COUNT
+        print(
+            f'{item_count:>8} {cells:>8} {grid_seconds * 1000:>10.1f} {grid_seconds * 1e6 / cells:>10.2f}'
+            f' {first_page_seconds * 1000:>10.1f} {last_page_seconds * 1000:>13.1f}'
+        )
+
+
+if __name__ == '__main__':
+    main()
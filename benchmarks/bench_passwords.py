@@ -0,0 +1,60 @@
+'''Times the home page while threads log in over and over, with passwords hashed in the web process and in the hashing pool.
+
+Run with `python -m benchmarks.bench_passwords`.'''
+import statistics
+import threading
+import time
+
+from incontext.db import get_db
+from incontext.passwords import get_password_hasher, make_password_hash
+
+from benchmarks.common import BENCH_PASSWORD, login, make_app
+
+LOGIN_THREADS = 4
+DURATION = 5.0 # seconds per run
+
+
+def main():
+    print(f'{"":>8} {"logins/s":>9} {"page p50 ms":>12} {"page p99 ms":>12} {"503s":>5}')
+    for label, workers in (('inline', 0), ('pool', 2)):
+        app = make_app(PASSWORD_HASH_WORKERS=workers, LOGIN_THROTTLE={}) # the storm is the point
+        with app.app_context():
+            db = get_db()
+            db.execute("UPDATE users SET password = ? WHERE username = 'bench'", (make_password_hash(BENCH_PASSWORD),))
+            db.commit()
+        page_client = login(app.test_client())
+        page_client.get('/')
+        done = threading.Event()
+        statuses = []
+
+        def log_in():
+            client = app.test_client()
+            while not done.is_set():
+                statuses.append(
+                    client.post('/auth/login', data={'username': 'bench', 'password': BENCH_PASSWORD}).status_code
+                )
+
+        threads = [threading.Thread(target=log_in) for _ in range(LOGIN_THREADS)]
+        for thread in threads:
+            thread.start()
+        latencies = []
+        end = time.perf_counter() + DURATION
+        while time.perf_counter() < end:
+            start = time.perf_counter()
+            page_client.get('/')
+            latencies.append(time.perf_counter() - start)
+            time.sleep(0.01)
+        done.set()
+        for thread in threads:
+            thread.join()
+        with app.app_context():
+            get_password_hasher().shutdown()
+        p99 = statistics.quantiles(latencies, n=100)[98]
+        print(
+            f'{label:>8} {statuses.count(302) / DURATION:>9.1f} {statistics.median(latencies) * 1000:>12.1f}'
+            f' {p99 * 1000:>12.1f} {statuses.count(503):>5}'
+        )
+
+
+if __name__ == '__main__':
+    main()
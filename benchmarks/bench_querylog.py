@@ -0,0 +1,43 @@
+'''Times master list pages with SQL logging off, with only the slow query threshold timing statements (as every request does by default), and with every request sampled for the query log.
+
+Run with `python -m benchmarks.bench_querylog`.'''
+from incontext.db import get_db
+
+from benchmarks.common import best_of, login, make_app, seed_master_list
+
+ITEM_COUNT = 10000
+DETAIL_COUNT = 10
+CONFIGS = (
+    ('off', {'QUERY_LOG_SAMPLE_RATE': 0, 'SLOW_QUERY_THRESHOLD': None}),
+    ('slow log', {'QUERY_LOG_SAMPLE_RATE': 0}),
+    ('sampled', {'QUERY_LOG_SAMPLE_RATE': 1}),
+)
+
+
+def main():
+    print(f'{"page":>12}' + ''.join(f' {label + " ms":>12}' for label, _ in CONFIGS))
+    results = {}
+    for label, config in CONFIGS:
+        app = make_app(**config)
+        with app.app_context():
+            db = get_db()
+            master_list_id = seed_master_list(db, ITEM_COUNT, DETAIL_COUNT)
+            master_item_id = db.execute(
+                'SELECT MIN(master_item_id) FROM master_list_item_relations WHERE master_list_id = ?', (master_list_id,)
+            ).fetchone()[0]
+        pages = (
+            ('list', f'/master-lists/{master_list_id}/view'),
+            ('list, 1000', f'/master-lists/{master_list_id}/view?limit=1000'),
+            ('item', f'/master-lists/{master_list_id}/master-items/{master_item_id}/view'),
+            ('search', f'/master-lists/{master_list_id}/search?q=item'),
+        )
+        client = login(app.test_client())
+        for page, url in pages:
+            assert client.get(url).status_code == 200
+            results[page, label] = best_of(lambda: client.get(url))
+    for page, _ in pages:
+        print(f'{page:>12}' + ''.join(f' {results[page, label] * 1000:>12.2f}' for label, _ in CONFIGS))
+
+
+if __name__ == '__main__':
+    main()
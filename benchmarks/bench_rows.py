@@ -0,0 +1,81 @@
+'''Fetches 100k master items and builds the master list grid from them, the way the list view does, comparing timestamps parsed as rows are fetched (`PARSE_DECLTYPES`) and rows copied into dicts with rows that parse timestamps only when read and grid rows that wrap them.
+
+Only the first 100 items' dates are read, like a page of the view shows. Prints the time and the peak memory allocated (by `tracemalloc`, which slows both runs down alike; the times are taken without it).
+
+Run with `python -m benchmarks.bench_rows`.'''
+import sqlite3
+import tracemalloc
+from datetime import datetime
+
+from incontext.db import Row, get_db
+from incontext.master_lists import build_master_grid
+
+from benchmarks.common import best_of, make_app, seed_master_list
+
+ITEM_COUNT = 100000
+DETAIL_COUNT = 1
+READ_DATES = 100
+
+
+def build_grid_with_dicts(master_items, master_details, master_contents):
+    '''`build_master_grid` as it was: a dict per item.'''
+    columns = {master_detail['id']: column for column, master_detail in enumerate(master_details)}
+    rows = {}
+    grid = []
+    for master_item in master_items:
+        row = dict(master_item)
+        row['master_contents'] = [''] * len(columns)
+        rows[row['id']] = row
+        grid.append(row)
+    for master_content in master_contents:
+        row = rows.get(master_content['master_item_id'])
+        column = columns.get(master_content['master_detail_id'])
+        if row is not None and column is not None:
+            row['master_contents'][column] = master_content['master_content']
+    return grid
+
+
+def run(path, master_list_id, detect_types, row_factory, build_grid):
+    db = sqlite3.connect(path, detect_types=detect_types)
+    db.row_factory = row_factory
+    master_details = db.execute(
+        'SELECT master_detail_id AS id FROM master_list_detail_relations WHERE master_list_id = ?', (master_list_id,)
+    ).fetchall()
+    master_items = db.execute(
+        'SELECT i.id, i.name, i.created FROM master_items i'
+        ' JOIN master_list_item_relations m ON m.master_item_id = i.id'
+        ' WHERE m.master_list_id = ?',
+        (master_list_id,)
+    ).fetchall()
+    master_contents = db.execute(
+        'SELECT master_item_id, master_detail_id, master_content FROM master_item_detail_relations'
+    )
+    grid = build_grid(master_items, master_details, master_contents)
+    for row in grid[:READ_DATES]:
+        row['created'].strftime('%d.%m.%Y')
+    db.close()
+
+
+def main():
+    app = make_app()
+    with app.app_context():
+        master_list_id = seed_master_list(get_db(), ITEM_COUNT, DETAIL_COUNT)
+    path = app.config['DATABASE']
+    sqlite3.register_converter('timestamp', lambda v: datetime.fromisoformat(v.decode()))
+    runs = (
+        ('parsed on fetch, dicts', (sqlite3.PARSE_DECLTYPES, sqlite3.Row, build_grid_with_dicts)),
+        ('parsed when read, grid rows', (0, Row, build_master_grid)),
+    )
+    print(f'{ITEM_COUNT} items')
+    print(f'{"":>28} {"ms":>8} {"peak MiB":>9}')
+    for label, args in runs:
+        cpu = best_of(lambda: run(path, master_list_id, *args), repeat=3)
+        tracemalloc.start()
+        run(path, master_list_id, *args)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f'{label:>28} {cpu * 1000:>8.1f} {peak / 2 ** 20:>9.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+'''Times master list full-text searches on a list of a million cells.
+
+Run with `python -m benchmarks.bench_search`.'''
+import itertools
+import random
+
+from incontext.db import get_db
+from incontext.master_lists import search_master_list
+
+from benchmarks.common import best_of, make_app, seed_master_list
+
+ITEM_COUNT = 50000
+DETAIL_COUNT = 20
+WORDS = [f'w{n}' for n in range(20000)]
+QUERIES = (
+    ('rare word', 'w19999'),
+    ('two words', 'w17 w42'),
+    ('prefix', 'w1999'),
+    ('common prefix', 'w10'),
+    ('common word', 'w0'),
+)
+
+
+def main():
+    rng = random.Random(0)
+    # word frequencies follow a rough Zipf curve, like real text
+    cum_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(WORDS))))
+    app = make_app()
+    with app.app_context():
+        db = get_db()
+        master_list_id = seed_master_list(
+            db, ITEM_COUNT, DETAIL_COUNT,
+            content=lambda item_id, detail_id: ' '.join(rng.choices(WORDS, cum_weights=cum_weights, k=4))
+        )
+        print(f'{ITEM_COUNT * DETAIL_COUNT} cells')
+        print(f'{"query":>14} {"hits":>8} {"ms":>8}')
+        for label, q in QUERIES:
+            hits, hit_count = search_master_list(master_list_id, q, 20)
+            seconds = best_of(lambda: search_master_list(master_list_id, q, 20))
+            print(f'{label:>14} {hit_count:>8} {seconds * 1000:>8.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+'''Compares new-agent writes per second from concurrent users, all writing to the one database, against each writing to their own tenant database.
+
+Runs with `synchronous=FULL`, so every commit waits for an fsync while holding its database's write lock, which is what tenants stop sharing.
+
+Run with `python -m benchmarks.bench_tenants`.'''
+import threading
+import time
+
+from werkzeug.security import generate_password_hash
+
+from incontext.db import get_db
+
+from benchmarks.common import make_app
+
+USER_COUNTS = (1, 4, 16)
+DURATION = 3.0 # seconds per run
+PRAGMAS = {'journal_mode': 'WAL', 'synchronous': 'FULL', 'busy_timeout': 5000}
+PASSWORD_HASH = generate_password_hash('user', method='pbkdf2:sha256:1')
+FORM = {'name': 'agent', 'description': '', 'model_id': '1', 'role': 'role', 'instructions': 'instructions'}
+
+
+def main():
+    print(f'{"":>10} {"users":>6} {"writes/s":>9}')
+    for label, tenants in (('one file', False), ('tenants', True)):
+        for user_count in USER_COUNTS:
+            app = make_app(DATABASE_PRAGMAS=PRAGMAS)
+            with app.app_context():
+                db = get_db()
+                db.executemany(
+                    'INSERT INTO users (username, password) VALUES (?, ?)',
+                    ((f'user {n}', PASSWORD_HASH) for n in range(user_count))
+                )
+                db.commit()
+            app.config['DATABASE_TENANTS'] = tenants
+            counts = []
+
+            def write(n):
+                client = app.test_client()
+                client.post('/auth/login', data={'username': f'user {n}', 'password': 'user'})
+                count = 0
+                end = time.perf_counter() + DURATION
+                while time.perf_counter() < end:
+                    assert client.post('/agents/new', data=FORM).status_code == 302
+                    count += 1
+                counts.append(count)
+
+            threads = [threading.Thread(target=write, args=(n,)) for n in range(user_count)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            print(f'{label:>10} {user_count:>6} {sum(counts) / DURATION:>9.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+'''Runs several worker processes against one database, like gunicorn workers, each mixing item views with item edits, and counts the requests that fail with "database is locked".
+
+Run with `python -m benchmarks.bench_write_contention`.'''
+import multiprocessing
+import sqlite3
+import time
+
+from incontext import create_app
+from incontext.db import get_db
+
+from benchmarks.common import login, make_app, seed_master_list
+
+WORKER_COUNTS = (1, 4, 8)
+WAL = {'journal_mode': 'WAL', 'synchronous': 'NORMAL'}
+CONFIGS = (
+    # without waiting for locks at all, to show what the retries alone do
+    ('WAL, no waits', {'DATABASE_PRAGMAS': WAL | {'busy_timeout': 0}, 'DATABASE_WRITE_RETRIES': 0}),
+    ('WAL, backoff only', {'DATABASE_PRAGMAS': WAL | {'busy_timeout': 0}}),
+    ('rollback journal', {'DATABASE_PRAGMAS': {'journal_mode': 'DELETE', 'busy_timeout': 100}}),
+    ('WAL', {'DATABASE_PRAGMAS': WAL | {'busy_timeout': 100}}),
+)
+DURATION = 3.0 # seconds per run
+READS_PER_WRITE = 4
+
+
+def work(config, master_list_id, master_item_id, form, results):
+    app = create_app(config)
+    client = login(app.test_client())
+    item_url = f'/master-lists/{master_list_id}/master-items/{master_item_id}'
+    counts = {'reads': 0, 'writes': 0, 'failed': 0}
+    end = time.perf_counter() + DURATION
+    n = 0
+    while time.perf_counter() < end:
+        n += 1
+        write = n % (READS_PER_WRITE + 1) == 0
+        try:
+            if write:
+                client.post(f'{item_url}/edit', data=form)
+            else:
+                client.get(f'{item_url}/view')
+            counts['writes' if write else 'reads'] += 1
+        except sqlite3.OperationalError:
+            counts['failed'] += 1
+    results.put(counts)
+
+
+def main():
+    print(f'{"":>18} {"workers":>8} {"reads/s":>9} {"writes/s":>9} {"failed":>7}')
+    for label, config in CONFIGS:
+        app = make_app(**config)
+        with app.app_context():
+            db = get_db()
+            master_list_id = seed_master_list(db, 1000, 10)
+            master_item_id = db.execute(
+                'SELECT MIN(master_item_id) FROM master_list_item_relations WHERE master_list_id = ?', (master_list_id,)
+            ).fetchone()[0]
+            form = {'name': 'edited', **{
+                str(row[0]): 'edited' for row in db.execute(
+                    'SELECT master_detail_id FROM master_list_detail_relations WHERE master_list_id = ?', (master_list_id,)
+                )
+            }}
+        worker_config = {key: app.config[key] for key in ('TESTING', 'DATABASE', 'AGENT_MODELS')} | config
+        for worker_count in WORKER_COUNTS:
+            results = multiprocessing.Queue()
+            workers = [
+                multiprocessing.Process(target=work, args=(worker_config, master_list_id, master_item_id, form, results))
+                for _ in range(worker_count)
+            ]
+            for worker in workers:
+                worker.start()
+            totals = {'reads': 0, 'writes': 0, 'failed': 0}
+            for _ in workers:
+                for key, count in results.get().items():
+                    totals[key] += count
+            for worker in workers:
+                worker.join()
+            print(
+                f'{label:>18} {worker_count:>8} {totals["reads"] / DURATION:>9.0f}'
+                f' {totals["writes"] / DURATION:>9.0f} {totals["failed"]:>7}'
+            )
+
+
+if __name__ == '__main__':
+    main()
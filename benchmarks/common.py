@@ -0,0 +1,90 @@
+'''Shared setup for the benchmarks: a throwaway app on a temp database, bulk seeding, and timing.'''
+import os
+import tempfile
+import time
+
+from werkzeug.security import generate_password_hash
+
+from incontext import create_app
+from incontext.db import get_db, init_db
+
+BENCH_PASSWORD = 'bench'
+AGENT_MODELS = [
+    ('Provider', 'provider', f'Model {n}', f'model-{n}', f'Model {n} description') for n in range(1, 4)
+]
+
+
+def make_app(**config):
+    '''Creates an app on a fresh database in a temp dir, with a `bench` admin user (id 2).'''
+    os.environ.setdefault('IC_ADMIN_PW', generate_password_hash('admin'))
+    tmpdir = tempfile.mkdtemp(prefix='incontext-bench-')
+    app = create_app({
+        'TESTING': True,
+        'DATABASE': os.path.join(tmpdir, 'bench.sqlite'),
+        'AGENT_MODELS': AGENT_MODELS,
+        'SLOW_QUERY_LOG': os.path.join(tmpdir, 'slow-queries.log'),
+        'DATABASE_TENANT_DIR': os.path.join(tmpdir, 'tenants'),
+        'LOGIN_THROTTLE_DATABASE': os.path.join(tmpdir, 'throttle.sqlite'),
+        **config,
+    })
+    with app.app_context():
+        init_db()
+        db = get_db()
+        db.execute(
+            'INSERT INTO users (username, password, admin) VALUES (?, ?, ?)',
+            ('bench', generate_password_hash(BENCH_PASSWORD), True)
+        )
+        db.commit()
+    return app
+
+
+def login(client):
+    client.post('/auth/login', data={'username': 'bench', 'password': BENCH_PASSWORD})
+    return client
+
+
+def seed_master_list(db, item_count, detail_count, creator_id=2, content=None):
+    '''Inserts a master list with `item_count` items and `detail_count` details, every cell filled (by `content(item_id, detail_id)` if given). Returns the list id.'''
+    content = content or (lambda item_id, detail_id: f'{item_id}/{detail_id}')
+    cur = db.execute(
+        'INSERT INTO master_lists (creator_id, name, description) VALUES (?, ?, ?)',
+        (creator_id, f'bench list {item_count}x{detail_count}', 'benchmark data')
+    )
+    master_list_id = cur.lastrowid
+    first_item_id = (db.execute('SELECT COALESCE(MAX(id), 0) FROM master_items').fetchone()[0]) + 1
+    first_detail_id = (db.execute('SELECT COALESCE(MAX(id), 0) FROM master_details').fetchone()[0]) + 1
+    item_ids = range(first_item_id, first_item_id + item_count)
+    detail_ids = range(first_detail_id, first_detail_id + detail_count)
+    db.executemany(
+        'INSERT INTO master_details (id, creator_id, name, description) VALUES (?, ?, ?, ?)',
+        ((detail_id, creator_id, f'detail {detail_id}', '') for detail_id in detail_ids)
+    )
+    db.executemany(
+        'INSERT INTO master_list_detail_relations (master_list_id, master_detail_id) VALUES (?, ?)',
+        ((master_list_id, detail_id) for detail_id in detail_ids)
+    )
+    db.executemany(
+        'INSERT INTO master_items (id, creator_id, name) VALUES (?, ?, ?)',
+        ((item_id, creator_id, f'item {item_id}') for item_id in item_ids)
+    )
+    db.executemany(
+        'INSERT INTO master_list_item_relations (master_list_id, master_item_id) VALUES (?, ?)',
+        ((master_list_id, item_id) for item_id in item_ids)
+    )
+    # details in reverse so that cell rowids don't follow column order
+    db.executemany(
+        'INSERT INTO master_item_detail_relations (master_item_id, master_detail_id, master_content) VALUES (?, ?, ?)',
+        ((item_id, detail_id, content(item_id, detail_id)) for item_id in item_ids for detail_id in reversed(detail_ids))
+    )
+    db.commit()
+    return master_list_id
+
+
+def best_of(fn, repeat=5):
+    '''Returns the fastest of `repeat` runs of `fn`, in seconds.'''
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
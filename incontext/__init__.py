@@ -13,6 +13,58 @@ def create_app(test_config=None):
     app.config.from_mapping( # sets some default configuration.
         SECRET_KEY='dev', # used by Flask and extensions to keep data safe. should be overridden with a random valye when deploying.
         DATABASE=os.path.join(app.instance_path, 'incontext.sqlite'), # the path where the sqlite database will be saved. `app.instance_path` is the path that Flask has chosen for the instance folder.
+        DATABASE_REUSE_CONNECTIONS=True, # keep one connection per worker thread open between requests instead of reconnecting for each.
+        DATABASE_PRAGMAS={ # applied in order to every new connection.
+            'journal_mode': 'WAL', # readers don't block the writer, nor the writer readers.
+            'synchronous': 'NORMAL', # safe with WAL; syncs on checkpoints instead of every commit.
+            'cache_size': -16000, # page cache per connection, in KiB (negative) or pages.
+            'mmap_size': 128 * 1024 * 1024, # read the database through memory mapped I/O.
+            'temp_store': 'MEMORY', # temp b-trees for sorts and subqueries stay in memory.
+            'busy_timeout': 5000, # ms to wait for a lock before failing with "database is locked".
+        },
+        DATABASE_WRITE_RETRIES=5, # times a writer tries again to take the write lock after `busy_timeout` ran out.
+        DATABASE_WRITE_BACKOFF=0.05, # seconds to wait before the first retry, doubling each time.
+        DATABASE_GROUP_COMMIT=False, # commit the writes of concurrent requests together, from one writer thread per process.
+        DATABASE_GROUP_COMMIT_WINDOW=0.002, # seconds a group commit waits for more writes after the first.
+        DATABASE_GROUP_COMMIT_MAX_BATCH=100, # writes committed together at most.
+        DATABASE_TENANTS=False, # keep each user's agents and tethered agents in a database of their own. Run `flask split-tenants` after turning it on.
+        DATABASE_TENANT_DIR=os.path.join(app.instance_path, 'tenants'), # where the tenant databases are, named by user id.
+        DATABASE_TENANT_IDLE=8, # tenant connections kept open per worker thread.
+        QUERY_LOG_SAMPLE_RATE=0.01, # share of requests whose SQL statements are timed and counted, reported in a `Server-Timing` header.
+        QUERY_LOG_REPEAT_THRESHOLD=3, # executions of the same statement within a sampled request that get it logged as repeated.
+        BACKUP_DIR=os.path.join(app.instance_path, 'backups'), # where `flask backup` puts its backups, one folder each.
+        BACKUP_PAGES_PER_STEP=256, # pages a backup copies while holding a read lock, before letting go of it.
+        BACKUP_STEP_SLEEP=0.005, # seconds a backup pauses between steps.
+        BACKUP_MAX_RESTARTS=3, # times a backup in rollback journal mode starts over because of writes. The last time, it copies everything in one step.
+        BACKUP_COMPRESS=False, # gzip backups.
+        BACKUP_KEEP=7, # backups kept, the oldest are removed.
+        MAINTENANCE_INTERVAL=None, # seconds between the `flask db-maintain` runs each worker process does in the background. `None` leaves it to cron.
+        MAINTENANCE_STAMP=os.path.join(app.instance_path, 'maintenance.stamp'), # touched by every background run, so other processes know it's done.
+        MAINTENANCE_TIME_LIMIT=10, # seconds after which a maintenance run stops starting new slices. The next one picks up from there.
+        MAINTENANCE_VACUUM_PAGES=512, # free pages given back per slice of incremental vacuum.
+        MAINTENANCE_SLEEP=0.05, # seconds a maintenance run pauses between slices.
+        MAINTENANCE_ANALYSIS_LIMIT=1000, # rows ANALYZE samples per index.
+        MAINTENANCE_PLANS=20, # statements from the slow query log whose plans are compared before and after ANALYZE.
+        SLOW_QUERY_THRESHOLD=0.1, # seconds after which a statement is written to the slow query log, with its query plan. `None` turns it off.
+        SLOW_QUERY_LOG=os.path.join(app.instance_path, 'slow-queries.log'), # lines of JSON, summarized by `flask slow-queries`.
+        SLOW_QUERY_LOG_MAX_BYTES=1024 * 1024, # size at which the slow query log is rotated.
+        SLOW_QUERY_LOG_BACKUPS=5, # rotated slow query logs kept.
+        PASSWORD_HASH_METHOD='scrypt:32768:8:1', # werkzeug's hash method and cost, spelled out as it's stored. Passwords hashed otherwise are rehashed on login.
+        PASSWORD_HASH_WORKERS=2, # processes that hash passwords. 0 hashes them in the web worker itself.
+        PASSWORD_HASH_QUEUE=32, # hashes waiting or running at once per web worker process, beyond which a login gets a 503.
+        PASSWORD_HASH_TIMEOUT=5, # seconds a login waits for its hash before giving up with a 503.
+        PASSWORD_HASH_NICE=10, # how much lower the hashing processes' CPU priority is.
+        LOGIN_THROTTLE={ # token buckets limiting login (and register) attempts: (tokens per second, bucket size) for each kind of key.
+            'ip': (0.2, 20), # per client address.
+            'username': (1 / 60, 5), # per username tried, from any address.
+        },
+        LOGIN_THROTTLE_DATABASE=os.path.join(app.instance_path, 'throttle.sqlite'), # where the buckets are, shared by the worker processes.
+        API_TOKEN_KEY=None, # key of the hashes of api token secrets. Defaults to the `SECRET_KEY`; changing it revokes all tokens.
+        API_TOKEN_TOUCH_INTERVAL=60, # seconds between updates of a token's last used time.
+        USER_CACHE_TTL=60, # seconds a worker process keeps a logged in user's record before reading it again. 0 reads it on every request.
+        MASTER_ITEMS_PER_PAGE=100, # default number of items per page on the master list view.
+        MASTER_ITEMS_MAX_PER_PAGE=1000, # upper bound for the `limit` query parameter.
+        SEARCH_RESULTS_PER_PAGE=20, # number of hits per page of a master list search.
     )
 
     if test_config is None:
@@ -31,6 +83,21 @@ def create_app(test_config=None):
     from . import db
     db.init_app(app) # calling the function to register a couple of database-related things with the app
 
+    from . import querylog
+    querylog.init_app(app) # samples requests for SQL statistics.
+
+    from . import backup
+    backup.init_app(app) # registers the `backup` command.
+
+    from . import maintenance
+    maintenance.init_app(app) # registers the `db-maintain` command, and runs it in the background if configured.
+
+    from . import passwords
+    passwords.init_app(app) # logins that can't get their password hashed in time get a 503.
+
+    from . import throttle
+    throttle.init_app(app) # the token buckets of login attempts.
+
     from . import auth
     app.register_blueprint(auth.bp) # has views for login, register, and logout.
 
@@ -47,4 +114,7 @@ def create_app(test_config=None):
     from . import agents
     app.register_blueprint(agents.bp)
 
+    from . import metrics
+    metrics.init_app(app) # counters, like those of write retries, and their view for admins.
+
     return app
@@ -3,8 +3,8 @@ from flask import (
 )
 from werkzeug.exceptions import abort
 
-from incontext.auth import login_required
-from incontext.db import get_db
+from incontext.auth import get_owned_row, login_required
+from incontext.db import get_tenant_db, run_write
 from incontext.master_agents import get_agent_models
 from incontext.master_agents import get_master_agent
 from incontext.master_agents import get_master_agents
@@ -40,13 +40,12 @@ def new():
         if error is not None:
             flash(error)
         else:
-            db = get_db()
-            db.execute(
+            creator_id = g.user['id']
+            run_write(lambda db: db.execute(
                 'INSERT INTO agents (name, description, model_id, role, instructions, creator_id)'
                 ' VALUES (?, ?, ?, ?, ?, ?)',
-                (name, description, model_id, role, instructions, g.user['id'])
-            )
-            db.commit()
+                (name, description, model_id, role, instructions, creator_id)
+            ), tenant=True)
             return redirect(url_for('agents.index'))
     return render_template('agents/new.html', agent_models=agent_models)
 
@@ -56,13 +55,12 @@ def new():
 def new_tethered():
     if request.method == "POST":
         requested_master_agent = get_master_agent(request.form["master_agent_id"], False)
-        db = get_db()
-        db.execute(
+        creator_id, master_agent_id = g.user['id'], request.form["master_agent_id"]
+        run_write(lambda db: db.execute(
             "INSERT INTO tethered_agents (creator_id, master_agent_id)"
             " VALUES (?, ?)",
-            (g.user["id"], request.form["master_agent_id"])
-        )
-        db.commit()
+            (creator_id, master_agent_id)
+        ), tenant=True)
         return redirect(url_for("agents.index"))
     master_agents = get_master_agents()
     return render_template("agents/new_tethered.html", master_agents=master_agents)
@@ -98,14 +96,12 @@ def edit(agent_id):
         if error is not None:
             flash(error)
         else:
-            db = get_db()
-            db.execute(
+            run_write(lambda db: db.execute(
                 "UPDATE agents"
                 " SET name = ?, description = ?, model_id = ?, role = ?, instructions = ?"
                 " WHERE id = ?",
                 (name, description, model_id, role, instructions, agent_id)
-            )
-            db.commit()
+            ), tenant=True)
             return redirect(url_for('agents.index'))
     return render_template("agents/edit.html", agent=agent, agent_models=agent_models)
 
@@ -114,9 +110,7 @@ def edit(agent_id):
 @login_required
 def delete(agent_id):
     agent = get_agent(agent_id)
-    db = get_db()
-    db.execute("DELETE FROM agents WHERE id = ?", (agent_id,))
-    db.commit()
+    run_write(lambda db: db.execute("DELETE FROM agents WHERE id = ?", (agent_id,)), tenant=True)
     return redirect(url_for('agents.index'))
 
 
@@ -124,14 +118,12 @@ def delete(agent_id):
 @login_required
 def delete_tethered(tethered_agent_id):
     tethered_agent = get_tethered_agent(tethered_agent_id)
-    db = get_db()
-    db.execute("DELETE FROM tethered_agents WHERE id = ?", (tethered_agent_id,))
-    db.commit()
+    run_write(lambda db: db.execute("DELETE FROM tethered_agents WHERE id = ?", (tethered_agent_id,)), tenant=True)
     return redirect(url_for('agents.index'))
 
 
 def get_agents():
-    db = get_db()
+    db = get_tenant_db()
     agents = db.execute(
         'SELECT a.id, a.creator_id, a.created, a.name, a.description, a.model_id, a.role, a.instructions, u.username'
         ' FROM agents a JOIN users u ON a.creator_id = u.id'
@@ -150,7 +142,8 @@ def get_agents():
 
 
 def get_agent(agent_id, check_access=True):
-    db = get_db()
+    get_owned_row('agents', agent_id, check_access=check_access)
+    db = get_tenant_db()
     agent = db.execute(
         'SELECT a.id, a.creator_id, a.created, a.name, a.description, a.model_id, a.role, a.instructions, m.model_name, m.provider_name, u.username'
         ' FROM agents a'
@@ -159,25 +152,10 @@ def get_agent(agent_id, check_access=True):
         ' WHERE a.id = ?',
         (agent_id,)
     ).fetchone()
-    if agent is None:
+    if agent is None: # deleted since
         abort(404)
-    if check_access:
-        if agent['creator_id'] != g.user['id']:
-            abort(403)
     return agent
 
 
 def get_tethered_agent(tethered_agent_id, check_access=True):
-    db = get_db()
-    tethered_agent = db.execute(
-        'SELECT ta.creator_id'
-        ' FROM tethered_agents ta'
-        ' WHERE ta.id = ?',
-        (tethered_agent_id,)
-    ).fetchone()
-    if tethered_agent is None:
-        abort(404)
-    if check_access:
-        if tethered_agent['creator_id'] != g.user['id']:
-            abort(403)
-    return tethered_agent
+    return get_owned_row('tethered_agents', tethered_agent_id, check_access=check_access)
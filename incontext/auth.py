@@ -1,15 +1,63 @@
 import functools
+import threading
+import time
 
 from flask import (
-    Blueprint, flash, g, redirect, render_template, request, session, url_for
+    Blueprint, current_app, flash, g, redirect, render_template, request, session, url_for
 )
-from werkzeug.security import check_password_hash, generate_password_hash
-from werkzeug.exceptions import abort
+from werkzeug.datastructures import WWWAuthenticate
+from werkzeug.exceptions import Unauthorized, abort
 
-from incontext.db import get_db
+from incontext.db import READ_ONLY_METHODS, get_db, get_tenant_db, run_write
+from incontext.passwords import make_password_hash, verify_password
+from incontext.throttle import Throttled, throttle
+from incontext.tokens import SCOPES, check_token, create_token, get_tokens, revoke_token
 
 bp = Blueprint('auth', __name__, url_prefix='/auth') # creates a blueprint named `'auth'`. It's passed `__name__` to know where it's defined. The `url_prefix` will be prepended to all URLs associated with the bp.
 
+USER_COLUMNS = 'id, username, admin' # what requests need of the logged in user. Not the password hash.
+USER_CACHE_MAX = 10000 # users cached per process, before the cache starts over.
+OWNED_TABLES = {'master_lists': False, 'master_agents': False, 'agents': True, 'tethered_agents': True} # tables with a `creator_id`, and whether they're in the tenant databases.
+
+
+class UserCache:
+    '''The logged in users of this worker process, by id, each kept for `USER_CACHE_TTL` seconds. A change to a user shows right away in the process that calls `invalidate_user`, and in the others once their copy expires.'''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.users = {}
+
+    def get(self, user_id, ttl):
+        now = time.monotonic()
+        with self.lock:
+            cached = self.users.get(user_id)
+        if cached is not None and cached[0] > now:
+            return cached[1]
+        user = get_db().execute(f'SELECT {USER_COLUMNS} FROM users WHERE id = ?', (user_id,)).fetchone()
+        user = None if user is None else dict(user) # a deleted user is cached too, as no one
+        with self.lock:
+            if len(self.users) >= USER_CACHE_MAX:
+                self.users.clear()
+            self.users[user_id] = (now + ttl, user)
+        return user
+
+    def invalidate(self, user_id):
+        with self.lock:
+            self.users.pop(user_id, None)
+
+
+bp.record_once(lambda state: state.app.extensions.setdefault('incontext.users', UserCache())) # one cache per app, made when the bp is registered.
+
+
+def invalidate_user(user_id):
+    '''Drops the cached record of a user whose username or admin flag changed, so the next request reads it again.'''
+    current_app.extensions['incontext.users'].invalidate(user_id)
+
+
+def without_user(view): # decorator for views that don't use `g.user`, so it isn't loaded for them.
+    view.needs_user = False
+    return view
+
+
 @bp.route('/register', methods=('GET', 'POST')) # associates the url `/register` with the `register` view function. So the function `register` will be called when Flask receives a request to `/auth/register`.
 def register():
     if request.method == 'POST':
@@ -25,10 +73,15 @@ def register():
 
         if error is None:
             try:
-                db.execute(
-                    'INSERT INTO users (username, password) VALUES (?, ?)', (username, generate_password_hash(password)),
-                )
-                db.commit()
+                throttle(ip=request.remote_addr) # hashing a new password costs as much as checking one.
+            except Throttled as e:
+                flash('Too many attempts. Please try again later.')
+                return render_template('auth/register.html'), 429, {'Retry-After': str(e.retry_after)}
+            try:
+                password_hash = make_password_hash(password) # in the hashing pool, which may turn this into a 503 when it's overloaded.
+                run_write(lambda db: db.execute(
+                    'INSERT INTO users (username, password) VALUES (?, ?)', (username, password_hash),
+                ))
             except db.IntegrityError: # this will occur if the username already exists. (username column has a uniqueness constraint.)
                 error = f'User {username} is already registered.'
             else:
@@ -43,6 +96,11 @@ def login():
     if request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
+        try:
+            throttle(ip=request.remote_addr, username=username) # before anything costly. `remote_addr` is the client's, as `ProxyFix` resolved it.
+        except Throttled as e:
+            flash('Too many login attempts. Please try again later.')
+            return render_template('auth/login.html'), 429, {'Retry-After': str(e.retry_after)}
         db = get_db()
         error = None
         user = db.execute(
@@ -51,11 +109,19 @@ def login():
 
         if user is None:
             error = 'Incorrect username.'
-        elif not check_password_hash(user['password'], password): # hashes the submitted password and and securely compares it with the stored password.
-            error = 'Incorrect password.'
+        else:
+            matches, new_hash = verify_password(user['password'], password) # hashes the submitted password and and securely compares it with the stored password.
+            if not matches:
+                error = 'Incorrect password.'
+            elif new_hash is not None: # hashed with an older method or cost. upgrade it while the password is at hand.
+                run_write(lambda db: db.execute(
+                    'UPDATE users SET password = ? WHERE id = ? AND password = ?', # unless it changed in the meantime
+                    (new_hash, user['id'], user['password'])
+                ))
 
         if error is None:
             session.clear() # session is a dict that stores data across requests. 
+            invalidate_user(user['id']) # logging in again is a sure way to see one's changes.
             session['user_id'] = user['id'] # the user's id is stored in a new session. The data is stored in a cookie that is sent to the browser, and the browser then sends it back with subsequent requests. Flask securely signs the data so that it can't be tampered with.
             return redirect(url_for('index')) # now that the user's id is stored in session, it'll be available on subsequent requests. at the beginning of each request, if a user is logged in their info should be loaded and made available to other views.
 
@@ -66,16 +132,27 @@ def login():
 @bp.before_app_request # registers a function that runs before the view function no matter what URL was requested.
 def load_logged_in_user():
     user_id = session.get('user_id')
+    view = current_app.view_functions.get(request.endpoint)
+    g.token_scopes = None # set for requests authenticated by an api token instead of the session.
+
+    if request.authorization is not None and request.authorization.type == 'bearer': # `Authorization: Bearer ic_...`, from scripts.
+        checked = check_token(request.authorization.token or '')
+        if checked is None:
+            raise Unauthorized('Invalid or expired token.', www_authenticate=WWWAuthenticate('bearer'))
+        user_id, g.token_scopes = checked
+        if ('read' if request.method in READ_ONLY_METHODS else 'write') not in g.token_scopes:
+            abort(403)
 
-    if user_id is None:
+    if user_id is None or request.endpoint == 'static' or not getattr(view, 'needs_user', True):
         g.user = None
     else:
-        g.user = get_db().execute(
-            'SELECT * FROM users WHERE id = ?', (user_id,)
-        ).fetchone() # g.user lasts for the lasts for the length of the request.
+        g.user = current_app.extensions['incontext.users'].get(
+            user_id, current_app.config['USER_CACHE_TTL']
+        ) # g.user lasts for the lasts for the length of the request. it's a dict of the `USER_COLUMNS`, cached across requests.
 
 
 @bp.route('/logout')
+@without_user
 def logout():
     session.clear() # then load_logged_in_user won't load a user on subsequent requests.
     return redirect(url_for('index'))
@@ -92,6 +169,17 @@ def login_required(view): # decorator to check that a user is logged in. apply i
     return wrapped_view
 
 
+def get_owned_row(table, row_id, columns='id', check_access=True):
+    '''Reads `columns` of a row of one of the `OWNED_TABLES` by primary key. 404s if there's no such row and, with `check_access`, 403s if the logged in user didn't create it. Call it before loading anything that hangs off the row, so that requests for other users' or missing rows stay cheap.'''
+    db = get_tenant_db() if OWNED_TABLES[table] else get_db()
+    row = db.execute(f'SELECT {columns}, creator_id FROM {table} WHERE id = ?', (row_id,)).fetchone()
+    if row is None:
+        abort(404)
+    if check_access and row['creator_id'] != g.user['id']:
+        abort(403)
+    return row
+
+
 def admin_only(view): # decorator to check that a user has admin property. apply it to views that are for admins only.
     @functools.wraps(view)
     def wrapped_view(**kwargs):
@@ -100,3 +188,39 @@ def admin_only(view): # decorator to check that a user has admin property. apply
         return view(**kwargs)
     return wrapped_view
 
+
+@bp.route('/tokens', methods=('GET', 'POST'))
+@login_required
+def tokens():
+    if g.token_scopes is not None: # a token can't make more tokens, or revoke them.
+        abort(403)
+    new_token = None
+    if request.method == 'POST':
+        name = request.form['name']
+        scopes = [scope for scope in SCOPES if scope in request.form.getlist('scopes')]
+        expires_in_days = request.form.get('expires_in_days', '')
+        error = None
+
+        if not name:
+            error = 'Name is required.'
+        elif not scopes:
+            error = 'At least one scope is required.'
+        elif expires_in_days and (not expires_in_days.isdigit() or int(expires_in_days) == 0):
+            error = 'Expiry must be a number of days.'
+
+        if error is None:
+            new_token = create_token(g.user['id'], name, scopes, int(expires_in_days) if expires_in_days else None) # shown this once.
+        else:
+            flash(error)
+
+    return render_template('auth/tokens.html', tokens=get_tokens(g.user['id']), scopes=SCOPES, new_token=new_token)
+
+
+@bp.route('/tokens/<int:token_id>/revoke', methods=('POST',))
+@login_required
+def revoke(token_id):
+    if g.token_scopes is not None:
+        abort(403)
+    if not revoke_token(g.user['id'], token_id):
+        abort(404)
+    return redirect(url_for('auth.tokens'))
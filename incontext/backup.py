@@ -0,0 +1,135 @@
+import gzip
+import os
+import shutil
+import sqlite3
+import time
+import urllib.parse
+from datetime import datetime
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+
+BACKUP_NAME_FORMAT = '%Y%m%d-%H%M%S-%f' # one folder per backup, named by when it started, so names sort by age.
+
+
+class TooManyRestarts(Exception):
+    pass
+
+
+def backup_database(path, backup_path, pages, sleep, max_restarts):
+    '''Copies the database at `path` to `backup_path` with sqlite's online backup API, `pages` pages per step, sleeping `sleep` seconds between steps. Returns the stats of the copy.
+
+    With WAL, the copy is of one snapshot, read in a transaction held through all the steps, which writers don't wait for; the steps only pace the copy. In rollback journal mode, each step holds a read lock that keeps writers from committing, and a write between steps restarts the copy, so under steady writes a large database would never be done. The `max_restarts`th time, it's done over in one step.'''
+    stats = {'pages': 0, 'bytes': 0, 'steps': 0, 'restarts': 0, 'longest_step': 0.0, 'seconds': 0.0}
+    source = sqlite3.connect(f'file:{urllib.parse.quote(path)}?mode=ro', uri=True)
+    destination = sqlite3.connect(backup_path)
+    if source.execute('PRAGMA journal_mode').fetchone()[0] == 'wal':
+        source.execute('BEGIN')
+        source.execute('SELECT COUNT(*) FROM sqlite_schema').fetchone() # starts the read transaction
+    step_start = start = time.perf_counter()
+    remaining_before = None
+
+    def progress(status, remaining, total):
+        nonlocal step_start, remaining_before
+        stats['longest_step'] = max(stats['longest_step'], time.perf_counter() - step_start)
+        stats['steps'] += 1
+        stats['pages'] = total
+        if remaining_before is not None and remaining >= remaining_before: # started over after a write
+            stats['restarts'] += 1
+            if stats['restarts'] >= max_restarts:
+                raise TooManyRestarts()
+        remaining_before = remaining
+        if remaining:
+            time.sleep(sleep) # gives writers their turn
+        step_start = time.perf_counter()
+
+    try:
+        try:
+            source.backup(destination, pages=pages, progress=progress, sleep=sleep) # `sleep` here is only for when a step finds the database locked
+        except TooManyRestarts:
+            remaining_before, step_start = None, time.perf_counter()
+            source.backup(destination, progress=progress, sleep=sleep)
+        destination.execute('PRAGMA journal_mode = DELETE') # a WAL database's copy would be in WAL mode too, needing files next to it
+        stats['bytes'] = destination.execute('PRAGMA page_count').fetchone()[0] * destination.execute('PRAGMA page_size').fetchone()[0]
+    finally:
+        destination.close()
+        source.close()
+    stats['seconds'] = time.perf_counter() - start
+    return stats
+
+
+def gzip_file(path):
+    '''Gzips the file at `path` to `path.gz`, removing it. Returns the compressed size.'''
+    with open(path, 'rb') as f, gzip.open(path + '.gz', 'wb') as compressed:
+        shutil.copyfileobj(f, compressed)
+    os.remove(path)
+    return os.path.getsize(path + '.gz')
+
+
+def remove_old_backups(backup_dir, keep):
+    '''Removes all but the `keep` newest backups in `backup_dir`. Returns their names.'''
+    backups = []
+    for name in os.listdir(backup_dir):
+        try:
+            datetime.strptime(name, BACKUP_NAME_FORMAT)
+        except ValueError: # not a backup
+            continue
+        backups.append(name)
+    old = sorted(backups)[:max(len(backups) - keep, 0)]
+    for name in old:
+        shutil.rmtree(os.path.join(backup_dir, name))
+    return old
+
+
+def get_database_files():
+    '''Returns the `(name, path)` of the databases to back up: the `DATABASE`, and the tenant databases in `DATABASE_TENANT_DIR`.'''
+    files = [(os.path.basename(current_app.config['DATABASE']), current_app.config['DATABASE'])]
+    tenant_dir = current_app.config['DATABASE_TENANT_DIR']
+    if os.path.isdir(tenant_dir):
+        for name in sorted(os.listdir(tenant_dir)):
+            if name.endswith('.sqlite'):
+                files.append((os.path.join('tenants', name), os.path.join(tenant_dir, name)))
+    return files
+
+
+@click.command('backup')
+@click.option('--dest', help='Folder to keep backups in. Defaults to BACKUP_DIR.')
+@click.option('--pages', type=int, help='Pages copied per step. Defaults to BACKUP_PAGES_PER_STEP.')
+@click.option('--sleep', type=float, help='Seconds to pause between steps. Defaults to BACKUP_STEP_SLEEP.')
+@click.option('--compress/--no-compress', default=None, help='Gzip the copies. Defaults to BACKUP_COMPRESS.')
+@click.option('--keep', type=int, help='Number of backups to keep, the oldest are removed. Defaults to BACKUP_KEEP.')
+@with_appcontext
+def backup_command(dest, pages, sleep, compress, keep):
+    '''Back up the database (and tenant databases) while the app is running.'''
+    config = current_app.config
+    backup_dir = dest or config['BACKUP_DIR']
+    backup_path = os.path.join(backup_dir, datetime.now().strftime(BACKUP_NAME_FORMAT))
+    partial_path = backup_path + '.partial' # renamed once complete, so a failed backup is never taken for one
+    for name, path in get_database_files():
+        copy_path = os.path.join(partial_path, name)
+        os.makedirs(os.path.dirname(copy_path), exist_ok=True)
+        stats = backup_database(
+            path, copy_path,
+            config['BACKUP_PAGES_PER_STEP'] if pages is None else pages,
+            config['BACKUP_STEP_SLEEP'] if sleep is None else sleep,
+            config['BACKUP_MAX_RESTARTS'],
+        )
+        size = stats['bytes'] / 2 ** 20
+        report = (
+            f"{name}: {stats['pages']} pages ({size:.1f} MiB) in {stats['seconds']:.2f} s,"
+            f" {size / max(stats['seconds'], 1e-9):.1f} MiB/s, {stats['steps']} steps,"
+            f" longest step {stats['longest_step'] * 1000:.1f} ms, {stats['restarts']} restarts"
+        )
+        if config['BACKUP_COMPRESS'] if compress is None else compress:
+            report += f', compressed to {gzip_file(copy_path) / 2 ** 20:.1f} MiB'
+        click.echo(report)
+    os.rename(partial_path, backup_path)
+    click.echo(f'Backed up to {backup_path}.')
+    for name in remove_old_backups(backup_dir, config['BACKUP_KEEP'] if keep is None else keep):
+        click.echo(f'Removed {name}.')
+
+
+def init_app(app):
+    app.cli.add_command(backup_command)
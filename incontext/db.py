@@ -1,38 +1,401 @@
+import concurrent.futures
+import contextlib
+import functools
 import os
+import queue
+import random
 import sqlite3
+import threading
+import time
+import urllib.parse
 from datetime import datetime
 
 import click
-from flask import current_app, g
+from flask import current_app, g, has_request_context, request
+from flask.cli import with_appcontext
 
+from .querylog import TimedCursor
 
-def get_db():
-    if 'db' not in g: # `g` is the application context global - a special object unique for each request. It is used for data that might be accessed by multiple functions during the request. This conditional ensures that for any given request there is only one connection to the database.
-        g.db = sqlite3.connect( # establishes a connection to the file pointed at by the `DATABASE` configuration key. This file doesn't have to exist yet, and won't until the database is initialized. (see protocol doc).
-            current_app.config['DATABASE'], # `current_app` is also a special object. It points to the Flask application handling the request. It's available because the project uses an application factory in `__init__.py`. `get_db` will be called while the application is handling a request. It's not being called outside of that context. Therefore `current_app` will be available.
-            detect_types=sqlite3.PARSE_DECLTYPES # Does things like parsing timestamps to python datetime objects because sqlite has only very few native data types (INTEGER, TEXT, REAL, and BLOB).
+
+READ_ONLY_METHODS = ('GET', 'HEAD') # requests served by read-only connections.
+WRITER_ONLY_PRAGMAS = ('journal_mode',) # persistent settings of the database file, which only a writer can change.
+VACUUM_PRAGMAS = ('auto_vacuum', 'page_size') # settings of an existing database file that only take effect through a VACUUM.
+WRITE_STATEMENTS = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE') # the statements python's sqlite3 opens a transaction for.
+TIMESTAMP_COLUMNS = ('created', 'applied', 'expires', 'last_used') # the `TIMESTAMP` columns of the schema, by name.
+TENANT_TABLES = ('agents', 'tethered_agents') # the tables kept in each user's own database when `DATABASE_TENANTS` is on.
+CONNECTIONS = (('db', True), ('db_ro', False), ('tenant_db', True), ('tenant_db_ro', False)) # the app context's connections in `g`, and whether they write.
+
+
+def get_db(write=None):
+    '''Returns the app context's connection: a read-only one while handling a GET or HEAD request, the writer otherwise (including outside of requests, like in commands). `write` overrides the choice.'''
+    if write is None:
+        write = not (has_request_context() and request.method in READ_ONLY_METHODS)
+    name = 'db' if write else 'db_ro'
+    if name not in g: # `g` is the application context global - a special object unique for each request. It is used for data that might be accessed by multiple functions during the request. This conditional ensures that for any given request there is only one connection of each kind to the database.
+        setattr(g, name, checkout_db(write)) # takes this worker thread's idle connection, or opens one.
+
+    return getattr(g, name)
+
+
+def get_tenant_db(write=None):
+    '''Returns the app context's connection to the logged in user's own database when `DATABASE_TENANTS` is on, with the global database attached read-only. Table names that aren't one of the `TENANT_TABLES` find the global tables, so queries join across both unchanged. With tenants off, this is `get_db`.'''
+    if not current_app.config['DATABASE_TENANTS']:
+        return get_db(write)
+    if write is None:
+        write = not (has_request_context() and request.method in READ_ONLY_METHODS)
+    name = 'tenant_db' if write else 'tenant_db_ro'
+    if name not in g:
+        setattr(g, name, checkout_db(write, g.user['id']))
+    return getattr(g, name)
+
+
+def get_tenant_path(user_id):
+    return os.path.join(current_app.config['DATABASE_TENANT_DIR'], f'{int(user_id)}.sqlite')
+
+
+def init_tenant_db(path):
+    '''Creates a tenant database with the `TENANT_TABLES`, unless it exists.'''
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    db = sqlite3.connect(path)
+    try:
+        with current_app.open_resource('tenant_schema.sql') as f:
+            db.executescript(f.read().decode('utf-8'))
+    finally:
+        db.close()
+
+
+class ConnectionPool(threading.local):
+    '''Holds each thread's idle connections between app contexts: one writer and one read-only connection to the global database, keyed by `write`, and up to `DATABASE_TENANT_IDLE` tenant connections, keyed by `(write, user_id)`, the least recently used going first. Being thread local, a connection is only ever used by the thread that opened it.'''
+    def __init__(self):
+        self.pid = os.getpid()
+        self.idle = {}
+
+
+class WriterCursor(sqlite3.Cursor):
+    '''Starts the transaction of the first write itself, with `BEGIN IMMEDIATE`, so the write lock is taken before anything is read or written and waiting for it can be retried safely. Once a transaction holds the lock, its statements can't fail from contention.'''
+    def execute(self, sql, parameters=()):
+        statement = sql.lstrip()[:7].upper()
+        if statement.startswith('BEGIN'):
+            return self.connection.begin(sql, self)
+        if not self.connection.in_transaction and statement.startswith(WRITE_STATEMENTS):
+            self.connection.begin()
+        return super().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        if not self.connection.in_transaction:
+            self.connection.begin()
+        return super().executemany(sql, seq_of_parameters)
+
+
+# `WriterCursor` comes first, so the time a write waits for the lock isn't counted as the statement's.
+class TimedWriterCursor(WriterCursor, TimedCursor):
+    pass
+
+
+class Connection(sqlite3.Connection):
+    '''The read-only connection, and the base of the writer. Its cursors time their statements for the slow query log while `slow_query_threshold` is set, and record them in `query_log` while that is set (during a sampled request). See `querylog`.'''
+    cursor_class = sqlite3.Cursor
+    timed_cursor_class = TimedCursor
+    query_log = None
+    slow_query_threshold = None
+
+    def cursor(self, factory=None):
+        if factory is None:
+            if self.query_log is not None or self.slow_query_threshold is not None:
+                factory = self.timed_cursor_class
+            else:
+                factory = self.cursor_class
+        return super().cursor(factory)
+
+    # `sqlite3.Connection.execute` doesn't go through `cursor`, so these do.
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+class LockTimeout(sqlite3.OperationalError):
+    '''The database stayed locked through all the retries of a write. Served as a 503, for the client to try again later.'''
+
+
+def is_lock_error(e):
+    return isinstance(e, sqlite3.OperationalError) and 'locked' in str(e) # sqlite's "database is locked", for SQLITE_BUSY and SQLITE_LOCKED alike
+
+
+def get_backoff(backoff, attempt):
+    '''Seconds to wait before retry `attempt` (from 0): exponential from `backoff`, with jitter so that waiting writers don't all retry at once.'''
+    return backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+
+
+class WriterConnection(Connection):
+    '''The read-write connection. Retries taking the write lock up to `DATABASE_WRITE_RETRIES` times, backing off exponentially (with jitter) from `DATABASE_WRITE_BACKOFF` seconds, on top of the `busy_timeout` each attempt waits. Counts the retries in `metrics`.'''
+    cursor_class = WriterCursor
+    timed_cursor_class = TimedWriterCursor
+    write_retries = 0
+    write_backoff = 0
+    metrics = None
+
+    def begin(self, sql='BEGIN IMMEDIATE', cursor=None):
+        for attempt in range(self.write_retries + 1):
+            try:
+                return sqlite3.Cursor.execute(cursor or sqlite3.Connection.cursor(self), sql)
+            except sqlite3.OperationalError as e:
+                if not is_lock_error(e):
+                    raise
+                if attempt == self.write_retries:
+                    raise LockTimeout(str(e)) from e
+                if self.metrics is not None:
+                    self.metrics.increment('db_begin_retries_total')
+                time.sleep(get_backoff(self.write_backoff, attempt))
+
+
+class Row(sqlite3.Row):
+    '''A `sqlite3.Row` that parses timestamps to python datetime objects (sqlite has only very few native data types: INTEGER, TEXT, REAL, and BLOB) when they're read by column name, rather than every one as it's fetched. Read by index or unpacked, they're the stored text.'''
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        if key in TIMESTAMP_COLUMNS and isinstance(value, str):
+            return datetime.fromisoformat(value)
+        return value
+
+
+def connect(write=True, tenant_id=None):
+    '''Opens a writer or a read-only (`mode=ro`, never takes a write lock) connection to the `DATABASE`, or to the database of the tenant `tenant_id` (created if need be) with the `DATABASE` attached read-only as `global`, and applies the `DATABASE_PRAGMAS`, in order.'''
+    path = current_app.config['DATABASE'] # `current_app` is also a special object. It points to the Flask application handling the request. It's available because the project uses an application factory in `__init__.py`. `get_db` will be called while the application is handling a request. It's not being called outside of that context. Therefore `current_app` will be available.
+    if tenant_id is not None:
+        global_path, path = path, get_tenant_path(tenant_id)
+        if not os.path.exists(path):
+            init_tenant_db(path)
+    uri = f'file:{urllib.parse.quote(path)}' + ('' if write else '?mode=ro')
+    if write:
+        db = sqlite3.connect( # establishes a connection to the file pointed at by the `DATABASE` configuration key. This file doesn't have to exist yet, and won't until the database is initialized. (see protocol doc).
+            uri,
+            uri=True,
+            factory=WriterConnection,
         )
-        g.db.row_factory = sqlite3.Row # returns rows that behave like dicts, allowing access to the columns by name.
+        db.write_retries = current_app.config['DATABASE_WRITE_RETRIES']
+        db.write_backoff = current_app.config['DATABASE_WRITE_BACKOFF']
+        db.metrics = current_app.extensions['incontext.metrics']
+    else:
+        db = sqlite3.connect(uri, uri=True, factory=Connection)
+    db.row_factory = Row # returns rows that behave like dicts, allowing access to the columns by name.
+    db.pool_key = write if tenant_id is None else (write, tenant_id)
+    for name, value in current_app.config['DATABASE_PRAGMAS'].items():
+        if write or name not in WRITER_ONLY_PRAGMAS:
+            db.execute(f'PRAGMA {name} = {value}')
+    if tenant_id is not None: # after the pragmas, which would otherwise apply to it too
+        db.execute('ATTACH DATABASE ? AS global', (f'file:{urllib.parse.quote(global_path)}?mode=ro',))
+    return db
+
 
-    return g.db
+def checkout_db(write=True, tenant_id=None):
+    '''Returns this thread's pooled connection of the kind asked for if it still answers a health check, otherwise a new one. With `DATABASE_REUSE_CONNECTIONS` off, every app context gets new connections.'''
+    db = None
+    if current_app.config['DATABASE_REUSE_CONNECTIONS']:
+        pool = current_app.extensions['incontext.db']
+        if pool.pid != os.getpid(): # connections inherited through a fork belong to the parent process, leave them alone.
+            pool.pid, pool.idle = os.getpid(), {}
+        db = pool.idle.pop(write if tenant_id is None else (write, tenant_id), None)
+        if db is not None:
+            try:
+                db.execute('SELECT 1')
+            except sqlite3.Error:
+                db = None
+    if db is None:
+        db = connect(write, tenant_id)
+    db.execute('PRAGMA foreign_keys = ON') # sqlite only enforces foreign keys (and their ON DELETE CASCADE actions) when this is set on the connection. Set on every checkout, in case the last user turned them off.
+    db.query_log = g.get('query_log') # set if this request is sampled, see `querylog`.
+    db.slow_query_threshold = current_app.config['SLOW_QUERY_THRESHOLD']
+    return db
 
 
 def close_db(e=None):
-    '''Checks if a connection was created and closes it if so. Called by the application factory after each request.'''
-    db = g.pop('db', None)
+    '''Checks if connections were taken and gives them back to the pool, rolling back whatever they left uncommitted. Called by the application factory after each request. Without pooling the connections are closed.'''
+    pool = current_app.extensions['incontext.db']
+    for name, write in CONNECTIONS:
+        db = g.pop(name, None)
+        if db is None:
+            continue
+        if current_app.config['DATABASE_REUSE_CONNECTIONS'] and pool.pid == os.getpid():
+            try:
+                if db.in_transaction:
+                    db.rollback()
+            except sqlite3.Error: # closed or broken, don't keep it
+                continue
+            displaced = pool.idle.pop(db.pool_key, None) # popped first, so the key moves to the end: the dict is in order of last use
+            if displaced is not None and displaced is not db: # like one an inner app context gave back first
+                displaced.close()
+            pool.idle[db.pool_key] = db
+            if isinstance(db.pool_key, tuple): # a tenant's, of which only the most recently used are kept
+                tenant_keys = [key for key in pool.idle if isinstance(key, tuple)]
+                for key in tenant_keys[:len(tenant_keys) - current_app.config['DATABASE_TENANT_IDLE']]:
+                    pool.idle.pop(key).close()
+        else:
+            db.close()
 
-    if db is not None:
-        db.close()
+
+def run_write(unit, tenant=False):
+    '''Runs `unit(db)` with the writer and commits it, returning what `unit` returns (like a new row's id). A unit must not commit, nor use `g` or `request`: with `DATABASE_GROUP_COMMIT` on, it runs on the process's group commit thread, in a transaction shared with the units of other requests, and this only returns once that transaction is committed. A unit that raises is rolled back on its own and its exception re-raised here.
+
+    The transaction is begun with `BEGIN IMMEDIATE`, whose wait for the write lock `WriterConnection` retries. If the database is locked later on (like a commit waiting for readers in rollback journal mode), the whole unit is rolled back and run again, up to `DATABASE_WRITE_RETRIES` times, so it must be safe to repeat. Raises `LockTimeout` once retries run out. Retries and failures are counted in the metrics.
+
+    With `tenant`, the unit writes to the `TENANT_TABLES` through `get_tenant_db`. With `DATABASE_TENANTS` on, it then commits on its own, since tenants don't share a write lock to begin with.'''
+    config = current_app.config
+    metrics = current_app.extensions['incontext.metrics']
+    for attempt in range(config['DATABASE_WRITE_RETRIES'] + 1):
+        try:
+            result = run_write_once(unit, tenant)
+        except sqlite3.OperationalError as e:
+            if isinstance(e, LockTimeout): # the lock wasn't even taken, and that's been retried already
+                metrics.increment('db_write_failures_total')
+                raise
+            if not is_lock_error(e):
+                raise
+            if attempt == config['DATABASE_WRITE_RETRIES']:
+                metrics.increment('db_write_failures_total')
+                raise LockTimeout(str(e)) from e
+            metrics.increment('db_write_retries_total')
+            time.sleep(get_backoff(config['DATABASE_WRITE_BACKOFF'], attempt))
+        else:
+            metrics.increment('db_writes_total')
+            return result
+
+
+def run_write_once(unit, tenant):
+    if tenant and current_app.config['DATABASE_TENANTS']:
+        db = get_tenant_db(write=True)
+    elif current_app.config['DATABASE_GROUP_COMMIT']:
+        return get_group_committer().submit(unit)
+    else:
+        db = get_db(write=True)
+    try:
+        result = unit(db)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return result
+
+
+def transactional(unit=None, *, tenant=False):
+    '''Decorator that turns a write unit taking the connection first, `unit(db, *args)`, into a function called without it, `unit(*args)`, which runs it with `run_write` (retries included). Use as `@transactional` or `@transactional(tenant=True)`.'''
+    if unit is None:
+        return functools.partial(transactional, tenant=tenant)
+
+    @functools.wraps(unit)
+    def wrapped_unit(*args, **kwargs):
+        return run_write(lambda db: unit(db, *args, **kwargs), tenant=tenant)
+    return wrapped_unit
+
+
+@contextlib.contextmanager
+def transaction(tenant=False):
+    '''Runs the `with` block in a transaction of the writer (or the tenant's, with `tenant`), begun with `BEGIN IMMEDIATE` and committed at the end, or rolled back if the block raises. Yields the connection. Unlike `run_write`, a block can't be run again, so only taking the lock is retried, and it doesn't go through group commit: for writes that use up their input, like imports. Raises `sqlite3.ProgrammingError` if the connection already has a transaction open, rather than commit or drop writes made outside the block.'''
+    db = get_tenant_db(write=True) if tenant else get_db(write=True)
+    if db.in_transaction:
+        raise sqlite3.ProgrammingError('A transaction is already open on this connection.')
+    db.begin()
+    try:
+        yield db
+        db.commit()
+    except BaseException:
+        db.rollback()
+        raise
+
+
+GROUP_COMMITTER_LOCK = threading.Lock()
+
+
+def get_group_committer():
+    '''Returns this process's group committer, starting it on first use (and again after a fork, which doesn't copy threads).'''
+    app = current_app._get_current_object()
+    with GROUP_COMMITTER_LOCK:
+        committer = app.extensions.get('incontext.group_commit')
+        if committer is None or committer.pid != os.getpid():
+            committer = app.extensions['incontext.group_commit'] = GroupCommitter(app)
+    return committer
+
+
+class GroupCommitter:
+    '''A writer thread with its own connection. It takes the write units submitted by request threads and runs those that queued up while it was busy, plus those arriving within `DATABASE_GROUP_COMMIT_WINDOW` seconds after, in one transaction (up to `DATABASE_GROUP_COMMIT_MAX_BATCH` units), so they share one commit and its fsync. Each unit runs in a savepoint, so a failing unit doesn't take the others down.'''
+    def __init__(self, app):
+        self.app = app
+        self.pid = os.getpid()
+        self.window = app.config['DATABASE_GROUP_COMMIT_WINDOW']
+        self.max_batch = app.config['DATABASE_GROUP_COMMIT_MAX_BATCH']
+        self.units = queue.SimpleQueue()
+        started = concurrent.futures.Future()
+        threading.Thread(target=self.run, args=(started,), name='group-commit', daemon=True).start()
+        started.result() # raises if the thread couldn't connect
+
+    def submit(self, unit):
+        future = concurrent.futures.Future()
+        self.units.put((unit, future))
+        return future.result()
+
+    def run(self, started):
+        try:
+            with self.app.app_context():
+                self.db = connect(write=True) # a connection can only be used by the thread that opened it
+            self.db.isolation_level = None # transactions are managed by hand, see `commit`
+            self.db.execute('PRAGMA foreign_keys = ON')
+        except Exception as e:
+            started.set_exception(e)
+            return
+        started.set_result(None)
+        while True:
+            # units submitted while the last batch was committing are taken right away. Only when there were some,
+            # meaning writes are coming in concurrently, it's worth waiting the window for more; a lone write isn't held up.
+            batch = [self.units.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self.units.get(timeout=max(deadline - time.monotonic(), 0) if len(batch) > 1 else 0))
+                except queue.Empty:
+                    break
+            self.commit(batch)
+
+    def commit(self, batch):
+        db = self.db
+        outcomes = []
+        try:
+            db.execute('BEGIN IMMEDIATE')
+            for unit, future in batch:
+                db.execute('SAVEPOINT unit')
+                try:
+                    outcomes.append((future, unit(db), None))
+                except Exception as e:
+                    db.execute('ROLLBACK TO unit')
+                    outcomes.append((future, None, e))
+                db.execute('RELEASE unit')
+            db.execute('COMMIT')
+        except Exception as e: # the transaction itself failed, so did every unit in it
+            if db.in_transaction:
+                db.execute('ROLLBACK')
+            for unit, future in batch:
+                future.set_exception(e)
+            return
+        for future, result, error in outcomes:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
 
 
 def init_db():
     db = get_db() # returns a database connection
 
+    db.execute('PRAGMA foreign_keys = OFF') # lets `schema.sql` drop the tables in any order
     with current_app.open_resource('schema.sql') as f: # `open_resource` opens a file relative to the `incontext` package
         db.executescript(f.read().decode('utf-8'))
+    db.execute('PRAGMA foreign_keys = ON')
 
     db.execute('INSERT INTO users (username, password, admin) VALUES(?, ?, ?)', ('admin', os.environ.get('IC_ADMIN_PW'), True),)
 
+    migrate(db) # bring the fresh schema up to the latest version
+
     db.executemany(
         "INSERT INTO agent_models (provider_name, provider_code, model_name, model_code, model_description)"
         " VALUES (?, ?, ?, ?, ?)",
@@ -49,13 +412,183 @@ def init_db_command():
     click.echo('Initialized the database.')
 
 
-# tell python how to interpret timestamp values in the database
-sqlite3.register_converter(
-    "timestamp", lambda v: datetime.fromisoformat(v.decode())
+def get_migrations():
+    '''Returns the `(version, name)` of every migration in the `migrations` folder, in version order. Migration files are named like `0001_relation_indexes.sql`.'''
+    migrations = []
+    for filename in os.listdir(os.path.join(current_app.root_path, 'migrations')):
+        version, _, name = filename.partition('_')
+        if version.isdigit() and name.endswith('.sql'):
+            migrations.append((int(version), filename))
+    return sorted(migrations)
+
+
+def get_schema_version(db):
+    db.execute(
+        'CREATE TABLE IF NOT EXISTS schema_version ('
+        ' version INTEGER PRIMARY KEY,'
+        ' name TEXT NOT NULL,'
+        ' applied TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP)'
+    )
+    return db.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version').fetchone()[0]
+
+
+def migrate(db):
+    '''Applies the migrations newer than the database's schema version, each in its own transaction, with foreign keys off so tables can be rebuilt. A migration that sets one of the `VACUUM_PRAGMAS` is followed by a VACUUM. Returns the names of the applied migrations.'''
+    current_version = get_schema_version(db)
+    db.commit()
+    applied = []
+    existing_violations = get_foreign_key_violations(db) # only violations a migration introduces make it fail
+    db.execute('PRAGMA foreign_keys = OFF') # a no-op inside a transaction, so it's set around them
+    try:
+        for version, name in get_migrations():
+            if version <= current_version:
+                continue
+            with current_app.open_resource(os.path.join('migrations', name)) as f:
+                script = f.read().decode('utf-8')
+            try:
+                db.executescript(
+                    'BEGIN;\n'
+                    f'{script}\n'
+                    f"INSERT INTO schema_version (version, name) VALUES ({version}, '{name}');"
+                )
+                violations = get_foreign_key_violations(db) - existing_violations
+                if violations:
+                    raise sqlite3.IntegrityError(f'{name} leaves rows in {min(violations)[0]} that violate a foreign key.')
+                db.commit()
+            except sqlite3.Error:
+                if db.in_transaction:
+                    db.rollback()
+                raise
+            if any(f'PRAGMA {pragma}' in script for pragma in VACUUM_PRAGMAS):
+                db.executescript('VACUUM') # can't run in a transaction. Rewrites the whole file, once.
+            applied.append(name)
+    finally:
+        db.execute('PRAGMA foreign_keys = ON')
+    return applied
+
+
+def get_foreign_key_violations(db):
+    return {tuple(violation) for violation in db.execute('PRAGMA foreign_key_check')}
+
+
+@click.command('migrate')
+@with_appcontext
+def migrate_command():
+    '''Apply pending schema migrations without touching existing data.'''
+    applied = migrate(get_db())
+    for name in applied:
+        click.echo(f'Applied {name}.')
+    if not applied:
+        click.echo('The database is up to date.')
+
+
+# rows that nothing points at anymore (or that point at nothing), with the statement that deletes them.
+ORPHANS = (
+    ('master_list_item_relations',
+        'DELETE FROM master_list_item_relations'
+        ' WHERE master_list_id NOT IN (SELECT id FROM master_lists)'
+        ' OR master_item_id NOT IN (SELECT id FROM master_items)'),
+    ('master_list_detail_relations',
+        'DELETE FROM master_list_detail_relations'
+        ' WHERE master_list_id NOT IN (SELECT id FROM master_lists)'
+        ' OR master_detail_id NOT IN (SELECT id FROM master_details)'),
+    ('master_items', 'DELETE FROM master_items WHERE id NOT IN (SELECT master_item_id FROM master_list_item_relations)'),
+    ('master_details', 'DELETE FROM master_details WHERE id NOT IN (SELECT master_detail_id FROM master_list_detail_relations)'),
+    ('master_item_detail_relations',
+        'DELETE FROM master_item_detail_relations'
+        ' WHERE master_item_id NOT IN (SELECT id FROM master_items)'
+        ' OR master_detail_id NOT IN (SELECT id FROM master_details)'),
+    ('tethered_agents', 'DELETE FROM tethered_agents WHERE master_agent_id NOT IN (SELECT id FROM master_agents)'),
+)
+# the same in each tenant database, whose rows point into the global database attached read-only, without foreign keys.
+TENANT_ORPHANS = (
+    ('tethered_agents', 'DELETE FROM main.tethered_agents WHERE master_agent_id NOT IN (SELECT id FROM global.master_agents)'),
 )
 
 
+def sweep_orphans(db):
+    '''Deletes orphaned rows left by data written without foreign keys. Returns the number of rows deleted per table.'''
+    swept = {}
+    for table, sql in ORPHANS:
+        swept[table] = db.execute(sql).rowcount
+    db.commit()
+    return swept
+
+
+def get_tenant_ids():
+    '''Returns the ids of the users with a database in `DATABASE_TENANT_DIR`.'''
+    tenant_dir = current_app.config['DATABASE_TENANT_DIR']
+    if not os.path.isdir(tenant_dir):
+        return []
+    names = (name.removesuffix('.sqlite') for name in os.listdir(tenant_dir) if name.endswith('.sqlite'))
+    return sorted(int(name) for name in names if name.isdigit())
+
+
+def sweep_tenant_orphans():
+    '''Deletes the rows of every tenant database that point to global rows that are gone, one tenant per transaction. Returns the number of rows deleted per table, over all tenants.'''
+    swept = {table: 0 for table, sql in TENANT_ORPHANS}
+    for tenant_id in get_tenant_ids():
+        with contextlib.closing(connect(True, tenant_id)) as db:
+            for table, sql in TENANT_ORPHANS:
+                swept[table] += db.execute(sql).rowcount
+            db.commit()
+    return swept
+
+
+@click.command('sweep-orphans')
+@with_appcontext
+def sweep_orphans_command():
+    '''Delete master data and relations that no longer belong to anything.'''
+    for table, count in sweep_orphans(get_db()).items():
+        click.echo(f'{table}: {count} deleted')
+    for table, count in sweep_tenant_orphans().items():
+        click.echo(f'tenant {table}: {count} deleted')
+
+
+def split_tenants(db):
+    '''Moves each user's rows of the `TENANT_TABLES` from the global database into their tenant database, one user per transaction. Returns the number of rows moved per table.'''
+    db.commit() # `ATTACH` can't run in a transaction
+    moved = dict.fromkeys(TENANT_TABLES, 0)
+    user_ids = [
+        row[0] for row in db.execute(' UNION '.join(f'SELECT creator_id FROM main.{table}' for table in TENANT_TABLES))
+    ]
+    for user_id in user_ids:
+        path = get_tenant_path(user_id)
+        init_tenant_db(path)
+        db.execute('ATTACH DATABASE ? AS tenant', (path,))
+        try:
+            for table in TENANT_TABLES:
+                moved[table] += db.execute(
+                    f'INSERT INTO tenant.{table} SELECT * FROM main.{table} WHERE creator_id = ?', (user_id,)
+                ).rowcount
+                db.execute(f'DELETE FROM main.{table} WHERE creator_id = ?', (user_id,))
+            db.commit()
+        except sqlite3.Error:
+            db.rollback()
+            raise
+        finally:
+            db.execute('DETACH DATABASE tenant')
+    return moved
+
+
+@click.command('split-tenants')
+@with_appcontext
+def split_tenants_command():
+    '''Move each user's agents and tethered agents into their own database.'''
+    for table, count in split_tenants(get_db()).items():
+        click.echo(f'{table}: {count} moved')
+
+
+def handle_lock_timeout(e):
+    return 'The database is busy. Please try again.', 503, {'Retry-After': '1'}
+
+
 def init_app(app):
     '''Called by the app factory to do these register actions on the app.'''
+    app.extensions['incontext.db'] = ConnectionPool() # idle connections, kept per worker thread.
+    app.register_error_handler(LockTimeout, handle_lock_timeout) # a write that couldn't get through, instead of a 500
     app.teardown_appcontext(close_db) # register the `close_db` function with the process of cleaning up after returning the response
     app.cli.add_command(init_db_command) # registers the `init-db` command that can be called with the `flask` command
+    app.cli.add_command(migrate_command)
+    app.cli.add_command(sweep_orphans_command)
+    app.cli.add_command(split_tenants_command)
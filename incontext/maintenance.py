@@ -0,0 +1,178 @@
+import fcntl
+import os
+import random
+import sqlite3
+import threading
+import time
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from incontext.backup import get_database_files
+from incontext.querylog import explain, read_slow_query_log
+
+
+def get_logged_statements(limit):
+    '''Returns the `(sql, parameters)` of the `limit` statements most recently written to the slow query log, one per fingerprint. Their plans are the ones worth watching.'''
+    config = current_app.config
+    statements = {}
+    for entry in read_slow_query_log(config['SLOW_QUERY_LOG'], config['SLOW_QUERY_LOG_BACKUPS']):
+        if entry['plan'] is not None: # logged with its parameters, so it can be explained again
+            statements.pop(entry['fingerprint'], None) # moves it to the end, as the latest
+            statements[entry['fingerprint']] = (entry['sql'], entry['parameters'])
+    return list(statements.values())[-limit:] if limit else []
+
+
+def get_plans(db, statements):
+    plans = {}
+    for sql, parameters in statements:
+        try:
+            plans[sql] = explain(db, sql, parameters)
+        except sqlite3.Error: # like a statement of a table dropped since
+            continue
+    return plans
+
+
+def maintain_database(path, statements=(), time_limit=10.0, vacuum_pages=512, sleep=0.05, analysis_limit=1000, busy_timeout=5.0):
+    '''Runs `ANALYZE`, `PRAGMA optimize` and `PRAGMA incremental_vacuum` on the database at `path`, a table or `vacuum_pages` pages at a time, each slice in a transaction of its own, sleeping `sleep` seconds between them so writers get their turn. Stops starting slices after `time_limit` seconds. Returns the stats of the run, with the plans of `statements` that changed.
+
+    `analysis_limit` bounds the rows `ANALYZE` reads per index; the statistics are approximate, which is all the planner needs.'''
+    stats = {
+        'tables': 0, 'tables_analyzed': 0, 'auto_vacuum': None, 'free_pages': 0, 'pages_reclaimed': 0,
+        'bytes_reclaimed': 0, 'plans_checked': 0, 'changed_plans': [], 'complete': False, 'seconds': 0.0,
+    }
+    start = time.perf_counter()
+    deadline = start + time_limit
+    db = sqlite3.connect(path, isolation_level=None, timeout=busy_timeout) # autocommit: every slice commits on its own
+    try:
+        plans_before = get_plans(db, statements)
+        db.execute(f'PRAGMA analysis_limit = {int(analysis_limit)}')
+        tables = [row[0] for row in db.execute(
+            "SELECT name FROM sqlite_schema WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name"
+        )]
+        stats['tables'] = len(tables)
+        for table in tables:
+            if time.perf_counter() >= deadline:
+                break
+            db.execute(f'ANALYZE "{table}"')
+            stats['tables_analyzed'] += 1
+            time.sleep(sleep)
+        db.execute('PRAGMA optimize') # whatever else sqlite finds worth doing, with the same `analysis_limit`
+
+        stats['auto_vacuum'] = db.execute('PRAGMA auto_vacuum').fetchone()[0]
+        page_size = db.execute('PRAGMA page_size').fetchone()[0]
+        stats['free_pages'] = free_pages = db.execute('PRAGMA freelist_count').fetchone()[0]
+        if stats['auto_vacuum'] == 2: # INCREMENTAL
+            while free_pages and time.perf_counter() < deadline:
+                # each step of the statement frees one page, and python's `execute` only takes one step
+                db.executescript(f'PRAGMA incremental_vacuum({int(vacuum_pages)})')
+                free_pages = db.execute('PRAGMA freelist_count').fetchone()[0]
+                if free_pages:
+                    time.sleep(sleep)
+            stats['pages_reclaimed'] = stats['free_pages'] - free_pages
+            stats['bytes_reclaimed'] = stats['pages_reclaimed'] * page_size
+            db.execute('PRAGMA wal_checkpoint(PASSIVE)') # with WAL, the file only shrinks once the truncation is checkpointed
+
+        plans_after = get_plans(db, statements)
+        stats['plans_checked'] = len(plans_after)
+        stats['changed_plans'] = [
+            (sql, plans_before[sql], plan) for sql, plan in plans_after.items()
+            if sql in plans_before and plans_before[sql] != plan
+        ]
+        stats['complete'] = stats['tables_analyzed'] == stats['tables'] and not free_pages
+    finally:
+        db.close()
+    stats['seconds'] = time.perf_counter() - start
+    return stats
+
+
+def run_maintenance():
+    '''Maintains the `DATABASE` and the tenant databases, within `MAINTENANCE_TIME_LIMIT` seconds in all. Plans are only compared on the `DATABASE`, where the logged statements run. Returns the report lines.'''
+    config = current_app.config
+    deadline = time.perf_counter() + config['MAINTENANCE_TIME_LIMIT']
+    statements = get_logged_statements(config['MAINTENANCE_PLANS'])
+    report = []
+    for name, path in get_database_files():
+        stats = maintain_database(
+            path,
+            statements if path == config['DATABASE'] else (),
+            time_limit=max(deadline - time.perf_counter(), 0),
+            vacuum_pages=config['MAINTENANCE_VACUUM_PAGES'],
+            sleep=config['MAINTENANCE_SLEEP'],
+            analysis_limit=config['MAINTENANCE_ANALYSIS_LIMIT'],
+            busy_timeout=config['DATABASE_PRAGMAS'].get('busy_timeout', 5000) / 1000,
+        )
+        line = (
+            f"{name}: analyzed {stats['tables_analyzed']} of {stats['tables']} tables,"
+            f" reclaimed {stats['pages_reclaimed']} of {stats['free_pages']} free pages"
+            f" ({stats['bytes_reclaimed'] / 2 ** 20:.1f} MiB),"
+            f" {len(stats['changed_plans'])} of {stats['plans_checked']} plans changed, in {stats['seconds']:.2f} s"
+        )
+        if stats['auto_vacuum'] != 2:
+            line += '. auto_vacuum isn\'t INCREMENTAL, run `flask migrate`'
+        if not stats['complete']:
+            line += '. Stopped at the time limit'
+        report.append(line)
+        for sql, before, after in stats['changed_plans']:
+            report.append(f'  {sql}')
+            report.extend(f'  - {step}' for step in before)
+            report.extend(f'  + {step}' for step in after)
+    return report
+
+
+@click.command('db-maintain')
+@click.option('--time-limit', type=float, help='Seconds to spend at most. Defaults to MAINTENANCE_TIME_LIMIT.')
+@with_appcontext
+def db_maintain_command(time_limit):
+    '''Update the query planner's statistics and give free pages back, in short slices while the app is running.'''
+    if time_limit is not None:
+        current_app.config['MAINTENANCE_TIME_LIMIT'] = time_limit
+    for line in run_maintenance():
+        click.echo(line)
+
+
+MAINTENANCE_SCHEDULER_LOCK = threading.Lock()
+
+
+def is_maintenance_due(stamp, interval):
+    '''Whether the last run, by any process, was `interval` seconds ago or more. Marks a run as started if so, under an exclusive lock on the stamp, so that of processes asking at once only one gets `True`.'''
+    with open(stamp, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX) # released when the file is closed
+        stat = os.fstat(f.fileno())
+        if stat.st_size and time.time() - stat.st_mtime < interval: # a stamp that was only just created here is empty
+            return False
+        f.truncate(0)
+        f.write(f'{os.getpid()}\n') # which process claimed the last run, and when, by the file's mtime
+    return True
+
+
+def run_maintenance_scheduler(app, interval):
+    while True:
+        time.sleep(interval * random.uniform(0.5, 1)) # each worker process has its own, so they don't all wake at once
+        with app.app_context():
+            try:
+                if is_maintenance_due(app.config['MAINTENANCE_STAMP'], interval):
+                    for line in run_maintenance():
+                        app.logger.info('Database maintenance: %s', line)
+            except Exception:
+                app.logger.exception('Database maintenance failed.')
+
+
+def start_maintenance_scheduler():
+    '''Starts this process's maintenance thread on its first request, when `MAINTENANCE_INTERVAL` is set (and again after a fork, which doesn't copy threads).'''
+    app = current_app._get_current_object()
+    interval = app.config['MAINTENANCE_INTERVAL']
+    if not interval or app.extensions.get('incontext.maintenance') == os.getpid():
+        return
+    with MAINTENANCE_SCHEDULER_LOCK:
+        if app.extensions.get('incontext.maintenance') != os.getpid():
+            app.extensions['incontext.maintenance'] = os.getpid()
+            threading.Thread(
+                target=run_maintenance_scheduler, args=(app, interval), name='db-maintenance', daemon=True
+            ).start()
+
+
+def init_app(app):
+    app.before_request(start_maintenance_scheduler)
+    app.cli.add_command(db_maintain_command)
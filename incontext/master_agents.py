@@ -3,8 +3,8 @@ from flask import (
 )
 from werkzeug.exceptions import abort
 
-from incontext.auth import login_required, admin_only
-from incontext.db import get_db
+from incontext.auth import get_owned_row, login_required, admin_only
+from incontext.db import get_db, run_write
 
 bp = Blueprint('master_agents', __name__, url_prefix='/master-agents')
 
@@ -39,13 +39,12 @@ def new():
         if error is not None:
             flash(error)
         else:
-            db = get_db()
-            db.execute(
+            creator_id = g.user['id']
+            run_write(lambda db: db.execute(
                 'INSERT INTO master_agents (name, description, model_id, role, instructions, creator_id)'
                 ' VALUES (?, ?, ?, ?, ?, ?)',
-                (name, description, model_id, role, instructions, g.user['id'])
-            )
-            db.commit()
+                (name, description, model_id, role, instructions, creator_id)
+            ))
             return redirect(url_for('master_agents.index'))
     return render_template('master-agents/new.html', agent_models=agent_models)
 
@@ -81,14 +80,12 @@ def edit(master_agent_id):
         if error is not None:
             flash(error)
         else:
-            db = get_db()
-            db.execute(
+            run_write(lambda db: db.execute(
                 "UPDATE master_agents"
                 " SET name = ?, description = ?, model_id = ?, role = ?, instructions = ?"
                 " WHERE id = ?",
                 (name, description, model_id, role, instructions, master_agent_id)
-            )
-            db.commit()
+            ))
             return redirect(url_for('master_agents.index'))
     return render_template("master-agents/edit.html", master_agent=master_agent, agent_models=agent_models)
 
@@ -98,9 +95,7 @@ def edit(master_agent_id):
 @admin_only
 def delete(master_agent_id):
     master_agent = get_master_agent(master_agent_id)
-    db = get_db()
-    db.execute("DELETE FROM master_agents WHERE id = ?", (master_agent_id,))
-    db.commit()
+    run_write(lambda db: db.execute("DELETE FROM master_agents WHERE id = ?", (master_agent_id,)))
     return redirect(url_for('master_agents.index'))
 
 
@@ -116,6 +111,7 @@ def get_master_agents():
 
 
 def get_master_agent(master_agent_id, check_access=True):
+    get_owned_row('master_agents', master_agent_id, check_access=check_access)
     db = get_db()
     master_agent = db.execute(
         'SELECT m.id, m.creator_id, m.created, m.name, m.description, m.model_id, m.role, m.instructions, a.model_name, a.provider_name, u.username'
@@ -125,11 +121,8 @@ def get_master_agent(master_agent_id, check_access=True):
         ' WHERE m.id = ?',
         (master_agent_id,)
     ).fetchone()
-    if master_agent is None:
+    if master_agent is None: # deleted since
         abort(404)
-    if check_access:
-        if master_agent['creator_id'] != g.user['id']:
-            abort(403)
     return master_agent
 
 
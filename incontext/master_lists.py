@@ -1,12 +1,31 @@
+import collections
+import csv
+import io
+import json
+
+import click
 from flask import (
-    Blueprint, flash, g, redirect, render_template, request, url_for
+    Blueprint, current_app, flash, g, redirect, render_template, request, stream_with_context, url_for
 )
-from werkzeug.exceptions import abort
+from flask.cli import with_appcontext
+from markupsafe import Markup, escape
+from werkzeug.exceptions import NotFound, abort
+
+from incontext.auth import get_owned_row, login_required, admin_only
+from incontext.db import get_db, run_write, transaction, transactional
 
-from incontext.auth import login_required, admin_only
-from incontext.db import get_db
+bp = Blueprint('master_lists', __name__, url_prefix='/master-lists', cli_group=None) # `cli_group=None` puts the bp's commands (`import-list`) at the top level of the `flask` command.
 
-bp = Blueprint('master_lists', __name__, url_prefix='/master-lists')
+IMPORT_FORMATS = ('csv', 'jsonl')
+IMPORT_CHUNK_SIZE = 1000 # items per `executemany` batch during imports.
+RESERVED_COLUMNS = ('id', 'name', 'created') # import columns that are not master details.
+EXPORT_MIMETYPES = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+EXPORT_BUFFER_SIZE = 64 * 1024 # characters collected before a chunk of an export is sent.
+HIGHLIGHT_START, HIGHLIGHT_END = '\x02', '\x03' # search match markers, swapped for <mark> tags after the text is escaped.
+SEARCH_MIN_PREFIX = 3 # shorter words only match whole words; a one- or two-letter prefix matches most of a list.
+GRID_COLUMNS = ('id', 'name', 'created') # grid columns besides master details, which are addressed by detail id.
+GRID_FILTER_OPS = ('eq', 'contains', 'min', 'max')
+CELL_NUMBER_SQL = "(CASE WHEN {0} GLOB '*[0-9]*' THEN CAST({0} AS REAL) END)" # a cell as a number (NULL if it has no digit); indexed by migration 0004, so keep them in sync.
 
 @bp.route('/')
 @login_required
@@ -29,13 +48,12 @@ def new():
         if error is not None:
             flash(error)
         else:
-            db = get_db()
-            db.execute(
+            creator_id = g.user['id']
+            run_write(lambda db: db.execute(
                 'INSERT INTO master_lists (name, description, creator_id)'
                 ' VALUES (?, ?, ?)',
-                (name, description, g.user['id'])
-            )
-            db.commit()
+                (name, description, creator_id)
+            ))
             return redirect(url_for('master_lists.index'))
     return render_template('master-lists/new.html')
 
@@ -43,15 +61,21 @@ def new():
 @bp.route('/<int:master_list_id>/view')
 @login_required
 def view(master_list_id):
-    master_list = get_master_list(master_list_id)
-    return render_template('master-lists/view.html', master_list=master_list)
+    after = request.args.get('after', type=int)
+    limit = get_page_limit(request.args.get('limit', type=int))
+    master_list = get_master_list(master_list_id, with_master_items=False)
+    grid = get_grid_query(request.args, master_list['master_details'])
+    master_list['master_items'], page = get_master_items_page(
+        master_list_id, master_list['master_details'], after, limit, grid['sort'], grid['filters']
+    )
+    return render_template('master-lists/view.html', master_list=master_list, page=page, grid=grid)
 
 
 @bp.route('/<int:master_list_id>/edit', methods=('GET', 'POST'))
 @login_required
 @admin_only
 def edit(master_list_id):
-    master_list = get_master_list(master_list_id)
+    master_list = get_master_list(master_list_id, with_master_items=False)
     if request.method == "POST":
         name = request.form['name']
         description = request.form['description']
@@ -61,13 +85,11 @@ def edit(master_list_id):
         if error is not None:
             flash(error)
         else:
-            db = get_db()
-            db.execute(
+            run_write(lambda db: db.execute(
                 'UPDATE master_lists SET name = ?, description = ?'
                 ' WHERE id = ?',
                 (name, description, master_list_id)
-            )
-            db.commit()
+            ))
             return redirect(url_for('master_lists.index'))
     return render_template("master-lists/edit.html", master_list=master_list)
 
@@ -76,36 +98,9 @@ def edit(master_list_id):
 @login_required
 @admin_only
 def delete(master_list_id):
-    master_list = get_master_list(master_list_id)
-    db = get_db()
-    # Delete master-related details
-    db.execute(
-        'DELETE FROM master_details'
-        ' WHERE id IN'
-        ' (SELECT master_detail_id FROM master_list_detail_relations WHERE master_list_id = ?)',
-        (master_list_id,)
-    )
-    # Delete master-related items
-    db.execute(
-        'DELETE FROM master_items'
-        ' WHERE id IN'
-        ' (SELECT master_item_id FROM master_list_item_relations WHERE master_list_id = ?)',
-        (master_list_id,)
-    )
-    # Delete item-detail relations
-    db.execute(
-        'DELETE FROM master_item_detail_relations'
-        ' WHERE master_item_id IN'
-        ' (SELECT master_item_id FROM master_list_item_relations WHERE master_list_id = ?)',
-        (master_list_id,)
-    )
-    # Delete master-item relations
-    db.execute('DELETE FROM master_list_item_relations WHERE master_list_id = ?',(master_list_id,))
-    # Delete master-detail relations
-    db.execute('DELETE FROM master_list_detail_relations WHERE master_list_id = ?', (master_list_id,))
-    # Delete master
-    db.execute('DELETE FROM master_lists WHERE id = ?', (master_list_id,))
-    db.commit()
+    master_list = get_master_list(master_list_id, with_master_items=False)
+    # cascades to the list's relations, whose triggers delete its items and details, which cascade to their cells
+    run_write(lambda db: db.execute('DELETE FROM master_lists WHERE id = ?', (master_list_id,)))
     return redirect(url_for('master_lists.index'))
 
 
@@ -113,7 +108,7 @@ def delete(master_list_id):
 @login_required
 @admin_only
 def new_master_item(master_list_id):
-    master_list = get_master_list(master_list_id)
+    master_list = get_master_list(master_list_id, with_master_items=False)
     if request.method == "POST":
         name = request.form['name']
         master_detail_contents = []
@@ -128,28 +123,7 @@ def new_master_item(master_list_id):
         if error is not None:
             flash(error)
         else:
-            db = get_db()
-            cur = db.cursor()
-            cur.execute(
-                'INSERT INTO master_items (name, creator_id)'
-                ' VALUES (?, ?)',
-                (name, g.user['id'])
-            )
-            master_item_id = cur.lastrowid
-            cur.execute(
-                'INSERT INTO master_list_item_relations (master_list_id, master_item_id)'
-                ' VALUES (?, ?)',
-                (master_list_id, master_item_id)
-            )
-            master_i_d_relations = []
-            for master_detail_content in master_detail_contents:
-                master_i_d_relations.append((master_item_id,) + master_detail_content)
-            cur.executemany(
-                'INSERT INTO master_item_detail_relations (master_item_id, master_detail_id, master_content)'
-                ' VALUES(?, ?, ?)',
-                master_i_d_relations
-            )
-            db.commit()
+            insert_master_item(master_list_id, name, g.user['id'], master_detail_contents)
             return redirect(url_for('master_lists.view', master_list_id=master_list_id))
     return render_template("master-lists/master-items/new.html", master_list=master_list)
 
@@ -157,24 +131,15 @@ def new_master_item(master_list_id):
 @bp.route("<int:master_list_id>/master-items/<int:master_item_id>/view")
 @login_required
 def view_master_item(master_list_id, master_item_id):
-    master_list = get_master_list(master_list_id)
-    requested_master_item = None
-    for master_item in master_list['master_items']:
-        if master_item['id'] == master_item_id:
-            requested_master_item = master_item
-    if not requested_master_item:
-        abort(404)
-    return render_template("master-lists/master-items/view.html", master_list=master_list, master_item=requested_master_item, master_details=master_list["master_details"])
+    master_list, master_item = get_master_item(master_list_id, master_item_id)
+    return render_template("master-lists/master-items/view.html", master_list=master_list, master_item=master_item, master_details=master_list["master_details"])
 
 
 @bp.route("<int:master_list_id>/master-items/<int:master_item_id>/edit", methods=("GET", "POST"))
 @login_required
 @admin_only
 def edit_master_item(master_list_id, master_item_id):
-    master_list = get_master_list(master_list_id)
-    requested_master_item = next((master_item for master_item in master_list["master_items"] if master_item["id"] == master_item_id), None)
-    if not requested_master_item:
-        abort(404)
+    master_list, master_item = get_master_item(master_list_id, master_item_id)
     if request.method == "POST":
         name = request.form['name']
         master_i_d_relations = []
@@ -182,49 +147,24 @@ def edit_master_item(master_list_id, master_item_id):
         for master_detail in master_details:
             master_detail_id = master_detail['id']
             master_detail_content = request.form[str(master_detail_id)]
-            master_i_d_relations.append((master_detail_content, master_item_id, master_detail_id))
+            master_i_d_relations.append((master_item_id, master_detail_id, master_detail_content))
         error = None
         if not name:
             error = 'Name is required.'
         if error is not None:
             flash(error)
         else:
-            db = get_db()
-            db.execute(
-                'UPDATE master_items SET name = ?'
-                ' WHERE id = ?',
-                (name, master_item_id)
-            )
-            db.executemany(
-                'UPDATE master_item_detail_relations'
-                ' SET master_content = ?'
-                ' WHERE master_item_id = ?'
-                ' AND master_detail_id = ?',
-                master_i_d_relations
-            )
-            db.commit()
+            update_master_item(master_item_id, name, master_i_d_relations)
             return redirect(url_for('master_lists.view', master_list_id=master_list_id))
-    return render_template("master-lists/master-items/edit.html", master_list=master_list, master_item=requested_master_item)
+    return render_template("master-lists/master-items/edit.html", master_list=master_list, master_item=master_item)
 
 
 @bp.route("<int:master_list_id>/master-items/<int:master_item_id>/delete", methods=("POST",))
 @login_required
 @admin_only
 def delete_master_item(master_list_id, master_item_id):
-    master_list = get_master_list(master_list_id)
-    requested_master_item = next((master_item for master_item in master_list["master_items"] if master_item["id"] == master_item_id), None)
-    if not requested_master_item:
-        abort(404)
-    master_details = master_list["master_details"]
-    db = get_db()
-    db.execute('DELETE FROM master_items WHERE id = ?', (master_item_id,))
-    db.execute('DELETE FROM master_item_detail_relations WHERE master_item_id = ?', (master_item_id,))
-    db.execute(
-        'DELETE from master_list_item_relations'
-        ' WHERE master_list_id = ? AND master_item_id = ?',
-        (master_list_id, master_item_id)
-    )
-    db.commit()
+    get_master_item(master_list_id, master_item_id)
+    run_write(lambda db: db.execute('DELETE FROM master_items WHERE id = ?', (master_item_id,))) # cascades to its cells and list relation
     return redirect(url_for('master_lists.view', master_list_id=master_list_id))
 
 
@@ -232,7 +172,7 @@ def delete_master_item(master_list_id, master_item_id):
 @login_required
 @admin_only
 def new_master_detail(master_list_id):
-    master_list = get_master_list(master_list_id)
+    master_list = get_master_list(master_list_id, with_master_items=False)
     if request.method == "POST":
         name = request.form['name']
         description = request.form['description']
@@ -242,27 +182,7 @@ def new_master_detail(master_list_id):
         if error is not None:
             flash(error)
         else:
-            db = get_db()
-            cur = db.cursor()
-            cur.execute(
-                'INSERT INTO master_details (name, description, creator_id)'
-                ' VALUES (?, ?, ?)',
-                (name, description, g.user['id'])
-            )
-            master_detail_id = cur.lastrowid
-            cur.execute(
-                'INSERT INTO master_list_detail_relations (master_list_id, master_detail_id)'
-                ' VALUES (?, ?)',
-                (master_list_id, master_detail_id)
-            )
-            master_items = master_list["master_items"]
-            data = [(master_item['id'], master_detail_id, '') for master_item in master_items]
-            cur.executemany(
-                'INSERT INTO master_item_detail_relations (master_item_id, master_detail_id, master_content)'
-                'VALUES (?, ?, ?)',
-                data
-            )
-            db.commit()
+            create_master_detail(master_list_id, name, description, g.user['id']) # no cells: existing items read as empty for the new detail until they're edited
             return redirect(url_for('master_lists.view', master_list_id=master_list["id"]))
     return render_template("master-lists/master-details/new.html", master_list=master_list)
 
@@ -271,7 +191,7 @@ def new_master_detail(master_list_id):
 @login_required
 @admin_only
 def edit_master_detail(master_list_id, master_detail_id):
-    master_list = get_master_list(master_list_id)
+    master_list = get_master_list(master_list_id, with_master_items=False)
     requested_master_detail = next((master_detail for master_detail in master_list["master_details"] if master_detail["id"] == master_detail_id), None)
     if requested_master_detail is None:
         abort(404)
@@ -284,13 +204,11 @@ def edit_master_detail(master_list_id, master_detail_id):
         if error is not None:
             flash(error)
         else:
-            db = get_db()
-            db.execute(
+            run_write(lambda db: db.execute(
                 'UPDATE master_details SET name = ?, description = ?'
                 ' WHERE id = ?',
                 (name, description, master_detail_id)
-            )
-            db.commit()
+            ))
             return redirect(url_for('master_lists.view', master_list_id=master_list_id))
     return render_template("master-lists/master-details/edit.html", master_list=master_list, master_detail=requested_master_detail)
 
@@ -299,18 +217,93 @@ def edit_master_detail(master_list_id, master_detail_id):
 @login_required
 @admin_only
 def delete_master_detail(master_list_id, master_detail_id):
-    master_list = get_master_list(master_list_id)
+    master_list = get_master_list(master_list_id, with_master_items=False)
     requested_master_detail = next((master_detail for master_detail in master_list["master_details"] if master_detail["id"] == master_detail_id), None)
     if not requested_master_detail:
         abort(404)
-    db = get_db()
-    db.execute('DELETE FROM master_details WHERE id = ?', (master_detail_id,))
-    db.execute('DELETE FROM master_item_detail_relations WHERE master_detail_id = ?', (master_detail_id,))
-    db.execute('DELETE FROM master_list_detail_relations WHERE master_detail_id = ?', (master_detail_id,))
-    db.commit()
+    run_write(lambda db: db.execute('DELETE FROM master_details WHERE id = ?', (master_detail_id,))) # cascades to its cells and list relation
     return redirect(url_for('master_lists.view', master_list_id=master_list_id))
 
 
+@bp.route('/<int:master_list_id>/search')
+@login_required
+def search(master_list_id):
+    master_list = get_master_list(master_list_id, with_master_items=False)
+    q = request.args.get('q', '').strip()
+    page_number = max(request.args.get('page', 1, type=int), 1)
+    limit = current_app.config['SEARCH_RESULTS_PER_PAGE']
+    hits, hit_count = search_master_list(master_list_id, q, limit, (page_number - 1) * limit) if q else ([], 0)
+    page = {
+        'number': page_number,
+        'count': hit_count,
+        'has_prev': page_number > 1,
+        'has_next': page_number * limit < hit_count,
+    }
+    return render_template('master-lists/search.html', master_list=master_list, q=q, hits=hits, page=page)
+
+
+@bp.route('/<int:master_list_id>/import', methods=('GET', 'POST'))
+@login_required
+@admin_only
+def import_master_items(master_list_id):
+    master_list = get_master_list(master_list_id, with_master_items=False)
+    if request.method == 'POST':
+        file = request.files.get('file')
+        error = None
+        if not file or not file.filename:
+            error = 'File is required.'
+        else:
+            file_format = request.form.get('format') or guess_import_format(file.filename)
+            try:
+                stream = io.TextIOWrapper(file.stream, encoding='utf-8-sig', newline='')
+                counts = import_rows(master_list, read_import_rows(stream, file_format))
+            except ValueError as e:
+                error = str(e)
+            except csv.Error as e: # like a field over `csv.field_size_limit()`
+                error = f'Invalid CSV: {e}.'
+        if error is not None:
+            flash(error)
+        else:
+            flash(f"Imported {counts['master_items']} items and {counts['master_contents']} cells.")
+            return redirect(url_for('master_lists.view', master_list_id=master_list_id))
+    return render_template('master-lists/import.html', master_list=master_list, import_formats=IMPORT_FORMATS)
+
+
+@bp.cli.command('import-list')
+@click.argument('master_list_id', type=int)
+@click.argument('file', type=click.File('r', encoding='utf-8-sig'))
+@click.option('--format', 'file_format', type=click.Choice(IMPORT_FORMATS), help='Defaults to the file extension.')
+@with_appcontext
+def import_list_command(master_list_id, file, file_format):
+    '''Import master items into a master list from a CSV or JSONL file.'''
+    try:
+        master_list = get_master_list(master_list_id, check_access=False, with_master_items=False)
+    except NotFound:
+        raise click.ClickException(f'Master list {master_list_id} does not exist.')
+    try:
+        counts = import_rows(master_list, read_import_rows(file, file_format or guess_import_format(file.name)))
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    except csv.Error as e:
+        raise click.ClickException(f'Invalid CSV: {e}.')
+    click.echo(f"Imported {counts['master_items']} items, {counts['master_contents']} cells and {counts['master_details']} new details.")
+
+
+@bp.route('/<int:master_list_id>/export.<any(csv, ndjson):file_format>')
+@login_required
+@admin_only
+def export_master_items(master_list_id, file_format):
+    master_list = get_master_list(master_list_id, with_master_items=False)
+    columns = list(RESERVED_COLUMNS) + get_master_detail_labels(master_list['master_details'])
+    rows = iter_master_items(master_list_id, master_list['master_details'])
+    chunks = export_csv(columns, rows) if file_format == 'csv' else export_ndjson(columns, rows)
+    return current_app.response_class(
+        stream_with_context(chunks), # keeps the app context (and the db connection) alive while the response streams.
+        mimetype=EXPORT_MIMETYPES[file_format],
+        headers={'Content-Disposition': f'attachment; filename=master-list-{master_list_id}.{file_format}'},
+    )
+
+
 def get_master_lists():
     db = get_db()
     master_lists = db.execute(
@@ -322,22 +315,22 @@ def get_master_lists():
     return master_lists
 
 
-def get_master_list(master_list_id, check_access=True):
+def get_master_list(master_list_id, check_access=True, with_master_items=True):
     db = get_db()
-    master_list = db.execute(
-        'SELECT m.id, m.creator_id, m.created, m.name, m.description'
-        ' FROM master_lists m'
-        ' WHERE m.id = ?',
+    master_list = get_owned_row('master_lists', master_list_id, 'id, created, name, description', check_access)
+    master_list_ext = dict(master_list)
+    master_details = db.execute(
+        'SELECT d.id, d.name, d.description'
+        ' FROM master_details d'
+        ' JOIN master_list_detail_relations m'
+        ' ON m.master_detail_id = d.id'
+        ' WHERE m.master_list_id = ?'
+        ' ORDER BY d.id',
         (master_list_id,)
-    ).fetchone()
-    if master_list is None:
-        abort(404)
-    if check_access:
-        if master_list['creator_id'] != g.user['id']:
-            abort(403)
-    master_list_ext = {}
-    for key in master_list.keys():
-        master_list_ext[key] = master_list[key]
+    ).fetchall()
+    master_list_ext['master_details'] = master_details
+    if not with_master_items:
+        return master_list_ext
     master_items = db.execute(
         'SELECT i.id, i.name, i.created, u.username'
         ' FROM master_items i'
@@ -348,34 +341,532 @@ def get_master_list(master_list_id, check_access=True):
         ' WHERE m.master_list_id = ?',
         (master_list_id,)
     ).fetchall()
-    master_list_ext['master_items'] = []
-    for master_item in master_items:
-        new_master_item = {}
-        for key in master_item.keys():
-            new_master_item[key] = master_item[key]
-        new_master_item['master_contents'] = []
-        master_item_id = str(master_item['id'])
-        master_list_ext['master_items'].append(new_master_item)
-    master_details = db.execute(
-        'SELECT d.id, d.name, d.description'
-        ' FROM master_details d'
-        ' JOIN master_list_detail_relations m'
-        ' ON m.master_detail_id = d.id'
-        ' WHERE m.master_list_id = ?',
-        (master_list_id,)
-    ).fetchall()
-    master_list_ext['master_details'] = master_details
     master_contents = db.execute(
-        'SELECT master_item_id, master_content'
+        'SELECT master_item_id, master_detail_id, master_content'
         ' FROM master_item_detail_relations'
         ' WHERE master_detail_id IN'
         ' (SELECT master_detail_id'
         '  FROM master_list_detail_relations'
         '  WHERE master_list_id = ?)',
         (master_list_id,)
+    )
+    master_list_ext['master_items'] = build_master_grid(master_items, master_details, master_contents)
+    return master_list_ext
+
+
+def get_master_item(master_list_id, master_item_id, check_access=True):
+    '''Loads one item of a master list, with one cell per master detail of the list, in a single indexed query. Returns `(master_list, master_item)`; 404s if the item isn't in the list.'''
+    owned_list = get_owned_row('master_lists', master_list_id, 'id, name, description', check_access) # before the item's rows, one per detail
+    db = get_db()
+    rows = db.execute(
+        'SELECT i.id, i.name, i.created, u.username,'
+        ' d.id AS master_detail_id, d.name AS master_detail_name, d.description AS master_detail_description,'
+        ' c.master_content'
+        ' FROM master_list_item_relations r'
+        ' JOIN master_items i ON i.id = r.master_item_id'
+        ' JOIN users u ON u.id = i.creator_id'
+        ' LEFT JOIN master_list_detail_relations m ON m.master_list_id = r.master_list_id'
+        ' LEFT JOIN master_details d ON d.id = m.master_detail_id'
+        ' LEFT JOIN master_item_detail_relations c'
+        ' ON c.master_item_id = r.master_item_id AND c.master_detail_id = m.master_detail_id'
+        ' WHERE r.master_list_id = ? AND r.master_item_id = ?'
+        ' ORDER BY m.master_detail_id',
+        (master_list_id, master_item_id)
+    ).fetchall()
+    if not rows:
+        abort(404)
+    first = rows[0]
+    master_details = [
+        {'id': row['master_detail_id'], 'name': row['master_detail_name'], 'description': row['master_detail_description']}
+        for row in rows if row['master_detail_id'] is not None
+    ]
+    master_list = {
+        'id': owned_list['id'],
+        'creator_id': owned_list['creator_id'],
+        'name': owned_list['name'],
+        'description': owned_list['description'],
+        'master_details': master_details,
+    }
+    master_item = {
+        'id': first['id'],
+        'name': first['name'],
+        'created': first['created'],
+        'username': first['username'],
+        'master_contents': [row['master_content'] or '' for row in rows if row['master_detail_id'] is not None],
+    }
+    return master_list, master_item
+
+
+def get_page_limit(limit=None):
+    '''Clamps a requested page size to `MASTER_ITEMS_MAX_PER_PAGE`, falling back to `MASTER_ITEMS_PER_PAGE`.'''
+    if limit is None or limit < 1:
+        return current_app.config['MASTER_ITEMS_PER_PAGE']
+    return min(limit, current_app.config['MASTER_ITEMS_MAX_PER_PAGE'])
+
+
+def get_grid_query(args, master_details):
+    '''Reads the grid's sort (`sort=<column>`, `-` prefixed for descending) and filters (repeated `column`, `op` and `value` args) from request args, dropping unknown columns, ops and empty values. Also returns the args to carry them over to other pages.'''
+    columns = GRID_COLUMNS + tuple(str(master_detail['id']) for master_detail in master_details)
+    sort = args.get('sort')
+    if sort is not None and sort.removeprefix('-') not in columns:
+        sort = None
+    filters = [
+        (column, op, value)
+        for column, op, value in zip(args.getlist('column'), args.getlist('op'), args.getlist('value'))
+        if column in columns and column != 'id' and op in GRID_FILTER_OPS and value != '' # ids are for sorting only
+    ]
+    return {
+        'sort': sort,
+        'filters': filters,
+        'args': {
+            'sort': sort,
+            'column': [column for column, op, value in filters],
+            'op': [op for column, op, value in filters],
+            'value': [value for column, op, value in filters],
+        },
+    }
+
+
+def get_master_items_page(master_list_id, master_details, after=None, limit=100, sort=None, filters=()):
+    '''Returns one page of a master list's items with only their cells, plus the page's navigation info. Items are paged by their sort key and id after the `after` item (keyset pagination), and filtered in SQL, so pages combine with sorting and filtering and never load more than one page.'''
+    db = get_db()
+    descending = sort is not None and sort.startswith('-')
+    sort = sort.removeprefix('-') if sort else 'id'
+    joins = ''
+    join_params = []
+    if sort == 'id':
+        keys = ['m.master_item_id']
+    elif sort in ('name', 'created'):
+        keys = [f'i.{sort}', 'm.master_item_id']
+    else:
+        # missing cells sort as empty ones
+        joins = (
+            ' LEFT JOIN master_item_detail_relations s'
+            ' ON s.master_item_id = m.master_item_id AND s.master_detail_id = ?'
+        )
+        join_params = [int(sort)]
+        keys = ["COALESCE(s.master_content, '')", 'm.master_item_id']
+    filter_sql, filter_params = get_grid_filters(filters)
+    from_sql = (
+        ' FROM master_list_item_relations m'
+        ' JOIN master_items i'
+        ' ON i.id = m.master_item_id'
+        ' JOIN users u'
+        ' ON u.id = i.creator_id'
+        f'{joins}'
+        f' WHERE m.master_list_id = ?{filter_sql}'
+    )
+    from_params = join_params + [master_list_id] + filter_params
+    key_sql = f'({", ".join(keys)})'
+    cursor = [after]
+    if after and len(keys) > 1:
+        # the cursor item's sort key, as stored (text) so it compares like the column
+        cursor_key = db.execute(
+            f'SELECT CAST({keys[0]} AS TEXT)'
+            ' FROM master_list_item_relations m'
+            ' JOIN master_items i'
+            ' ON i.id = m.master_item_id'
+            f'{joins}'
+            ' WHERE m.master_list_id = ? AND m.master_item_id = ?',
+            join_params + [master_list_id, after]
+        ).fetchone()
+        # a deleted cursor item starts over at the first page
+        after = after if cursor_key else None
+        cursor = [cursor_key[0] if cursor_key else None, after]
+    cursor_value_sql = f'({", ".join("?" * len(keys))})'
+
+    def order_by(reverse):
+        return ', '.join(key + (' DESC' if reverse else '') for key in keys)
+
+    cursor_sql = f' AND {key_sql} {"<" if descending else ">"} {cursor_value_sql}' if after else ''
+    master_items = db.execute(
+        'SELECT i.id, i.name, i.created, u.username'
+        f'{from_sql}{cursor_sql}'
+        ' ORDER BY ' + order_by(descending) +
+        ' LIMIT ?',
+        from_params + (cursor if after else []) + [limit + 1]
     ).fetchall()
-    for master_content in master_contents:
-        master_item_id = master_content['master_item_id']
-        master_item = next((master_item for master_item in master_list_ext["master_items"] if master_item["id"] == master_item_id), None)
-        master_item['master_contents'].append(master_content['master_content'])
-    return master_list_ext 
+    has_next = len(master_items) > limit
+    master_items = master_items[:limit]
+    master_item_ids = [master_item['id'] for master_item in master_items]
+    master_contents = db.execute(
+        'SELECT master_item_id, master_detail_id, master_content'
+        ' FROM master_item_detail_relations'
+        f' WHERE master_item_id IN ({", ".join("?" * len(master_item_ids))})',
+        master_item_ids
+    )
+    # the items up to and including the cursor, walking backwards: the one after the previous page's items is its cursor
+    previous_ids = db.execute(
+        'SELECT m.master_item_id'
+        f'{from_sql} AND {key_sql} {">=" if descending else "<="} {cursor_value_sql}'
+        ' ORDER BY ' + order_by(not descending) +
+        ' LIMIT ?',
+        from_params + cursor + [limit + 1]
+    ).fetchall() if after else []
+    master_item_count = db.execute(
+        'SELECT COUNT(*)'
+        ' FROM master_list_item_relations m'
+        # only filters on names and creation dates need the items table
+        f'{" JOIN master_items i ON i.id = m.master_item_id" if any(column in GRID_COLUMNS for column, op, value in filters) else ""}'
+        f' WHERE m.master_list_id = ?{filter_sql}',
+        [master_list_id] + filter_params
+    ).fetchone()[0]
+    page = {
+        'limit': limit,
+        'count': master_item_count,
+        'has_prev': bool(previous_ids),
+        'prev_after': previous_ids[limit]['master_item_id'] if len(previous_ids) > limit else None,
+        'next_after': master_item_ids[-1] if has_next else None,
+    }
+    return build_master_grid(master_items, master_details, master_contents), page
+
+
+def get_grid_filters(filters):
+    '''Turns grid filters into SQL conditions on the items of a list (`m`) and their rows (`i`), with their params. Each filtered detail is one subquery on the cell indexes; ranges compare numerically when the bound is a number.'''
+    conditions = []
+    params = []
+    cell_conditions = {}
+    for column, op, value in filters:
+        if op == 'contains':
+            condition, value = "{} LIKE ? ESCAPE '\\'", '%' + value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        elif op in ('min', 'max') and is_number(value):
+            condition, value = CELL_NUMBER_SQL + (' >= ?' if op == 'min' else ' <= ?'), float(value)
+        else:
+            condition = '{} ' + {'eq': '=', 'min': '>=', 'max': '<='}[op] + ' ?'
+        if column in GRID_COLUMNS:
+            conditions.append(condition.format(f'i.{column}'))
+            params.append(value)
+        else:
+            cell_conditions.setdefault(int(column), []).append((condition.format('master_content'), value))
+    for master_detail_id, detail_conditions in cell_conditions.items():
+        conditions.append(
+            'm.master_item_id IN (SELECT master_item_id FROM master_item_detail_relations'
+            ' WHERE master_detail_id = ?' + ''.join(f' AND {condition}' for condition, value in detail_conditions) + ')'
+        )
+        params += [master_detail_id] + [value for condition, value in detail_conditions]
+    return ''.join(f' AND {condition}' for condition in conditions), params
+
+
+def is_number(value):
+    try:
+        float(value)
+    except ValueError:
+        return False
+    return True
+
+
+class GridRow:
+    '''An item of the master list table: its database row, read through rather than copied into a dict, and its `master_contents`.'''
+    __slots__ = ('master_item', 'master_contents')
+
+    def __init__(self, master_item, master_contents):
+        self.master_item = master_item
+        self.master_contents = master_contents
+
+    def __getitem__(self, key):
+        if key == 'master_contents':
+            return self.master_contents
+        return self.master_item[key]
+
+
+def build_master_grid(master_items, master_details, master_contents):
+    '''Assembles the master list table in one pass from item rows and `(master_item_id, master_detail_id, master_content)` rows. Each item gets one `master_contents` slot per master detail, in header order, so columns line up even where a cell is missing.'''
+    columns = {master_detail['id']: column for column, master_detail in enumerate(master_details)}
+    rows = {}
+    grid = []
+    for master_item in master_items:
+        row = GridRow(master_item, [''] * len(columns))
+        rows[master_item['id']] = row
+        grid.append(row)
+    for master_item_id, master_detail_id, master_content in master_contents: # unpacked, rows are read at C speed
+        row = rows.get(master_item_id)
+        column = columns.get(master_detail_id)
+        if row is not None and column is not None:
+            row.master_contents[column] = master_content
+    return grid
+
+
+def guess_import_format(filename):
+    return 'jsonl' if filename.lower().endswith(('.jsonl', '.ndjson')) else 'csv'
+
+
+def read_import_rows(stream, file_format):
+    '''Lazily parses a CSV (with a header row) or JSONL text stream into `(line_number, row_dict)` pairs.'''
+    if file_format == 'csv':
+        reader = csv.DictReader(stream)
+        columns = reader.fieldnames or ()
+        if 'name' not in columns:
+            raise ValueError('The file needs a name column.')
+        for column_number, column in enumerate(columns, start=1):
+            if not column.strip():
+                raise ValueError(f'Line {reader.line_num}: column {column_number} has no name.')
+            if column in columns[:column_number - 1]: # `DictReader` would keep only the last one's values
+                raise ValueError(f'Line {reader.line_num}: column {column} appears more than once.')
+        for row in reader:
+            yield reader.line_num, row
+    elif file_format == 'jsonl':
+        for line_number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError:
+                raise ValueError(f'Line {line_number}: invalid JSON.')
+            if not isinstance(row, dict):
+                raise ValueError(f'Line {line_number}: expected a JSON object.')
+            yield line_number, row
+    else:
+        raise ValueError(f'Unknown format {file_format}.')
+
+
+def import_rows(master_list, rows, chunk_size=IMPORT_CHUNK_SIZE):
+    '''Inserts parsed import rows as items of `master_list` in a single transaction, one `executemany` per chunk so memory stays bounded. `name` is the item name; every other column is a master detail, matched by name (or by its export label) or created. Any invalid row rolls back the whole import.'''
+    master_list_id = master_list['id']
+    creator_id = master_list['creator_id']
+    counts = {'master_items': 0, 'master_contents': 0, 'master_details': 0}
+    # takes the write lock up front, so nobody else can claim the item ids assigned below. `rows` may be a stream read as it goes, so the import can't be retried once begun.
+    with transaction() as db:
+        master_details = db.execute(
+            'SELECT d.id, d.name'
+            ' FROM master_details d'
+            ' JOIN master_list_detail_relations m'
+            ' ON m.master_detail_id = d.id'
+            ' WHERE m.master_list_id = ?'
+            ' ORDER BY d.id',
+            (master_list_id,)
+        ).fetchall()
+        master_detail_ids = {master_detail['name']: master_detail['id'] for master_detail in master_details}
+        # the columns of an export of this list name their details unambiguously
+        master_detail_ids.update(zip(get_master_detail_labels(master_details), (master_detail['id'] for master_detail in master_details)))
+        next_master_item_id = db.execute(
+            "SELECT MAX(COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'master_items'), 0),"
+            " COALESCE((SELECT MAX(id) FROM master_items), 0)) + 1"
+        ).fetchone()[0]
+        master_items, master_contents = [], []
+
+        def flush():
+            db.executemany('INSERT INTO master_items (id, name, creator_id) VALUES (?, ?, ?)', master_items)
+            db.executemany(
+                'INSERT INTO master_list_item_relations (master_list_id, master_item_id) VALUES (?, ?)',
+                [(master_list_id, master_item[0]) for master_item in master_items]
+            )
+            db.executemany(
+                'INSERT INTO master_item_detail_relations (master_item_id, master_detail_id, master_content)'
+                ' VALUES (?, ?, ?)',
+                master_contents
+            )
+            counts['master_items'] += len(master_items)
+            counts['master_contents'] += len(master_contents)
+            master_items.clear()
+            master_contents.clear()
+
+        for line_number, row in rows:
+            name = row.get('name')
+            if not name:
+                raise ValueError(f'Line {line_number}: name is required.')
+            for column in row:
+                if column is None:
+                    raise ValueError(f'Line {line_number}: more values than columns.')
+                if column not in RESERVED_COLUMNS and column not in master_detail_ids:
+                    if not column.strip():
+                        raise ValueError(f'Line {line_number}: a column has no name.')
+                    master_detail_ids[column] = add_master_detail(db, master_list_id, column, '', creator_id)
+                    counts['master_details'] += 1
+            master_item_id = next_master_item_id
+            next_master_item_id += 1
+            master_items.append((master_item_id, str(name), creator_id))
+            for column, value in row.items():
+                if column in RESERVED_COLUMNS or value is None or value == '':
+                    continue # cells are sparse: empty ones aren't stored
+                if not isinstance(value, str):
+                    value = json.dumps(value)
+                master_contents.append((master_item_id, master_detail_ids[column], value))
+            if len(master_items) >= chunk_size:
+                flush()
+        flush()
+    return counts
+
+
+@transactional
+def insert_master_item(db, master_list_id, name, creator_id, master_detail_contents):
+    '''Adds an item to a master list with its filled cells, from `(master_detail_id, master_content)` pairs. Returns its id.'''
+    master_item_id = db.execute(
+        'INSERT INTO master_items (name, creator_id)'
+        ' VALUES (?, ?)',
+        (name, creator_id)
+    ).lastrowid
+    db.execute(
+        'INSERT INTO master_list_item_relations (master_list_id, master_item_id)'
+        ' VALUES (?, ?)',
+        (master_list_id, master_item_id)
+    )
+    db.executemany(
+        'INSERT INTO master_item_detail_relations (master_item_id, master_detail_id, master_content)'
+        ' VALUES(?, ?, ?)',
+        # cells are sparse: an empty one is simply not stored
+        [(master_item_id,) + master_detail_content for master_detail_content in master_detail_contents if master_detail_content[1]]
+    )
+    return master_item_id
+
+
+@transactional
+def update_master_item(db, master_item_id, name, master_i_d_relations):
+    '''Renames an item and sets its cells, from `(master_item_id, master_detail_id, master_content)` triples.'''
+    db.execute(
+        'UPDATE master_items SET name = ?'
+        ' WHERE id = ?',
+        (name, master_item_id)
+    )
+    # cells are sparse: filled ones are upserted (the item may not have had one yet), emptied ones removed
+    db.executemany(
+        'INSERT INTO master_item_detail_relations (master_item_id, master_detail_id, master_content)'
+        ' VALUES (?, ?, ?)'
+        ' ON CONFLICT (master_item_id, master_detail_id)'
+        ' DO UPDATE SET master_content = excluded.master_content',
+        [master_i_d_relation for master_i_d_relation in master_i_d_relations if master_i_d_relation[2]]
+    )
+    db.executemany(
+        'DELETE FROM master_item_detail_relations'
+        ' WHERE master_item_id = ? AND master_detail_id = ?',
+        [master_i_d_relation[:2] for master_i_d_relation in master_i_d_relations if not master_i_d_relation[2]]
+    )
+
+
+def add_master_detail(db, master_list_id, name, description, creator_id):
+    '''Adds a master detail to a list inside the caller's transaction. Returns its id.'''
+    master_detail_id = db.execute(
+        'INSERT INTO master_details (name, description, creator_id) VALUES (?, ?, ?)',
+        (name, description, creator_id)
+    ).lastrowid
+    db.execute(
+        'INSERT INTO master_list_detail_relations (master_list_id, master_detail_id) VALUES (?, ?)',
+        (master_list_id, master_detail_id)
+    )
+    return master_detail_id
+
+
+create_master_detail = transactional(add_master_detail) # the same in its own transaction
+
+
+def get_master_detail_labels(master_details):
+    '''Returns the export column of each master detail: its name, or if that's one of the `RESERVED_COLUMNS` or another detail's name too, its name suffixed with its id (`color #4`), so that no column overwrites another in a JSON object or on import.'''
+    names = collections.Counter(master_detail['name'] for master_detail in master_details)
+    labels = []
+    used = set(RESERVED_COLUMNS)
+    for master_detail in master_details:
+        label = master_detail['name']
+        if label in RESERVED_COLUMNS or names[label] > 1:
+            label = f"{label} #{master_detail['id']}"
+        while label in used: # another detail's name is literally this label
+            label = f"{label} #{master_detail['id']}"
+        used.add(label)
+        labels.append(label)
+    return labels
+
+
+def iter_master_items(master_list_id, master_details):
+    '''Yields `[id, name, created, *master_contents]` for each item of a master list, reading one cursor row at a time instead of loading the list.'''
+    columns = {master_detail['id']: column for column, master_detail in enumerate(master_details, start=3)}
+    cur = get_db().execute(
+        'SELECT i.id, i.name, i.created, c.master_detail_id, c.master_content'
+        ' FROM master_list_item_relations m'
+        ' JOIN master_items i'
+        ' ON i.id = m.master_item_id'
+        ' LEFT JOIN master_item_detail_relations c'
+        ' ON c.master_item_id = m.master_item_id'
+        ' WHERE m.master_list_id = ?'
+        ' ORDER BY m.master_item_id',
+        (master_list_id,)
+    )
+    row = None
+    for master_item_id, name, created, master_detail_id, master_content in cur:
+        if row is None or row[0] != master_item_id:
+            if row is not None:
+                yield row
+            row = [master_item_id, name, str(created)] + [''] * len(master_details)
+        column = columns.get(master_detail_id)
+        if column is not None and master_content is not None:
+            row[column] = master_content
+    if row is not None:
+        yield row
+
+
+def export_csv(columns, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for row in rows:
+        if buffer.tell() >= EXPORT_BUFFER_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        writer.writerow(row)
+    yield buffer.getvalue()
+
+
+def export_ndjson(columns, rows):
+    buffer = []
+    size = 0
+    for row in rows:
+        line = json.dumps(dict(zip(columns, row))) + '\n'
+        buffer.append(line)
+        size += len(line)
+        if size >= EXPORT_BUFFER_SIZE:
+            yield ''.join(buffer)
+            buffer.clear()
+            size = 0
+    yield ''.join(buffer)
+
+
+def search_master_list(master_list_id, q, limit, offset=0):
+    '''Full-text searches a master list's item names and cells. Returns one page of hits, best first, with the matches highlighted, and the total number of hits.'''
+    db = get_db()
+    match = to_match_query(q)
+    hits_sql = (
+        'SELECT i.id AS master_item_id, i.name AS master_item_name, NULL AS master_detail_name,'
+        ' highlight(master_items_search, 0, ?, ?) AS match, s.rank AS rank'
+        # CROSS JOIN keeps the full-text match as the outer loop; left to itself the planner may walk the whole list
+        ' FROM master_items_search s'
+        ' CROSS JOIN master_list_item_relations m ON m.master_item_id = s.rowid'
+        ' JOIN master_items i ON i.id = s.rowid'
+        ' WHERE master_items_search MATCH ? AND m.master_list_id = ?'
+        ' UNION ALL'
+        ' SELECT i.id, i.name, d.name,'
+        " snippet(master_contents_search, 0, ?, ?, '…', 24), s.rank"
+        ' FROM master_contents_search s'
+        ' CROSS JOIN master_item_detail_relations c ON c.id = s.rowid'
+        ' JOIN master_list_item_relations m ON m.master_item_id = c.master_item_id'
+        ' JOIN master_items i ON i.id = c.master_item_id'
+        ' JOIN master_details d ON d.id = c.master_detail_id'
+        ' WHERE master_contents_search MATCH ? AND m.master_list_id = ?'
+    )
+    # counting needs neither snippets nor names, which would otherwise be built for every hit
+    count_sql = (
+        'SELECT (SELECT COUNT(*) FROM master_items_search s'
+        ' CROSS JOIN master_list_item_relations m ON m.master_item_id = s.rowid'
+        ' WHERE master_items_search MATCH ? AND m.master_list_id = ?)'
+        ' + (SELECT COUNT(*) FROM master_contents_search s'
+        ' CROSS JOIN master_item_detail_relations c ON c.id = s.rowid'
+        ' CROSS JOIN master_list_item_relations m ON m.master_item_id = c.master_item_id'
+        ' WHERE master_contents_search MATCH ? AND m.master_list_id = ?)'
+    )
+    hit_count = db.execute(count_sql, (match, master_list_id) * 2).fetchone()[0]
+    params = (HIGHLIGHT_START, HIGHLIGHT_END, match, master_list_id) * 2
+    hits = []
+    for hit in db.execute(f'{hits_sql} ORDER BY rank LIMIT ? OFFSET ?', params + (limit, offset)):
+        hit = dict(hit)
+        hit['match'] = highlight_markup(hit['match'])
+        hits.append(hit)
+    return hits, hit_count
+
+
+def to_match_query(q):
+    '''Turns free text into an FTS5 query that matches all of its words (as prefixes, if long enough), so user input can't be an FTS syntax error.'''
+    return ' '.join(
+        '"' + word.replace('"', '""') + '"' + ('*' if len(word) >= SEARCH_MIN_PREFIX else '')
+        for word in q.split()
+    )
+
+
+def highlight_markup(text):
+    return Markup(str(escape(text)).replace(HIGHLIGHT_START, '<mark>').replace(HIGHLIGHT_END, '</mark>'))
@@ -0,0 +1,44 @@
+import threading
+
+from flask import Blueprint, Response, current_app
+
+from incontext.auth import admin_only, login_required
+
+bp = Blueprint('metrics', __name__)
+
+
+class Metrics:
+    '''Counters and gauges, by name, of this process (each worker process counts its own).'''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+
+    def increment(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def set(self, name, value):
+        with self.lock:
+            self.counters[name] = value
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.counters)
+
+
+def get_metrics():
+    return current_app.extensions['incontext.metrics']
+
+
+@bp.route('/metrics')
+@login_required
+@admin_only
+def index():
+    '''Serves this worker's counters in the Prometheus text format.'''
+    counters = get_metrics().snapshot()
+    return Response(''.join(f'{name} {value}\n' for name, value in sorted(counters.items())), mimetype='text/plain')
+
+
+def init_app(app):
+    app.extensions['incontext.metrics'] = Metrics()
+    app.register_blueprint(bp)
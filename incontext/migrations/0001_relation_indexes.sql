@@ -0,0 +1,18 @@
+-- Index the relation tables on both sides so list, item and detail lookups and cascades don't scan.
+
+CREATE UNIQUE INDEX master_list_item_relations_list_item
+	ON master_list_item_relations (master_list_id, master_item_id);
+CREATE INDEX master_list_item_relations_item
+	ON master_list_item_relations (master_item_id, master_list_id);
+
+CREATE UNIQUE INDEX master_list_detail_relations_list_detail
+	ON master_list_detail_relations (master_list_id, master_detail_id);
+CREATE INDEX master_list_detail_relations_detail
+	ON master_list_detail_relations (master_detail_id, master_list_id);
+
+-- one cell per item and detail
+CREATE UNIQUE INDEX master_item_detail_relations_item_detail
+	ON master_item_detail_relations (master_item_id, master_detail_id);
+-- covers reading a list's cells by detail without touching the table
+CREATE INDEX master_item_detail_relations_detail
+	ON master_item_detail_relations (master_detail_id, master_item_id, master_content);
@@ -0,0 +1,93 @@
+-- Rebuild the relation tables (and tethered_agents) with ON DELETE CASCADE foreign keys, since SQLite can't alter
+-- constraints in place. Rows that point at missing parents are left behind. Triggers delete an item or detail
+-- together with its list relation, so deleting a master list is a single cascading DELETE.
+
+CREATE TABLE master_item_detail_relations_new (
+	id INTEGER PRIMARY KEY AUTOINCREMENT,
+	master_item_id INTEGER NOT NULL,
+	master_detail_id INTEGER NOT NULL,
+	master_content TEXT,
+	FOREIGN KEY (master_item_id) REFERENCES master_items (id) ON DELETE CASCADE,
+	FOREIGN KEY (master_detail_id) REFERENCES master_details (id) ON DELETE CASCADE
+);
+INSERT INTO master_item_detail_relations_new (id, master_item_id, master_detail_id, master_content)
+	SELECT id, master_item_id, master_detail_id, master_content
+	FROM master_item_detail_relations
+	WHERE master_item_id IN (SELECT id FROM master_items)
+	AND master_detail_id IN (SELECT id FROM master_details);
+DROP TABLE master_item_detail_relations;
+ALTER TABLE master_item_detail_relations_new RENAME TO master_item_detail_relations;
+CREATE UNIQUE INDEX master_item_detail_relations_item_detail
+	ON master_item_detail_relations (master_item_id, master_detail_id);
+CREATE INDEX master_item_detail_relations_detail
+	ON master_item_detail_relations (master_detail_id, master_item_id, master_content);
+
+CREATE TABLE master_list_item_relations_new (
+	id INTEGER PRIMARY KEY AUTOINCREMENT,
+	master_list_id INTEGER NOT NULL,
+	master_item_id INTEGER NOT NULL,
+	FOREIGN KEY (master_list_id) REFERENCES master_lists (id) ON DELETE CASCADE,
+	FOREIGN KEY (master_item_id) REFERENCES master_items (id) ON DELETE CASCADE
+);
+INSERT INTO master_list_item_relations_new (id, master_list_id, master_item_id)
+	SELECT id, master_list_id, master_item_id
+	FROM master_list_item_relations
+	WHERE master_list_id IN (SELECT id FROM master_lists)
+	AND master_item_id IN (SELECT id FROM master_items);
+DROP TABLE master_list_item_relations;
+ALTER TABLE master_list_item_relations_new RENAME TO master_list_item_relations;
+CREATE UNIQUE INDEX master_list_item_relations_list_item
+	ON master_list_item_relations (master_list_id, master_item_id);
+CREATE INDEX master_list_item_relations_item
+	ON master_list_item_relations (master_item_id, master_list_id);
+
+CREATE TABLE master_list_detail_relations_new (
+	id INTEGER PRIMARY KEY AUTOINCREMENT,
+	master_list_id INTEGER NOT NULL,
+	master_detail_id INTEGER NOT NULL,
+	FOREIGN KEY (master_list_id) REFERENCES master_lists (id) ON DELETE CASCADE,
+	FOREIGN KEY (master_detail_id) REFERENCES master_details (id) ON DELETE CASCADE
+);
+INSERT INTO master_list_detail_relations_new (id, master_list_id, master_detail_id)
+	SELECT id, master_list_id, master_detail_id
+	FROM master_list_detail_relations
+	WHERE master_list_id IN (SELECT id FROM master_lists)
+	AND master_detail_id IN (SELECT id FROM master_details);
+DROP TABLE master_list_detail_relations;
+ALTER TABLE master_list_detail_relations_new RENAME TO master_list_detail_relations;
+CREATE UNIQUE INDEX master_list_detail_relations_list_detail
+	ON master_list_detail_relations (master_list_id, master_detail_id);
+CREATE INDEX master_list_detail_relations_detail
+	ON master_list_detail_relations (master_detail_id, master_list_id);
+
+-- items and details belong to their list: they go when their last list relation goes
+CREATE TRIGGER master_list_item_relations_delete_item
+	AFTER DELETE ON master_list_item_relations
+	BEGIN
+		DELETE FROM master_items
+		WHERE id = OLD.master_item_id
+		AND NOT EXISTS (SELECT 1 FROM master_list_item_relations WHERE master_item_id = OLD.master_item_id);
+	END;
+CREATE TRIGGER master_list_detail_relations_delete_detail
+	AFTER DELETE ON master_list_detail_relations
+	BEGIN
+		DELETE FROM master_details
+		WHERE id = OLD.master_detail_id
+		AND NOT EXISTS (SELECT 1 FROM master_list_detail_relations WHERE master_detail_id = OLD.master_detail_id);
+	END;
+
+CREATE TABLE tethered_agents_new (
+	id INTEGER PRIMARY KEY AUTOINCREMENT,
+	creator_id INTEGER NOT NULL,
+	created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+	master_agent_id INTEGER NOT NULL,
+	FOREIGN KEY (master_agent_id) REFERENCES master_agents (id) ON DELETE CASCADE
+);
+INSERT INTO tethered_agents_new (id, creator_id, created, master_agent_id)
+	SELECT id, creator_id, created, master_agent_id
+	FROM tethered_agents
+	WHERE master_agent_id IN (SELECT id FROM master_agents);
+DROP TABLE tethered_agents;
+ALTER TABLE tethered_agents_new RENAME TO tethered_agents;
+CREATE INDEX tethered_agents_master_agent ON tethered_agents (master_agent_id);
+CREATE INDEX tethered_agents_creator ON tethered_agents (creator_id);
@@ -0,0 +1,37 @@
+-- Full-text indexes over master item names and cell contents. They are external content tables: the text stays in
+-- master_items and master_item_detail_relations and only the index is stored, kept in sync by the triggers below.
+
+CREATE VIRTUAL TABLE master_items_search USING fts5(
+	name,
+	content='master_items', content_rowid='id',
+	tokenize='unicode61 remove_diacritics 2'
+);
+CREATE VIRTUAL TABLE master_contents_search USING fts5(
+	master_content,
+	content='master_item_detail_relations', content_rowid='id',
+	tokenize='unicode61 remove_diacritics 2'
+);
+INSERT INTO master_items_search (master_items_search) VALUES ('rebuild');
+INSERT INTO master_contents_search (master_contents_search) VALUES ('rebuild');
+
+CREATE TRIGGER master_items_search_insert AFTER INSERT ON master_items BEGIN
+	INSERT INTO master_items_search (rowid, name) VALUES (NEW.id, NEW.name);
+END;
+CREATE TRIGGER master_items_search_delete AFTER DELETE ON master_items BEGIN
+	INSERT INTO master_items_search (master_items_search, rowid, name) VALUES ('delete', OLD.id, OLD.name);
+END;
+CREATE TRIGGER master_items_search_update AFTER UPDATE OF name ON master_items BEGIN
+	INSERT INTO master_items_search (master_items_search, rowid, name) VALUES ('delete', OLD.id, OLD.name);
+	INSERT INTO master_items_search (rowid, name) VALUES (NEW.id, NEW.name);
+END;
+
+CREATE TRIGGER master_contents_search_insert AFTER INSERT ON master_item_detail_relations BEGIN
+	INSERT INTO master_contents_search (rowid, master_content) VALUES (NEW.id, NEW.master_content);
+END;
+CREATE TRIGGER master_contents_search_delete AFTER DELETE ON master_item_detail_relations BEGIN
+	INSERT INTO master_contents_search (master_contents_search, rowid, master_content) VALUES ('delete', OLD.id, OLD.master_content);
+END;
+CREATE TRIGGER master_contents_search_update AFTER UPDATE OF master_content ON master_item_detail_relations BEGIN
+	INSERT INTO master_contents_search (master_contents_search, rowid, master_content) VALUES ('delete', OLD.id, OLD.master_content);
+	INSERT INTO master_contents_search (rowid, master_content) VALUES (NEW.id, NEW.master_content);
+END;
@@ -0,0 +1,15 @@
+-- Order the detail index by content, so filtering a column by value or range is an index range scan. It still covers
+-- reading a detail's cells, and the unique (item, detail) index still serves lookups by item.
+
+DROP INDEX master_item_detail_relations_detail;
+CREATE INDEX master_item_detail_relations_detail
+	ON master_item_detail_relations (master_detail_id, master_content, master_item_id);
+
+-- Numeric ranges compare cells as numbers, which only an index on that expression can serve. Cells without a digit
+-- aren't numbers (they would all cast to 0) and index as NULL. Queries must use this exact expression.
+CREATE INDEX master_item_detail_relations_detail_number
+	ON master_item_detail_relations (
+		master_detail_id,
+		(CASE WHEN master_content GLOB '*[0-9]*' THEN CAST(master_content AS REAL) END),
+		master_item_id
+	);
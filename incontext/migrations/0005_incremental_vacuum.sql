@@ -0,0 +1,5 @@
+-- Keep the pages that deletes free in a freelist that `flask db-maintain` gives back to the file system a slice at a
+-- time with `PRAGMA incremental_vacuum`, instead of a full VACUUM that locks the database while it rewrites it. The
+-- setting only takes effect through a VACUUM, which `migrate` runs after this.
+
+PRAGMA auto_vacuum = INCREMENTAL;
@@ -0,0 +1,17 @@
+-- Personal access tokens, for scripts. A token is `ic_<prefix>_<secret>`: the prefix finds its row through the unique
+-- index, and only a keyed hash (HMAC-SHA256) of the secret is stored, which is fast to check since the secret is
+-- random, unlike a password. Scopes are space separated.
+
+CREATE TABLE api_tokens (
+	id INTEGER PRIMARY KEY AUTOINCREMENT,
+	user_id INTEGER NOT NULL,
+	name TEXT NOT NULL,
+	prefix TEXT UNIQUE NOT NULL,
+	secret_hash TEXT NOT NULL,
+	scopes TEXT NOT NULL,
+	created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+	expires TIMESTAMP,
+	last_used TIMESTAMP,
+	FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+);
+CREATE INDEX api_tokens_user ON api_tokens (user_id);
@@ -0,0 +1,102 @@
+import concurrent.futures
+import multiprocessing
+import os
+import threading
+
+from flask import current_app
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+class PasswordHashUnavailable(Exception):
+    '''Too many passwords are waiting to be hashed, or one took longer than `PASSWORD_HASH_TIMEOUT`. Served as a 503.'''
+
+
+def lower_priority(nice):
+    os.nice(nice) # lets the web workers have the CPU first, so other routes stay fast during a burst of logins
+
+
+def hash_password(password, method):
+    return generate_password_hash(password, method)
+
+
+def check_password(pwhash, password, method):
+    '''Returns whether `password` matches `pwhash`, and if it does but `pwhash` wasn't made with `method`, its new hash.'''
+    if not check_password_hash(pwhash, password):
+        return False, None
+    if pwhash.partition('$')[0] == method:
+        return True, None
+    return True, generate_password_hash(password, method)
+
+
+class PasswordHasher:
+    '''Hashes passwords in a pool of `PASSWORD_HASH_WORKERS` processes, so a web worker waits on them without burning its own CPU. At most `PASSWORD_HASH_QUEUE` hashes wait or run at once, beyond which `run` fails right away instead of queueing up. With no workers, hashes are made in the calling thread.'''
+    def __init__(self, app):
+        self.pid = os.getpid()
+        self.workers = app.config['PASSWORD_HASH_WORKERS']
+        self.timeout = app.config['PASSWORD_HASH_TIMEOUT']
+        self.slots = threading.BoundedSemaphore(app.config['PASSWORD_HASH_QUEUE']) if app.config['PASSWORD_HASH_QUEUE'] else None
+        self.pool = None
+        self.broken = False
+        if self.workers:
+            self.pool = concurrent.futures.ProcessPoolExecutor(
+                self.workers,
+                mp_context=multiprocessing.get_context('spawn'), # a fork would copy this process's threads' locks, held or not
+                initializer=lower_priority,
+                initargs=(app.config['PASSWORD_HASH_NICE'],),
+            )
+
+    def run(self, fn, *args):
+        if self.pool is None:
+            return fn(*args)
+        if self.slots is None or not self.slots.acquire(blocking=False):
+            raise PasswordHashUnavailable('Too many passwords waiting to be hashed.')
+        try:
+            future = self.pool.submit(fn, *args)
+        except concurrent.futures.process.BrokenProcessPool as e: # like a worker killed for memory
+            self.slots.release()
+            self.broken = True
+            raise PasswordHashUnavailable(str(e)) from e
+        future.add_done_callback(lambda future: self.slots.release()) # a slot is held until the hash is done, even if it timed out
+        try:
+            return future.result(self.timeout)
+        except concurrent.futures.TimeoutError as e:
+            future.cancel() # only helps if it hasn't started
+            raise PasswordHashUnavailable('Hashing a password timed out.') from e
+        except concurrent.futures.process.BrokenProcessPool as e:
+            self.broken = True
+            raise PasswordHashUnavailable(str(e)) from e
+
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+
+
+PASSWORD_HASHER_LOCK = threading.Lock()
+
+
+def get_password_hasher():
+    '''Returns this process's password hasher, starting its pool on first use (and again after a fork, or after a worker died).'''
+    app = current_app._get_current_object()
+    with PASSWORD_HASHER_LOCK:
+        hasher = app.extensions.get('incontext.passwords')
+        if hasher is None or hasher.pid != os.getpid() or hasher.broken:
+            hasher = app.extensions['incontext.passwords'] = PasswordHasher(app)
+    return hasher
+
+
+def make_password_hash(password):
+    '''Hashes a new password with the `PASSWORD_HASH_METHOD`.'''
+    return get_password_hasher().run(hash_password, password, current_app.config['PASSWORD_HASH_METHOD'])
+
+
+def verify_password(pwhash, password):
+    '''Returns whether `password` matches `pwhash`, and the password's hash with the `PASSWORD_HASH_METHOD` if `pwhash` was made with another method (or cost), to store instead.'''
+    return get_password_hasher().run(check_password, pwhash, password, current_app.config['PASSWORD_HASH_METHOD'])
+
+
+def handle_password_hash_unavailable(e):
+    return 'Too many logins at once. Please try again.', 503, {'Retry-After': '1'}
+
+
+def init_app(app):
+    app.register_error_handler(PasswordHashUnavailable, handle_password_hash_unavailable)
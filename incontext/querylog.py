@@ -0,0 +1,290 @@
+import collections
+import functools
+import json
+import logging.handlers
+import random
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+import click
+from flask import current_app, g, has_request_context, request
+from flask.cli import with_appcontext
+
+
+# literals are replaced by `?`, so statements that differ only in their values count as one.
+NORMALIZE = (
+    (re.compile(r"'(?:[^']|'')*'"), '?'), # strings
+    (re.compile(r'(?<![\w.])-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?\b'), '?'), # numbers, but not digits in names like `t1`
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)'), '(?, ...)'), # `IN` lists of any length
+    (re.compile(r'\s+'), ' '),
+)
+
+ITER_FETCH_SIZE = 256 # rows a timed cursor fetches at once while it's iterated over.
+
+# statements on these tables are logged without their values, which may be password or token hashes.
+REDACTED_TABLES = re.compile(r'\b(?:users|api_tokens)\b', re.IGNORECASE)
+
+
+def redact(sql, parameters):
+    '''Returns `parameters` to log for `sql`: as they are, or each replaced by `None` if `sql` touches one of the `REDACTED_TABLES`.'''
+    if isinstance(parameters, dict):
+        return {name: None for name in parameters} if REDACTED_TABLES.search(sql) else parameters
+    parameters = list(parameters or ())
+    return [None] * len(parameters) if REDACTED_TABLES.search(sql) else parameters
+
+
+@functools.lru_cache(maxsize=1024) # most statements are constants of the code, normalized once per process.
+def normalize(sql):
+    '''Returns `sql` with its literal values replaced by `?` and its whitespace collapsed.'''
+    for pattern, replacement in NORMALIZE:
+        sql = pattern.sub(replacement, sql)
+    return sql.strip()
+
+
+class QueryLog:
+    '''The statements one request ran: per normalized statement, how many times it ran, the seconds spent in it (executing and fetching) and the rows it returned or changed.'''
+    def __init__(self):
+        self.statements = {}
+
+    def start(self, sql):
+        '''Counts one execution of `sql` and returns its `[executions, seconds, rows]`, for the cursor to add to.'''
+        sql = normalize(sql)
+        stats = self.statements.get(sql)
+        if stats is None:
+            stats = self.statements[sql] = [0, 0.0, 0]
+        stats[0] += 1
+        return stats
+
+    def totals(self):
+        '''Returns the request's `(executions, seconds, rows)`.'''
+        executions, seconds, rows = 0, 0.0, 0
+        for stats in self.statements.values():
+            executions += stats[0]
+            seconds += stats[1]
+            rows += stats[2]
+        return executions, seconds, rows
+
+    def repeated(self, threshold):
+        '''Returns the `(sql, executions)` of the statements that ran at least `threshold` times, most repeated first. Usually a query in a loop (N+1) that one query could replace.'''
+        return sorted(
+            ((sql, stats[0]) for sql, stats in self.statements.items() if stats[0] >= threshold),
+            key=lambda repeat: -repeat[1]
+        )
+
+
+class TimedCursor(sqlite3.Cursor):
+    '''A cursor that times each statement, executing and fetching, for the request's query log (when sampled) and to log it to the slow query log once it took the connection's `slow_query_threshold` seconds. A statement is logged as soon as it crosses the threshold, with the time and rows up to then. Iterating over it fetches `ITER_FETCH_SIZE` rows at a time, so that's timed too without timing every row.'''
+    sql = parameters = stats = None
+    seconds, rows = 0.0, 0
+    buffered = () # rows fetched for iteration, not yet returned
+
+    def start(self, sql, parameters):
+        self.sql, self.parameters, self.seconds, self.rows = sql, parameters, 0.0, 0
+        self.buffered = ()
+        query_log = self.connection.query_log
+        self.stats = None if query_log is None else query_log.start(sql)
+
+    def add(self, seconds, rows):
+        self.seconds += seconds
+        self.rows += rows
+        if self.stats is not None:
+            self.stats[1] += seconds
+            self.stats[2] += rows
+        threshold = self.connection.slow_query_threshold
+        if threshold is not None and self.seconds >= threshold and self.sql is not None:
+            sql, self.sql = self.sql, None # logged once per execution
+            log_slow_query(self.connection, sql, self.parameters, self.seconds, self.rows)
+
+    def execute(self, sql, parameters=()):
+        self.start(sql, parameters)
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self.add(time.perf_counter() - start, max(self.rowcount, 0)) # the rows changed; -1 for queries, whose rows are counted as they're fetched
+
+    def executemany(self, sql, seq_of_parameters):
+        self.start(sql, None) # the parameters may be a generator, used up by now
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self.add(time.perf_counter() - start, max(self.rowcount, 0))
+
+    # sqlite steps through a query's rows as they're fetched, so that time is the statement's too.
+    def fetchone(self):
+        if self.buffered:
+            return self.buffered.popleft()
+        start = time.perf_counter()
+        row = super().fetchone()
+        self.add(time.perf_counter() - start, row is not None)
+        return row
+
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        rows = [self.buffered.popleft() for _ in range(min(size, len(self.buffered)))]
+        if len(rows) < size:
+            start = time.perf_counter()
+            fetched = super().fetchmany(size - len(rows))
+            self.add(time.perf_counter() - start, len(fetched))
+            rows += fetched
+        return rows
+
+    def fetchall(self):
+        rows = list(self.buffered)
+        self.buffered = ()
+        start = time.perf_counter()
+        fetched = super().fetchall()
+        self.add(time.perf_counter() - start, len(fetched))
+        return rows + fetched
+
+    def __next__(self):
+        if not self.buffered:
+            start = time.perf_counter()
+            self.buffered = collections.deque(super().fetchmany(ITER_FETCH_SIZE))
+            self.add(time.perf_counter() - start, len(self.buffered))
+            if not self.buffered:
+                raise StopIteration
+        return self.buffered.popleft()
+
+
+def explain(db, sql, parameters):
+    '''Returns sqlite's plan for `sql` as lines indented by depth, like the sqlite3 shell's `.eqp` output.'''
+    depths = {0: -1}
+    plan = []
+    for node_id, parent_id, _, detail in db.cursor(sqlite3.Cursor).execute(f'EXPLAIN QUERY PLAN {sql}', parameters):
+        depths[node_id] = depths.get(parent_id, -1) + 1
+        plan.append('  ' * depths[node_id] + detail)
+    return plan
+
+
+def log_slow_query(db, sql, parameters, seconds, rows):
+    '''Writes a slow statement, its parameters (redacted for some tables) and its query plan to the `SLOW_QUERY_LOG` as a line of JSON.'''
+    try:
+        plan = explain(db, sql, parameters) if parameters is not None else None
+    except sqlite3.Error: # like a statement that failed itself
+        plan = None
+    entry = {
+        'time': datetime.now(timezone.utc).isoformat(timespec='milliseconds'),
+        'request': f'{request.method} {request.path}' if has_request_context() else None,
+        'fingerprint': normalize(sql),
+        'sql': sql,
+        'parameters': redact(sql, parameters),
+        'seconds': round(seconds, 6),
+        'rows': rows,
+        'plan': plan,
+    }
+    get_slow_query_handler().handle(logging.makeLogRecord({'msg': json.dumps(entry, default=repr)}))
+
+
+SLOW_QUERY_HANDLERS_LOCK = threading.Lock()
+
+
+def get_slow_query_handler():
+    '''Returns the app's handler writing to the `SLOW_QUERY_LOG`, which it rotates after `SLOW_QUERY_LOG_MAX_BYTES`, keeping `SLOW_QUERY_LOG_BACKUPS` old files.'''
+    config = current_app.config
+    handlers = current_app.extensions['incontext.slow_queries']
+    with SLOW_QUERY_HANDLERS_LOCK:
+        handler = handlers.get(config['SLOW_QUERY_LOG'])
+        if handler is None:
+            handler = handlers[config['SLOW_QUERY_LOG']] = logging.handlers.RotatingFileHandler(
+                config['SLOW_QUERY_LOG'],
+                maxBytes=config['SLOW_QUERY_LOG_MAX_BYTES'],
+                backupCount=config['SLOW_QUERY_LOG_BACKUPS'],
+                encoding='utf-8',
+                delay=True,
+            )
+    return handler
+
+
+def read_slow_query_log(path, backups):
+    '''Yields the entries of the slow query log at `path` and its rotated files, oldest first.'''
+    for n in range(backups, -1, -1):
+        try:
+            f = open(f'{path}.{n}' if n else path, encoding='utf-8')
+        except FileNotFoundError:
+            continue
+        with f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError: # a line cut short by a crash
+                    continue
+
+
+def summarize_slow_queries(entries):
+    '''Groups slow query log entries by fingerprint. Returns `{fingerprint, count, seconds, max_seconds, plan}` dicts, the statements that took the longest in total first. The plan is the latest one.'''
+    statements = {}
+    for entry in entries:
+        statement = statements.get(entry['fingerprint'])
+        if statement is None:
+            statement = statements[entry['fingerprint']] = {
+                'fingerprint': entry['fingerprint'], 'count': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'plan': None
+            }
+        statement['count'] += 1
+        statement['seconds'] += entry['seconds']
+        statement['max_seconds'] = max(statement['max_seconds'], entry['seconds'])
+        statement['plan'] = entry['plan'] or statement['plan']
+    return sorted(statements.values(), key=lambda statement: -statement['seconds'])
+
+
+def is_costly_step(step):
+    '''Whether a query plan step reads a whole table or index (`SCAN`) or sorts or deduplicates rows in a temp b-tree, usually what a missing index looks like.'''
+    step = step.lstrip()
+    return step.startswith('SCAN ') or 'TEMP B-TREE' in step
+
+
+@click.command('slow-queries')
+@click.option('--limit', default=20, help='Number of statements to show.')
+@with_appcontext
+def slow_queries_command(limit):
+    '''Summarize the slow query log by statement, slowest in total first.'''
+    statements = summarize_slow_queries(
+        read_slow_query_log(current_app.config['SLOW_QUERY_LOG'], current_app.config['SLOW_QUERY_LOG_BACKUPS'])
+    )
+    if not statements:
+        click.echo('No slow queries logged.')
+    for statement in statements[:limit]:
+        click.echo(
+            f"{statement['count']} x, {statement['seconds']:.3f} s total, {statement['max_seconds']:.3f} s max:"
+            f" {statement['fingerprint']}"
+        )
+        for step in statement['plan'] or ():
+            click.echo(f"  {'!' if is_costly_step(step) else ' '} {step}") # flags full scans and temp b-trees
+        click.echo()
+
+
+def start_query_log():
+    '''Samples `QUERY_LOG_SAMPLE_RATE` of the requests for logging. Connections checked out during a sampled request log to `g.query_log`.'''
+    rate = current_app.config['QUERY_LOG_SAMPLE_RATE']
+    if rate and random.random() < rate:
+        g.query_log = QueryLog()
+
+
+def report_query_log(response):
+    '''Adds a sampled request's totals to the response as a `Server-Timing` header, logs them at debug level, and warns about statements that ran `QUERY_LOG_REPEAT_THRESHOLD` times or more.'''
+    query_log = g.pop('query_log', None)
+    if query_log is None:
+        return response
+    executions, seconds, rows = query_log.totals()
+    repeated = query_log.repeated(current_app.config['QUERY_LOG_REPEAT_THRESHOLD'])
+    response.headers['Server-Timing'] = (
+        f'db;dur={seconds * 1000:.3f};desc="{executions} queries, {rows} rows, {len(repeated)} repeated"'
+    )
+    current_app.logger.debug(
+        '%s %s: %d queries, %.3f ms, %d rows', request.method, request.path, executions, seconds * 1000, rows
+    )
+    for sql, count in repeated:
+        current_app.logger.warning('%s %s ran this %d times: %s', request.method, request.path, count, sql)
+    return response
+
+
+def init_app(app):
+    '''Called by the app factory, before the blueprints, so requests are sampled before anything checks out a connection.'''
+    app.extensions['incontext.slow_queries'] = {} # the slow query log's file handler, by path.
+    app.before_request(start_query_log)
+    app.after_request(report_query_log)
+    app.cli.add_command(slow_queries_command)
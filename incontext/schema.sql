@@ -1,3 +1,7 @@
+DROP TABLE IF EXISTS schema_version;
+DROP TABLE IF EXISTS api_tokens;
+DROP TABLE IF EXISTS master_items_search;
+DROP TABLE IF EXISTS master_contents_search;
 DROP TABLE IF EXISTS users;
 DROP TABLE IF EXISTS master_lists;
 DROP TABLE IF EXISTS master_items;
@@ -0,0 +1,23 @@
+-- A tenant's own database, with the tables of `schema.sql` that hold one user's private data, in the same column
+-- order. Foreign keys can't point into the attached global database, so these have none: `flask sweep-orphans` deletes
+-- tethered agents whose master agent is gone.
+
+PRAGMA auto_vacuum = INCREMENTAL; -- like the global database since migration 0005. Only applies to a new, empty file.
+
+CREATE TABLE IF NOT EXISTS agents (
+	id INTEGER PRIMARY KEY AUTOINCREMENT,
+	creator_id INTEGER NOT NULL,
+	created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+	name TEXT NOT NULL,
+	description TEXT NOT NULL,
+	model_id INTEGER NOT NULL,
+	role TEXT NOT NULL,
+	instructions TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS tethered_agents (
+	id INTEGER PRIMARY KEY AUTOINCREMENT,
+	creator_id INTEGER NOT NULL,
+	created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+	master_agent_id INTEGER NOT NULL
+);
@@ -0,0 +1,83 @@
+import math
+import os
+import random
+import sqlite3
+import threading
+import time
+
+from flask import current_app
+
+
+# Takes a token from a bucket, refilled at `rate` tokens per second up to `burst`, in one statement, so that worker
+# processes sharing the database can't both take the last one. A bucket without enough left isn't charged, and its
+# `allowed` says so. New buckets start full.
+TAKE_TOKEN = (
+    'INSERT INTO buckets (key, tokens, updated, allowed) VALUES (:key, :burst - 1, :now, 1)'
+    ' ON CONFLICT (key) DO UPDATE SET'
+    ' tokens = MIN(:burst, tokens + (:now - updated) * :rate)'
+    ' - (MIN(:burst, tokens + (:now - updated) * :rate) >= 1),'
+    ' allowed = MIN(:burst, tokens + (:now - updated) * :rate) >= 1,'
+    ' updated = :now'
+    ' RETURNING tokens, allowed'
+)
+FORGET_SHARE = 0.01 # of the takes that also delete the buckets that have been full for a while
+
+
+class Throttled(Exception):
+    def __init__(self, bucket, retry_after):
+        super().__init__(f'Too many attempts by {bucket}.')
+        self.bucket = bucket
+        self.retry_after = retry_after
+
+
+class ThrottleStore(threading.local):
+    '''This thread's connection to the `LOGIN_THROTTLE_DATABASE`, the buckets of all the worker processes.'''
+    path = db = pid = None
+
+    def connect(self, path):
+        if self.db is None or self.path != path or self.pid != os.getpid():
+            self.db = sqlite3.connect(path, isolation_level=None, timeout=5) # autocommit: every take is its own transaction
+            self.db.execute('PRAGMA journal_mode = WAL')
+            self.db.execute('PRAGMA synchronous = OFF') # the buckets are worth no fsync; losing the last few takes in a crash is fine
+            self.db.execute(
+                'CREATE TABLE IF NOT EXISTS buckets ('
+                ' key TEXT PRIMARY KEY,'
+                ' tokens REAL NOT NULL,'
+                ' updated REAL NOT NULL,'
+                ' allowed INTEGER NOT NULL)'
+                ' WITHOUT ROWID'
+            )
+            self.path, self.pid = path, os.getpid()
+        return self.db
+
+
+def take_token(db, key, rate, burst, now=None):
+    '''Takes a token from the bucket `key`. Returns `None` if there was one, else the seconds until there is.'''
+    now = time.time() if now is None else now # wall clock time, which all processes share
+    tokens, allowed = db.execute(TAKE_TOKEN, {'key': key, 'rate': rate, 'burst': burst, 'now': now}).fetchone()
+    if random.random() < FORGET_SHARE:
+        db.execute('DELETE FROM buckets WHERE updated < ?', (now - burst / rate,)) # full again by now anyway
+    return None if allowed else (1 - tokens) / rate
+
+
+def throttle(**keys):
+    '''Takes a token from each of the buckets named by `keys`, like `ip='127.0.0.1'`, each limited by the `LOGIN_THROTTLE` of its name. Raises `Throttled` for the first one that's empty. Counts the outcomes in the metrics.'''
+    config = current_app.config
+    metrics = current_app.extensions['incontext.metrics']
+    db = current_app.extensions['incontext.throttle'].connect(config['LOGIN_THROTTLE_DATABASE'])
+    for bucket, value in keys.items():
+        limit = config['LOGIN_THROTTLE'].get(bucket)
+        if limit is None or value is None:
+            continue
+        rate, burst = limit
+        metrics.set(f'login_throttle_rate{{bucket="{bucket}"}}', rate)
+        metrics.set(f'login_throttle_burst{{bucket="{bucket}"}}', burst)
+        retry_after = take_token(db, f'{bucket}:{value}', rate, burst)
+        if retry_after is not None:
+            metrics.increment(f'login_throttled_total{{bucket="{bucket}"}}')
+            raise Throttled(bucket, math.ceil(retry_after))
+    metrics.increment('login_attempts_total')
+
+
+def init_app(app):
+    app.extensions['incontext.throttle'] = ThrottleStore()
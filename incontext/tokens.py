@@ -0,0 +1,74 @@
+import hashlib
+import hmac
+import secrets
+from datetime import datetime, timedelta, timezone
+
+from flask import current_app
+
+from incontext.db import get_db, run_write
+
+
+TOKEN_PREFIX = 'ic_' # marks a string as one of our tokens, like to secret scanners.
+SCOPES = ('read', 'write') # `read` allows GET and HEAD requests, `write` the others.
+
+
+def get_token_key():
+    return (current_app.config['API_TOKEN_KEY'] or current_app.config['SECRET_KEY']).encode()
+
+
+def hash_token_secret(secret):
+    '''A keyed hash of a token's secret. A plain hash would do as well against guessing, since secrets are random, but the key also keeps a leaked copy of the database from being checked against tokens found elsewhere.'''
+    return hmac.new(get_token_key(), secret.encode(), hashlib.sha256).hexdigest()
+
+
+def utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None) # naive, like the `CURRENT_TIMESTAMP`s sqlite stores
+
+
+def create_token(user_id, name, scopes, expires_in_days=None):
+    '''Creates a token for a user. Returns it, which is the only time it's known in full.'''
+    prefix, secret = secrets.token_hex(6), secrets.token_urlsafe(32)
+    expires = None if expires_in_days is None else (utcnow() + timedelta(days=expires_in_days)).isoformat(' ', 'seconds')
+    secret_hash = hash_token_secret(secret) # here, since the unit may run where there's no app context
+    run_write(lambda db: db.execute(
+        'INSERT INTO api_tokens (user_id, name, prefix, secret_hash, scopes, expires)'
+        ' VALUES (?, ?, ?, ?, ?, ?)',
+        (user_id, name, prefix, secret_hash, ' '.join(scopes), expires)
+    ))
+    return f'{TOKEN_PREFIX}{prefix}_{secret}'
+
+
+def check_token(token):
+    '''Returns the `(user_id, scopes)` of a valid, unexpired token, else `None`. Notes its use, at most every `API_TOKEN_TOUCH_INTERVAL` seconds, so that most requests don't write.'''
+    prefix, _, secret = token.removeprefix(TOKEN_PREFIX).partition('_')
+    if not token.startswith(TOKEN_PREFIX) or not secret:
+        return None
+    api_token = get_db().execute(
+        'SELECT id, user_id, secret_hash, scopes, expires, last_used FROM api_tokens WHERE prefix = ?', (prefix,)
+    ).fetchone()
+    if api_token is None or not hmac.compare_digest(api_token['secret_hash'], hash_token_secret(secret)):
+        return None
+    now = utcnow()
+    if api_token['expires'] is not None and api_token['expires'] <= now:
+        return None
+    if api_token['last_used'] is None or (now - api_token['last_used']).total_seconds() >= current_app.config['API_TOKEN_TOUCH_INTERVAL']:
+        run_write(lambda db: db.execute(
+            'UPDATE api_tokens SET last_used = ? WHERE id = ?', (now.isoformat(' ', 'seconds'), api_token['id'])
+        ))
+    return api_token['user_id'], api_token['scopes'].split()
+
+
+def get_tokens(user_id):
+    return get_db().execute(
+        'SELECT id, name, prefix, scopes, created, expires, last_used'
+        ' FROM api_tokens WHERE user_id = ?'
+        ' ORDER BY created DESC, id DESC',
+        (user_id,)
+    ).fetchall()
+
+
+def revoke_token(user_id, token_id):
+    '''Deletes a user's token. Returns whether there was one.'''
+    return run_write(lambda db: db.execute(
+        'DELETE FROM api_tokens WHERE id = ? AND user_id = ?', (token_id, user_id)
+    ).rowcount) > 0
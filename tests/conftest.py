@@ -1,4 +1,6 @@
+import glob
 import os
+import shutil
 import tempfile
 
 import pytest
@@ -17,6 +19,14 @@ def app():
         'TESTING': True, # tells Flask that the app is in test mode. makes testing better in Flask, and also tapped by extensions.
         'DATABASE': db_path, # override so it points to the temp path instead of the instance folder.
         'AGENT_MODELS': AGENT_MODELS,
+        'PASSWORD_HASH_METHOD': 'pbkdf2:sha256:50000', # that of the passwords in `data.sql`, so logging in doesn't rehash them.
+        'PASSWORD_HASH_WORKERS': 0, # hash in the test's own process.
+        # everything else the app writes goes next to the temp database too, not into the instance folder.
+        'LOGIN_THROTTLE_DATABASE': db_path + '-throttle',
+        'SLOW_QUERY_LOG': db_path + '-slow-queries.log',
+        'BACKUP_DIR': db_path + '-backups',
+        'MAINTENANCE_STAMP': db_path + '-maintenance.stamp',
+        'DATABASE_TENANT_DIR': db_path + '-tenants',
     })
 
     with app.app_context(): # create the test db (at the temp file path)
@@ -26,7 +36,11 @@ def app():
     yield app
 
     os.close(db_fd) # test is over. close and remove the temp file.
-    os.unlink(db_path)
+    for path in [db_path] + glob.glob(glob.escape(db_path) + '-*'): # along with the files sqlite keeps next to it in WAL mode, and those above.
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.unlink(path)
 
 @pytest.fixture
 def client(app): # that's the application object created by the app fixture.
@@ -1,5 +1,8 @@
+import sqlite3
+
 import pytest
-from incontext.db import get_db
+from incontext.db import get_db, get_tenant_db
+from flask import g
 
 
 def test_index_agents(client, auth):
@@ -291,3 +294,42 @@ def test_delete_tethered_agent(client, auth, app):
     assert response.headers["Location"] == "/agents/"
 
 
+
+
+def test_tenant_databases(client, auth, app, runner, tmp_path):
+    app.config['DATABASE_TENANTS'] = True
+    app.config['DATABASE_TENANT_DIR'] = str(tmp_path)
+    result = runner.invoke(args=['split-tenants'])
+    assert 'agents: 3 moved' in result.output
+    assert 'tethered_agents: 3 moved' in result.output
+    with app.app_context():
+        assert get_db().execute('SELECT COUNT(*) FROM agents').fetchone()[0] == 0
+    auth.login()
+    # the user's own rows, joined with the global tables
+    response = client.get('/agents/')
+    assert b'agent name 1' in response.data
+    assert b'agent name 3' not in response.data
+    assert b'master agent name 1 (tethered)' in response.data
+    assert b'agent role 1' in client.get('/agents/1/view').data
+    # writes go to the user's database
+    response = client.post(
+        '/agents/new',
+        data={'name': 'agent name 4', 'description': '', 'model_id': '1', 'role': 'role', 'instructions': 'instructions'}
+    )
+    assert response.headers['Location'] == '/agents/'
+    assert client.post('/agents/1/delete').status_code == 302
+    assert client.post('/agents/1/delete-tethered').status_code == 302
+    tenant = sqlite3.connect(tmp_path / '2.sqlite')
+    assert [row[0] for row in tenant.execute('SELECT name FROM agents ORDER BY id')] == ['agent name 2', 'agent name 4']
+    assert tenant.execute('SELECT COUNT(*) FROM tethered_agents').fetchone()[0] == 1
+    tenant.close()
+    with app.app_context():
+        assert get_db().execute('SELECT COUNT(*) FROM agents').fetchone()[0] == 0
+    # the global database is read-only from a tenant's connection
+    with app.test_request_context(method='POST'):
+        g.user = {'id': 3}
+        db = get_tenant_db()
+        assert db.execute('SELECT name FROM agents').fetchall()[0]['name'] == 'agent name 3'
+        with pytest.raises(sqlite3.OperationalError) as e:
+            db.execute('UPDATE users SET admin = 1')
+        assert 'readonly' in str(e.value)
@@ -1,5 +1,9 @@
+import time
+
 import pytest
+from werkzeug.exceptions import Forbidden, NotFound
 from flask import g, session
+from incontext.auth import get_owned_row, invalidate_user
 from incontext.db import get_db
 
 def test_register(client, app):
@@ -52,3 +56,62 @@ def test_logout(client, auth):
     with client:
         auth.logout()
         assert 'user_id' not in session
+
+
+def test_logged_in_user_is_cached(app, client, auth):
+    auth.login()
+    with client:
+        client.get('/')
+        assert g.user == {'id': 2, 'username': 'test', 'admin': 1} # no password hash
+    with app.app_context():
+        get_db().execute("UPDATE users SET username = 'renamed' WHERE id = 2")
+        get_db().commit()
+    with client:
+        client.get('/')
+        assert g.user['username'] == 'test'
+        # static files and views that don't need the user don't load it
+        client.get('/static/styles.css')
+        assert g.user is None
+    with app.app_context():
+        invalidate_user(2)
+    with client:
+        client.get('/')
+        assert g.user['username'] == 'renamed'
+
+
+def test_user_cache_expires(app, client, auth, monkeypatch):
+    auth.login()
+    client.get('/')
+    with app.app_context():
+        get_db().execute('UPDATE users SET admin = 0 WHERE id = 2')
+        get_db().commit()
+    assert client.get('/master-lists/1/edit').status_code == 200
+    now = time.monotonic()
+    monkeypatch.setattr('incontext.auth.time.monotonic', lambda: now + app.config['USER_CACHE_TTL'])
+    assert client.get('/master-lists/1/edit').status_code == 403
+
+
+def test_get_owned_row(app):
+    with app.test_request_context():
+        g.user = {'id': 2}
+        assert dict(get_owned_row('master_lists', 1, 'name')) == {'name': 'master list name 1', 'creator_id': 2}
+        with pytest.raises(NotFound):
+            get_owned_row('master_agents', 99)
+        g.user = {'id': 3}
+        with pytest.raises(Forbidden):
+            get_owned_row('master_lists', 1)
+        assert get_owned_row('master_lists', 1, check_access=False)['id'] == 1
+
+
+def test_ownership_checked_before_loading(app, client, auth):
+    with app.app_context():
+        get_db().execute("UPDATE users SET admin = 1 WHERE username = 'other'")
+        get_db().commit()
+    auth.login('other', 'other')
+    with app.app_context():
+        statements = []
+        get_db(write=False).set_trace_callback(statements.append) # the GET request shares this app context's read-only connection
+        assert client.get('/master-lists/1/master-items/1/view').status_code == 403
+        assert [statement for statement in statements if 'master_' in statement] == [
+            'SELECT id, name, description, creator_id FROM master_lists WHERE id = 1'
+        ]
@@ -0,0 +1,71 @@
+import gzip
+import os
+import sqlite3
+
+import pytest
+from incontext.backup import backup_database
+from incontext.db import get_db
+
+
+def test_backup_command(app, runner, tmp_path):
+    with app.app_context():
+        get_db().execute("INSERT INTO users (username, password) VALUES ('backed up', '')")
+        get_db().commit()
+    result = runner.invoke(args=['backup', '--dest', str(tmp_path), '--pages', '1', '--sleep', '0'])
+    assert result.exit_code == 0
+    name = os.path.basename(app.config['DATABASE'])
+    assert f'{name}: ' in result.output
+    assert ' 0 restarts' in result.output
+    backups = os.listdir(tmp_path)
+    assert len(backups) == 1
+    # copied one page per step
+    pages = int(result.output.split(': ')[1].split(' pages')[0])
+    assert f', {pages} steps,' in result.output
+    db = sqlite3.connect(tmp_path / backups[0] / name)
+    assert db.execute("SELECT COUNT(*) FROM users WHERE username = 'backed up'").fetchone()[0] == 1
+    assert db.execute('PRAGMA journal_mode').fetchone()[0] == 'delete'
+    db.close()
+
+    # compressed, and only the newest backups are kept
+    for _ in range(2):
+        result = runner.invoke(args=['backup', '--dest', str(tmp_path), '--compress', '--keep', '2'])
+    assert 'compressed to' in result.output
+    assert f'Removed {backups[0]}.' in result.output
+    backups = sorted(os.listdir(tmp_path))
+    assert len(backups) == 2
+    with gzip.open(tmp_path / backups[-1] / f'{name}.gz') as f:
+        assert f.read(16) == b'SQLite format 3\x00'
+
+
+def test_backup_tenants(app, runner, tmp_path):
+    app.config['DATABASE_TENANT_DIR'] = str(tmp_path / 'tenants')
+    runner.invoke(args=['split-tenants'])
+    result = runner.invoke(args=['backup', '--dest', str(tmp_path / 'backups')])
+    assert 'tenants/2.sqlite: ' in result.output
+    assert 'tenants/3.sqlite: ' in result.output
+    backup = os.listdir(tmp_path / 'backups')[0]
+    db = sqlite3.connect(tmp_path / 'backups' / backup / 'tenants' / '3.sqlite')
+    assert db.execute('SELECT name FROM agents').fetchall() == [('agent name 3',)]
+    db.close()
+
+
+@pytest.mark.parametrize('journal_mode, restarts', (
+    ('wal', 0), # copies a snapshot
+    ('delete', 3), # starts over after each write, then copies the rest in one step
+))
+def test_backup_during_writes(tmp_path, monkeypatch, journal_mode, restarts):
+    path = str(tmp_path / 'source.sqlite')
+    db = sqlite3.connect(path, isolation_level=None)
+    db.execute(f'PRAGMA journal_mode = {journal_mode}')
+    db.execute('CREATE TABLE t (x)')
+    db.executemany('INSERT INTO t VALUES (?)', ((n,) for n in range(1000)))
+    # a write between every two steps
+    monkeypatch.setattr('incontext.backup.time.sleep', lambda seconds: db.execute('INSERT INTO t VALUES (-1)'))
+    stats = backup_database(path, str(tmp_path / 'backup.sqlite'), 1, 0, 3)
+    assert stats['restarts'] == restarts
+    backup = sqlite3.connect(tmp_path / 'backup.sqlite')
+    count = backup.execute('SELECT COUNT(*) FROM t').fetchone()[0]
+    assert count == 1000 if journal_mode == 'wal' else count > 1000
+    assert backup.execute('PRAGMA integrity_check').fetchone()[0] == 'ok'
+    backup.close()
+    db.close()
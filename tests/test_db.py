@@ -1,8 +1,11 @@
 import sqlite3
 import os
+import threading
+import time
+from datetime import datetime
 
 import pytest
-from incontext.db import get_db
+from incontext.db import LockTimeout, get_db, get_migrations, run_write, transaction, transactional
 from flask import g, session
 
 
@@ -10,11 +13,245 @@ def test_get_close_db(app):
     with app.app_context():
         db = get_db()
         assert db is get_db() # within an application context, `get_db` should return the same connection each time it's called.
+        db.execute("INSERT INTO users (username, password) VALUES ('uncommitted', '')")
+
+    # after the context, the connection goes back to the pool, with its open transaction rolled back
+    with app.app_context():
+        assert get_db() is db
+        assert db.execute('SELECT COUNT(*) FROM users').fetchone()[0] == 3
+        # and a connection that fails the health check is replaced
+        db.close()
+    with app.app_context():
+        assert get_db() is not db
+        assert get_db().execute('SELECT 1').fetchone()[0] == 1
+
+    # a connection given back under a key that's taken replaces the one there, which is closed
+    with app.app_context():
+        outer = get_db()
+        with app.app_context():
+            inner = get_db()
+            get_db(write=False)
+    idle = app.extensions['incontext.db'].idle
+    assert idle[True] is outer
+    assert list(idle) == [False, True] # the writer was given back last
+    with pytest.raises(sqlite3.ProgrammingError):
+        inner.execute('SELECT 1')
+
+    app.config['DATABASE_REUSE_CONNECTIONS'] = False
+    with app.app_context():
+        db = get_db()
 
     with pytest.raises(sqlite3.ProgrammingError) as e:
         db.execute('SELECT 1')
 
-    assert 'closed' in str(e.value) # After the context, the connection should be closed.
+    assert 'closed' in str(e.value) # Without pooling, the connection is closed after the context.
+
+
+def test_connection_pragmas(app, monkeypatch):
+    with app.app_context():
+        db = get_db()
+        assert db.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+        assert db.execute('PRAGMA synchronous').fetchone()[0] == 1 # NORMAL
+        assert db.execute('PRAGMA busy_timeout').fetchone()[0] == 5000
+        db.execute('PRAGMA foreign_keys = OFF')
+    # connection state a previous user changed is reset
+    with app.app_context():
+        assert get_db().execute('PRAGMA foreign_keys').fetchone()[0] == 1
+    # connections aren't shared with a forked process
+    monkeypatch.setattr('incontext.db.os.getpid', lambda: -1)
+    with app.app_context():
+        assert get_db() is not db
+
+
+def test_read_only_and_writer_connections(app):
+    with app.test_request_context(method='GET'):
+        db = get_db()
+        assert db is not get_db(write=True)
+        assert db.execute('SELECT COUNT(*) FROM users').fetchone()[0] == 3
+        with pytest.raises(sqlite3.OperationalError) as e:
+            db.execute("INSERT INTO users (username, password) VALUES ('reader', '')")
+        assert 'readonly' in str(e.value)
+    with app.test_request_context(method='POST'):
+        db = get_db()
+        statements = []
+        db.set_trace_callback(statements.append)
+        db.execute("INSERT INTO users (username, password) VALUES ('writer', '')")
+        db.cursor().execute("INSERT INTO users (username, password) VALUES ('writer 2', '')")
+        db.commit()
+        db.set_trace_callback(None)
+        # writes take the write lock before they start
+        assert statements[0] == 'BEGIN IMMEDIATE'
+        assert statements.count('BEGIN IMMEDIATE') == 1
+
+
+def test_rows_parse_timestamps_when_read(app):
+    with app.app_context():
+        row = get_db().execute("SELECT id, created FROM master_items WHERE id = 1").fetchone()
+        assert isinstance(row['created'], datetime)
+        assert str(row['created']) == row[1] # by index, it's the stored text
+        assert dict(row)['created'] == row['created']
+        assert row['id'] == 1
+
+
+def test_writer_retries_write_lock(app):
+    app.config['DATABASE_PRAGMAS'] = {'busy_timeout': 0}
+    app.config['DATABASE_WRITE_RETRIES'] = 3
+    app.config['DATABASE_WRITE_BACKOFF'] = 0.05
+    app.config['DATABASE_REUSE_CONNECTIONS'] = False
+    other = sqlite3.connect(app.config['DATABASE'], isolation_level=None, check_same_thread=False)
+    other.execute('BEGIN IMMEDIATE')
+    with app.app_context():
+        db = get_db()
+        with pytest.raises(sqlite3.OperationalError) as e:
+            db.execute("INSERT INTO users (username, password) VALUES ('writer', '')")
+        assert 'locked' in str(e.value)
+        assert not db.in_transaction
+        # the lock is let go while the writer backs off
+        threading.Timer(0.05, other.rollback).start()
+        db.execute("INSERT INTO users (username, password) VALUES ('writer', '')")
+        db.commit()
+        assert db.execute('SELECT COUNT(*) FROM users').fetchone()[0] == 4
+    other.close()
+
+
+def insert_user(username):
+    return lambda db: db.execute('INSERT INTO users (username, password) VALUES (?, ?)', (username, '')).lastrowid
+
+
+def test_run_write(app):
+    with app.app_context():
+        assert run_write(insert_user('writer')) == 4
+        with pytest.raises(sqlite3.IntegrityError):
+            run_write(insert_user('writer'))
+        db = get_db()
+        assert not db.in_transaction
+        assert db.execute("SELECT COUNT(*) FROM users WHERE username = 'writer'").fetchone()[0] == 1
+
+
+def test_run_write_retries_unit(app):
+    app.config['DATABASE_WRITE_RETRIES'] = 2
+    app.config['DATABASE_WRITE_BACKOFF'] = 0
+    attempts = []
+
+    def unit(db):
+        attempts.append(db.execute("INSERT INTO users (username, password) VALUES (?, '')", (f'writer {len(attempts)}',)).lastrowid)
+        if len(attempts) < 3:
+            raise sqlite3.OperationalError('database is locked') # like a commit that found readers in the way
+        return attempts[-1]
+
+    with app.app_context():
+        metrics = app.extensions['incontext.metrics']
+        assert run_write(unit) == 4
+        assert attempts == [4, 4, 4] # each attempt was rolled back
+        assert metrics.snapshot() == {'db_write_retries_total': 2, 'db_writes_total': 1}
+        attempts.clear()
+        app.config['DATABASE_WRITE_RETRIES'] = 1
+        with pytest.raises(LockTimeout):
+            run_write(unit)
+        assert attempts == [5, 5]
+        assert metrics.snapshot()['db_write_failures_total'] == 1
+        # other errors aren't retried
+        with pytest.raises(sqlite3.IntegrityError):
+            run_write(insert_user('test'))
+        assert metrics.snapshot()['db_write_retries_total'] == 3
+        assert get_db().execute("SELECT COUNT(*) FROM users WHERE username LIKE 'writer%'").fetchone()[0] == 1
+
+
+def test_transaction(app):
+    with app.app_context():
+        with transaction() as db:
+            assert db.in_transaction
+            db.execute("INSERT INTO users (username, password) VALUES ('writer', '')")
+        with pytest.raises(ValueError):
+            with transaction() as db:
+                db.execute("INSERT INTO users (username, password) VALUES ('rolled back', '')")
+                raise ValueError()
+        assert [row['username'] for row in get_db().execute('SELECT username FROM users WHERE id > 3')] == ['writer']
+        # writes left pending outside a block aren't committed with it
+        db = get_db(write=True)
+        db.execute("INSERT INTO users (username, password) VALUES ('pending', '')")
+        with pytest.raises(sqlite3.ProgrammingError):
+            with transaction():
+                pass
+        assert db.in_transaction
+        db.rollback()
+
+        @transactional
+        def rename_user(db, user_id, username):
+            return db.execute('UPDATE users SET username = ? WHERE id = ?', (username, user_id)).rowcount
+
+        assert rename_user(4, 'renamed') == 1
+        assert get_db().execute('SELECT username FROM users WHERE id = 4').fetchone()[0] == 'renamed'
+
+
+def test_locked_write_is_503(app, client, auth):
+    app.config['DATABASE_PRAGMAS'] = {'busy_timeout': 0}
+    app.config['DATABASE_WRITE_RETRIES'] = 1
+    app.config['DATABASE_WRITE_BACKOFF'] = 0
+    app.config['DATABASE_REUSE_CONNECTIONS'] = False
+    auth.login()
+    other = sqlite3.connect(app.config['DATABASE'], isolation_level=None)
+    other.execute('BEGIN IMMEDIATE')
+    response = client.post('/master-lists/1/master-details/new', data={'name': 'detail', 'description': ''})
+    other.rollback()
+    other.close()
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+    metrics = app.extensions['incontext.metrics'].snapshot()
+    assert (metrics['db_begin_retries_total'], metrics['db_write_failures_total']) == (1, 1)
+    assert client.post('/master-lists/1/master-details/new', data={'name': 'detail', 'description': ''}).status_code == 302
+
+
+def test_group_commit(app, client, auth):
+    app.config['DATABASE_GROUP_COMMIT'] = True
+    statements = []
+    with app.app_context():
+        run_write(lambda db: db.set_trace_callback(statements.append)) # units run on the group commit thread
+    statements.clear()
+    connections = []
+    results = {}
+
+    def write(username):
+        def unit(db):
+            connections.append(db)
+            return insert_user(username)(db)
+        with app.app_context():
+            results[username] = run_write(unit)
+
+    def write_duplicate():
+        with app.app_context():
+            try:
+                run_write(insert_user('test'))
+            except sqlite3.IntegrityError as e:
+                results['test'] = e
+
+    def write_slowly():
+        with app.app_context():
+            run_write(lambda db: time.sleep(0.2))
+
+    # the writes queue up while the group commit thread is busy
+    busy = threading.Thread(target=write_slowly)
+    busy.start()
+    time.sleep(0.05)
+    threads = [threading.Thread(target=write, args=(f'writer {n}',)) for n in range(3)]
+    threads.append(threading.Thread(target=write_duplicate))
+    for thread in threads:
+        thread.start()
+    for thread in threads + [busy]:
+        thread.join()
+    # each request got its own result, and a failing write only failed itself
+    assert sorted(results[f'writer {n}'] for n in range(3)) == [4, 5, 6]
+    assert isinstance(results['test'], sqlite3.IntegrityError)
+    # all written by the one group commit connection, in one transaction after the busy one
+    assert len(set(map(id, connections))) == 1
+    assert statements.count('COMMIT') == 2
+    with app.app_context():
+        assert get_db().execute("SELECT COUNT(*) FROM users WHERE username LIKE 'writer %'").fetchone()[0] == 3
+    # views write through it too
+    auth.login()
+    client.post('/master-lists/1/master-items/new', data={'name': 'grouped item', '1': 'cell', '2': ''})
+    with app.app_context():
+        assert get_db().execute("SELECT COUNT(*) FROM master_items WHERE name = 'grouped item'").fetchone()[0] == 1
 
 
 def test_init_db_command(runner, monkeypatch):
@@ -65,3 +302,132 @@ def test_admin_login(client, auth):
         assert g.user['username'] == 'admin'
         assert g.user["admin"] == True
 
+
+
+def test_migrate_command(app, runner):
+    with app.app_context():
+        db = get_db()
+        # start over from the baseline schema, with data
+        db.execute('PRAGMA foreign_keys = OFF')
+        with app.open_resource('schema.sql') as f:
+            db.executescript(f.read().decode('utf-8'))
+        with open(os.path.join(os.path.dirname(__file__), 'data.sql'), 'rb') as f:
+            db.executescript(f.read().decode('utf-8'))
+    result = runner.invoke(args=['migrate'])
+    assert 'Applied 0001_relation_indexes.sql' in result.output
+    result = runner.invoke(args=['migrate'])
+    assert 'up to date' in result.output
+    with app.app_context():
+        db = get_db()
+        versions = db.execute('SELECT version FROM schema_version').fetchall()
+        assert [version['version'] for version in versions] == [version for version, name in get_migrations()]
+        assert db.execute('SELECT COUNT(*) FROM master_item_detail_relations').fetchone()[0] == 5
+
+
+def query_plan(db, sql, params=()):
+    return [row['detail'] for row in db.execute('EXPLAIN QUERY PLAN ' + sql, params).fetchall()]
+
+
+@pytest.mark.parametrize(('sql', 'expected'), (
+    (
+        'SELECT master_item_id FROM master_list_item_relations WHERE master_list_id = ?',
+        'SEARCH master_list_item_relations USING COVERING INDEX master_list_item_relations_list_item (master_list_id=?)',
+    ),
+    (
+        'SELECT master_list_id FROM master_list_item_relations WHERE master_item_id = ?',
+        'SEARCH master_list_item_relations USING COVERING INDEX master_list_item_relations_item (master_item_id=?)',
+    ),
+    (
+        'SELECT master_detail_id FROM master_list_detail_relations WHERE master_list_id = ?',
+        'SEARCH master_list_detail_relations USING COVERING INDEX master_list_detail_relations_list_detail (master_list_id=?)',
+    ),
+    (
+        'SELECT master_list_id FROM master_list_detail_relations WHERE master_detail_id = ?',
+        'SEARCH master_list_detail_relations USING COVERING INDEX master_list_detail_relations_detail (master_detail_id=?)',
+    ),
+    (
+        'SELECT master_content FROM master_item_detail_relations WHERE master_item_id = ? AND master_detail_id = ?',
+        'SEARCH master_item_detail_relations USING INDEX master_item_detail_relations_item_detail (master_item_id=? AND master_detail_id=?)',
+    ),
+    (
+        'SELECT master_item_id, master_content FROM master_item_detail_relations WHERE master_detail_id = ?',
+        'SEARCH master_item_detail_relations USING COVERING INDEX master_item_detail_relations_detail (master_detail_id=?)',
+    ),
+))
+def test_relation_indexes(app, sql, expected):
+    with app.app_context():
+        plan = query_plan(get_db(), sql, (1,) * sql.count('?'))
+        assert plan == [expected]
+
+
+def test_master_list_queries_use_indexes(app):
+    with app.app_context():
+        db = get_db()
+        plan = query_plan(
+            db,
+            'SELECT master_item_id, master_detail_id, master_content'
+            ' FROM master_item_detail_relations'
+            ' WHERE master_detail_id IN'
+            ' (SELECT master_detail_id FROM master_list_detail_relations WHERE master_list_id = ?)',
+            (1,)
+        )
+        assert not [step for step in plan if step.startswith('SCAN')]
+
+
+def first_column(db, sql):
+    return [row[0] for row in db.execute(sql).fetchall()]
+
+
+def test_foreign_keys_cascade(app):
+    with app.app_context():
+        db = get_db()
+        assert db.execute('PRAGMA foreign_keys').fetchone()[0] == 1
+        with pytest.raises(sqlite3.IntegrityError):
+            db.execute('INSERT INTO master_list_item_relations (master_list_id, master_item_id) VALUES (99, 1)')
+        db.rollback()
+        db.execute('DELETE FROM master_lists WHERE id = 1')
+        assert first_column(db, 'SELECT id FROM master_items') == [3]
+        assert first_column(db, 'SELECT id FROM master_details') == [3]
+        assert first_column(db, 'SELECT master_item_id FROM master_item_detail_relations') == [3]
+        assert first_column(db, 'SELECT master_list_id FROM master_list_item_relations') == [2]
+        assert first_column(db, 'SELECT master_list_id FROM master_list_detail_relations') == [2]
+        db.execute('DELETE FROM master_agents WHERE id = 1')
+        assert first_column(db, 'SELECT master_agent_id FROM tethered_agents') == [2, 3]
+
+
+def test_sweep_orphans_command(app, runner):
+    with app.app_context():
+        db = get_db()
+        db.execute('PRAGMA foreign_keys = OFF')
+        db.execute("INSERT INTO master_items (creator_id, name) VALUES (2, 'orphan item')")
+        db.execute("INSERT INTO master_item_detail_relations (master_item_id, master_detail_id, master_content) VALUES (99, 1, 'orphan content')")
+        db.execute('INSERT INTO master_list_item_relations (master_list_id, master_item_id) VALUES (99, 3)')
+        db.execute('INSERT INTO tethered_agents (creator_id, master_agent_id) VALUES (2, 99)')
+        db.commit()
+    result = runner.invoke(args=['sweep-orphans'])
+    assert 'master_items: 1 deleted' in result.output
+    assert 'master_item_detail_relations: 1 deleted' in result.output
+    assert 'master_list_item_relations: 1 deleted' in result.output
+    assert 'tethered_agents: 1 deleted' in result.output
+    with app.app_context():
+        db = get_db()
+        assert first_column(db, 'SELECT id FROM master_items') == [1, 2, 3]
+        assert db.execute('SELECT COUNT(*) FROM master_item_detail_relations').fetchone()[0] == 5
+        assert db.execute('SELECT COUNT(*) FROM tethered_agents').fetchone()[0] == 3
+        assert db.execute('PRAGMA foreign_key_check').fetchall() == []
+
+
+def test_sweep_tenant_orphans(app, runner, tmp_path):
+    app.config['DATABASE_TENANTS'] = True
+    app.config['DATABASE_TENANT_DIR'] = str(tmp_path)
+    runner.invoke(args=['split-tenants'])
+    with app.app_context():
+        db = get_db()
+        db.execute('DELETE FROM master_agents WHERE id IN (1, 3)') # nothing points at them from the global database anymore
+        db.commit()
+    result = runner.invoke(args=['sweep-orphans'])
+    assert 'tenant tethered_agents: 2 deleted' in result.output
+    for tenant_id, master_agent_ids in ((2, [2]), (3, [])):
+        tenant = sqlite3.connect(tmp_path / f'{tenant_id}.sqlite')
+        assert [row[0] for row in tenant.execute('SELECT master_agent_id FROM tethered_agents')] == master_agent_ids
+        tenant.close()
@@ -0,0 +1,85 @@
+import os
+import sqlite3
+import threading
+
+from incontext.db import get_db
+from incontext.maintenance import is_maintenance_due, maintain_database
+
+
+def test_maintain_database(tmp_path):
+    path = str(tmp_path / 'maintain.sqlite')
+    db = sqlite3.connect(path, isolation_level=None)
+    db.execute('PRAGMA auto_vacuum = INCREMENTAL')
+    db.execute('CREATE TABLE t (a, b)')
+    db.execute('CREATE INDEX t_a ON t (a)')
+    db.execute('CREATE INDEX t_b ON t (b)')
+    db.execute('CREATE TABLE churn (x)')
+    db.executemany('INSERT INTO t VALUES (?, ?)', ((i, i % 2) for i in range(1000)))
+    db.executemany('INSERT INTO churn VALUES (?)', ((b'x' * 2000,) for _ in range(200)))
+    db.execute('DELETE FROM churn')
+    free_pages = db.execute('PRAGMA freelist_count').fetchone()[0]
+    assert free_pages >= 100
+    statement = ('SELECT * FROM t WHERE a > ? AND b = ?', [1, 0])
+    # without statistics, the planner takes `b = ?` to be the more selective
+    assert db.execute('EXPLAIN QUERY PLAN ' + statement[0], statement[1]).fetchone()[3] == 'SEARCH t USING INDEX t_b (b=?)'
+    db.close()
+
+    stats = maintain_database(path, [statement], vacuum_pages=50, sleep=0)
+    assert stats['complete']
+    assert (stats['tables_analyzed'], stats['tables']) == (2, 2)
+    assert stats['pages_reclaimed'] == stats['free_pages'] >= free_pages - 1 # sqlite_stat1 took one
+    assert stats['changed_plans'] == [
+        (statement[0], ['SEARCH t USING INDEX t_b (b=?)'], ['SEARCH t USING INDEX t_a (a>?)'])
+    ]
+    db = sqlite3.connect(path)
+    assert db.execute('PRAGMA freelist_count').fetchone()[0] == 0
+    assert db.execute("SELECT COUNT(*) FROM sqlite_stat1 WHERE tbl = 't'").fetchone()[0] == 2
+    db.close()
+
+    # out of time: nothing is started
+    stats = maintain_database(path, time_limit=0)
+    assert stats['tables_analyzed'] == 0
+    assert not stats['complete']
+
+
+def test_db_maintain_command(app, runner):
+    app.config['MAINTENANCE_SLEEP'] = 0
+    with app.app_context():
+        db = get_db()
+        assert db.execute('PRAGMA auto_vacuum').fetchone()[0] == 2 # set up by migration 0005
+        db.executemany('INSERT INTO master_items (name, creator_id) VALUES (?, 1)', (('x' * 2000,) for _ in range(100)))
+        db.commit()
+        db.execute('DELETE FROM master_items WHERE id > 4')
+        db.commit()
+    result = runner.invoke(args=['db-maintain'])
+    assert ': analyzed ' in result.output.splitlines()[0]
+    assert ' reclaimed 0 of 0 ' not in result.output
+    assert 'Stopped' not in result.output
+    assert 'auto_vacuum' not in result.output
+    with app.app_context():
+        assert get_db().execute('PRAGMA freelist_count').fetchone()[0] == 0
+
+    result = runner.invoke(args=['db-maintain', '--time-limit', '0'])
+    assert 'analyzed 0 of' in result.output
+
+
+def test_is_maintenance_due(tmp_path):
+    stamp = str(tmp_path / 'maintenance.stamp')
+    assert is_maintenance_due(stamp, 60)
+    assert not is_maintenance_due(stamp, 60)
+    assert is_maintenance_due(stamp, 0)
+    # of processes (here, threads with their own file handles) that wake together, one runs it
+    (tmp_path / 'other.stamp').write_text('1\n')
+    os.utime(tmp_path / 'other.stamp', (0, 0)) # long ago
+    results = []
+    start = threading.Barrier(8)
+
+    def ask():
+        start.wait()
+        results.append(is_maintenance_due(str(tmp_path / 'other.stamp'), 60))
+    threads = [threading.Thread(target=ask) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(results) == [False] * 7 + [True]
@@ -1,5 +1,10 @@
+import csv
+import io
+import json
+
 import pytest
 from incontext.db import get_db
+from incontext.master_lists import get_master_list, get_master_items_page
 
 
 def test_index(client, auth):
@@ -665,3 +670,384 @@ def test_delete_master_detail(client, auth, app):
     assert response.headers["Location"] == "/master-lists/1/view"
 
 
+def test_master_list_grid(app):
+    with app.app_context():
+        db = get_db()
+        # cells inserted out of column order, and one missing cell
+        db.execute("INSERT INTO master_items (creator_id, name) VALUES (2, 'master item name 4')")
+        db.execute('INSERT INTO master_list_item_relations (master_list_id, master_item_id) VALUES (1, 4)')
+        db.execute("INSERT INTO master_item_detail_relations (master_item_id, master_detail_id, master_content) VALUES (4, 2, 'master relation content 7')")
+        db.commit()
+        master_list = get_master_list(1, check_access=False)
+        assert [master_detail['id'] for master_detail in master_list['master_details']] == [1, 2]
+        master_items = {master_item['id']: master_item for master_item in master_list['master_items']}
+        assert master_items[1]['master_contents'] == ['master relation content 1', 'master relation content 2']
+        assert master_items[2]['master_contents'] == ['master relation content 3', 'master relation content 4']
+        assert master_items[4]['master_contents'] == ['', 'master relation content 7']
+
+
+def test_view_master_list_pagination(app, client, auth):
+    with app.app_context():
+        db = get_db()
+        for n in range(4, 9):
+            cur = db.execute('INSERT INTO master_items (creator_id, name) VALUES (2, ?)', (f'master item name {n}',))
+            db.execute('INSERT INTO master_list_item_relations (master_list_id, master_item_id) VALUES (1, ?)', (cur.lastrowid,))
+        db.commit()
+    # list 1 now has items 1, 2, 4, 5, 6, 7, 8
+    auth.login()
+    response = client.get('/master-lists/1/view?limit=3')
+    assert response.status_code == 200
+    assert b'7 items' in response.data
+    assert b'master relation content 1' in response.data
+    assert b'master item name 4' in response.data
+    assert b'master item name 5' not in response.data
+    assert b'/master-lists/1/view?after=4&amp;limit=3' in response.data
+    assert b'Previous' not in response.data
+    response = client.get('/master-lists/1/view?after=4&limit=3')
+    assert b'master item name 4' not in response.data
+    assert b'master item name 5' in response.data
+    assert b'master item name 7' in response.data
+    assert b'master relation content 1' not in response.data
+    assert b'/master-lists/1/view?after=7&amp;limit=3' in response.data
+    # previous page is the first page
+    assert b'/master-lists/1/view?limit=3' in response.data
+    response = client.get('/master-lists/1/view?after=7&limit=3')
+    assert b'master item name 8' in response.data
+    assert b'Next' not in response.data
+    assert b'/master-lists/1/view?after=4&amp;limit=3' in response.data
+    response = client.get('/master-lists/1/view?after=2&limit=3')
+    assert b'master item name 4' in response.data
+    assert b'master item name 7' not in response.data
+    # the page size is capped
+    app.config['MASTER_ITEMS_MAX_PER_PAGE'] = 2
+    response = client.get('/master-lists/1/view?limit=50')
+    assert b'master item name 2' in response.data
+    assert b'master item name 4' not in response.data
+
+
+def test_view_master_list_sort_and_filter(app, client, auth):
+    with app.app_context():
+        db = get_db()
+        # detail 1 gets numbers, one of them missing
+        for n, content in zip(range(4, 9), ('10', '9', None, '100', 'ten')):
+            cur = db.execute('INSERT INTO master_items (creator_id, name) VALUES (2, ?)', (f'master item name {n}',))
+            db.execute('INSERT INTO master_list_item_relations (master_list_id, master_item_id) VALUES (1, ?)', (cur.lastrowid,))
+            if content is not None:
+                db.execute(
+                    'INSERT INTO master_item_detail_relations (master_item_id, master_detail_id, master_content) VALUES (?, 1, ?)',
+                    (cur.lastrowid, content)
+                )
+        db.commit()
+        master_details = get_master_list(1, check_access=False, with_master_items=False)['master_details']
+
+        def item_ids(after=None, limit=100, sort=None, filters=()):
+            master_items, page = get_master_items_page(1, master_details, after, limit, sort, filters)
+            return [master_item['id'] for master_item in master_items], page
+
+        # sorted by cell text, missing cells first, ties by id
+        assert item_ids(sort='1')[0] == [6, 4, 7, 5, 1, 2, 8]
+        assert item_ids(sort='-1')[0] == [8, 2, 1, 5, 7, 4, 6]
+        assert item_ids(sort='-name')[0] == [8, 7, 6, 5, 4, 2, 1]
+        assert item_ids(after=5, sort='-name', limit=2)[0] == [4, 2]
+        assert item_ids(after=2, sort='created', limit=2)[0] == [4, 5]
+        # pages follow the sort
+        ids, page = item_ids(sort='1', limit=3)
+        assert ids == [6, 4, 7] and page['next_after'] == 7
+        ids, page = item_ids(after=7, sort='1', limit=3)
+        assert ids == [5, 1, 2] and page['next_after'] == 2 and page['has_prev'] and page['prev_after'] is None
+        ids, page = item_ids(after=2, sort='1', limit=3)
+        assert ids == [8] and page['next_after'] is None and page['prev_after'] == 7
+        ids, page = item_ids(after=5, sort='-1', limit=3)
+        assert ids == [7, 4, 6]
+        # filters combine, count and page together
+        assert item_ids(filters=[('1', 'eq', '10')])[0] == [4]
+        assert item_ids(filters=[('1', 'contains', 'CONTENT')])[0] == [1, 2]
+        assert item_ids(filters=[('1', 'contains', '%')])[0] == []
+        assert item_ids(filters=[('1', 'min', '9'), ('1', 'max', '99')])[0] == [4, 5]
+        assert item_ids(filters=[('1', 'min', 'n')])[0] == [8]
+        assert item_ids(filters=[('name', 'contains', 'name 1')])[0] == [1]
+        # cells sort as text
+        ids, page = item_ids(sort='-1', limit=1, filters=[('1', 'min', '9')])
+        assert ids == [5] and page['count'] == 3
+        assert item_ids(after=5, sort='-1', limit=1, filters=[('1', 'min', '9')])[0] == [7]
+    # the view reads them from the query string, and its links keep them
+    auth.login()
+    response = client.get('/master-lists/1/view?sort=-1&column=1&op=min&value=9&limit=1')
+    assert b'3 items' in response.data
+    assert b'master item name 5' in response.data
+    assert b'/master-lists/1/view?after=5&amp;limit=1&amp;sort=-1&amp;column=1&amp;op=min&amp;value=9' in response.data
+    # unknown columns, ops and empty values are ignored
+    response = client.get('/master-lists/1/view?sort=99&column=99&op=eq&value=x&column=1&op=eq&value=')
+    assert b'7 items' in response.data
+    response = client.get('/master-lists/1/view?column=1&op=eq&value=nothing')
+    assert b'No matching items' in response.data
+
+
+@pytest.mark.parametrize(('method', 'path'), (
+    ('get', '/master-lists/1/master-items/1/view'),
+    ('get', '/master-lists/1/master-items/1/edit'),
+))
+def test_master_item_loaded_in_one_query(app, client, auth, method, path):
+    auth.login()
+    with app.app_context():
+        statements = []
+        get_db(write=False).set_trace_callback(statements.append) # the GET request shares this app context and its read-only connection
+        response = getattr(client, method)(path)
+        assert response.status_code == 200
+        statements = [statement for statement in statements if 'master_' in statement]
+        # the list and its ownership check by primary key, then the item without the list
+        assert statements[0] == 'SELECT id, name, description, creator_id FROM master_lists WHERE id = 1'
+        statements = statements[1:]
+        assert len(statements) == 1
+        assert 'JOIN master_lists' not in statements[0]
+        plan = get_db().execute('EXPLAIN QUERY PLAN ' + statements[0]).fetchall()
+        assert not [step['detail'] for step in plan if step['detail'].startswith('SCAN') or 'TEMP B-TREE' in step['detail']]
+
+
+def test_import_master_items(app, client, auth):
+    # user must be logged in
+    response = client.get('/master-lists/1/import')
+    assert response.status_code == 302
+    assert response.headers['Location'] == '/auth/login'
+    # user must be admin
+    auth.login('other', 'other')
+    assert client.get('/master-lists/1/import').status_code == 403
+    auth.login()
+    assert client.get('/master-lists/1/import').status_code == 200
+    # data validation
+    response = client.post('/master-lists/1/import', data={}, content_type='multipart/form-data')
+    assert b'File is required' in response.data
+    response = client.post(
+        '/master-lists/1/import',
+        data={'file': (io.BytesIO(b'title,master detail name 1\nx,y\n'), 'items.csv')},
+        content_type='multipart/form-data'
+    )
+    assert b'needs a name column' in response.data
+    response = client.post(
+        '/master-lists/1/import',
+        data={'file': (io.BytesIO(b'{"name": "a"}\n{"master detail name 1": "b"}\n'), 'items.jsonl')},
+        content_type='multipart/form-data'
+    )
+    assert b'Line 2: name is required' in response.data
+    for data, message in (
+        (b'name,,x\na,b,c\n', b'Line 1: column 2 has no name.'),
+        (b'name,x,x\na,b,c\n', b'Line 1: column x appears more than once.'),
+        (b'name,x\na,' + b'b' * 200000 + b'\n', b'Invalid CSV: field larger than field limit'),
+    ):
+        response = client.post('/master-lists/1/import', data={'file': (io.BytesIO(data), 'items.csv')}, content_type='multipart/form-data')
+        assert response.status_code == 200
+        assert message in response.data
+    response = client.post(
+        '/master-lists/1/import', data={'file': (io.BytesIO(b'{"name": "a", " ": "b"}\n'), 'items.jsonl')}, content_type='multipart/form-data'
+    )
+    assert b'Line 1: a column has no name.' in response.data
+    with app.app_context():
+        # a failed import leaves nothing behind
+        assert get_db().execute('SELECT COUNT(*) FROM master_items').fetchone()[0] == 3
+    # csv rows are imported, with new columns becoming master details
+    response = client.post(
+        '/master-lists/1/import',
+        data={'file': (io.BytesIO(
+            b'name,master detail name 2,master detail name 4\n'
+            b'master item name 4,master relation content 6,master relation content 7\n'
+            b'master item name 5,,master relation content 8\n'
+        ), 'items.csv')},
+        content_type='multipart/form-data'
+    )
+    assert response.status_code == 302
+    assert response.headers['Location'] == '/master-lists/1/view'
+    with app.app_context():
+        master_list = get_master_list(1, check_access=False)
+        assert [master_detail['name'] for master_detail in master_list['master_details']] == [
+            'master detail name 1', 'master detail name 2', 'master detail name 4'
+        ]
+        master_items = {master_item['name']: master_item['master_contents'] for master_item in master_list['master_items']}
+        assert master_items['master item name 1'] == ['master relation content 1', 'master relation content 2', '']
+        assert master_items['master item name 4'] == ['', 'master relation content 6', 'master relation content 7']
+        assert master_items['master item name 5'] == ['', '', 'master relation content 8']
+    # jsonl rows are imported too
+    response = client.post(
+        '/master-lists/2/import',
+        data={'file': (io.BytesIO(
+            b'{"name": "master item name 6", "master detail name 3": 42}\n'
+            b'\n'
+            b'{"name": "master item name 7", "master detail name 5": "master relation content 9"}\n'
+        ), 'items.ndjson')},
+        content_type='multipart/form-data'
+    )
+    assert response.status_code == 302
+    with app.app_context():
+        master_list = get_master_list(2, check_access=False)
+        master_items = {master_item['name']: master_item['master_contents'] for master_item in master_list['master_items']}
+        assert master_items['master item name 6'] == ['42', '']
+        assert master_items['master item name 7'] == ['', 'master relation content 9']
+        assert master_items['master item name 3'] == ['master relation content 5', '']
+
+
+def test_import_list_command(app, runner, tmp_path):
+    path = tmp_path / 'items.csv'
+    path.write_text('name,master detail name 1\n' + ''.join(f'imported item {n},content {n}\n' for n in range(2500)))
+    result = runner.invoke(args=['import-list', '1', str(path)])
+    assert 'Imported 2500 items, 2500 cells and 0 new details.' in result.output
+    with app.app_context():
+        master_list = get_master_list(1, check_access=False)
+        assert len(master_list['master_items']) == 2502
+        assert master_list['master_items'][-1]['name'] == 'imported item 2499'
+        assert master_list['master_items'][-1]['master_contents'] == ['content 2499', '']
+    result = runner.invoke(args=['import-list', '3', str(path)])
+    assert 'Master list 3 does not exist' in result.output
+    path.write_text('name,x\na,' + 'b' * 200000 + '\n')
+    result = runner.invoke(args=['import-list', '1', str(path)])
+    assert result.exit_code == 1
+    assert 'Invalid CSV: field larger than field limit' in result.output
+
+
+def test_export_master_items(app, client, auth):
+    # user must be logged in
+    response = client.get('/master-lists/1/export.csv')
+    assert response.status_code == 302
+    assert response.headers['Location'] == '/auth/login'
+    # user must be admin
+    auth.login('other', 'other')
+    assert client.get('/master-lists/1/export.csv').status_code == 403
+    auth.login()
+    # master list must exist
+    assert client.get('/master-lists/3/export.csv').status_code == 404
+    assert client.get('/master-lists/1/export.xml').status_code == 404
+    with app.app_context():
+        created = [str(row['created']) for row in get_db().execute('SELECT created FROM master_items WHERE id IN (1, 2)')]
+    response = client.get('/master-lists/1/export.csv')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/csv'
+    assert response.is_streamed
+    rows = list(csv.reader(io.StringIO(response.get_data(as_text=True))))
+    assert rows == [
+        ['id', 'name', 'created', 'master detail name 1', 'master detail name 2'],
+        ['1', 'master item name 1', created[0], 'master relation content 1', 'master relation content 2'],
+        ['2', 'master item name 2', created[1], 'master relation content 3', 'master relation content 4'],
+    ]
+    response = client.get('/master-lists/2/export.ndjson')
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    rows = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert len(rows) == 1
+    assert rows[0]['id'] == 3
+    assert rows[0]['name'] == 'master item name 3'
+    assert rows[0]['master detail name 3'] == 'master relation content 5'
+    # an export can be imported again
+    response = client.post(
+        '/master-lists/2/import',
+        data={'file': (io.BytesIO(client.get('/master-lists/1/export.csv').data), 'items.csv')},
+        content_type='multipart/form-data'
+    )
+    with app.app_context():
+        master_list = get_master_list(2, check_access=False)
+        assert [master_detail['name'] for master_detail in master_list['master_details']] == [
+            'master detail name 3', 'master detail name 1', 'master detail name 2'
+        ]
+        assert master_list['master_items'][-1]['master_contents'] == ['', 'master relation content 3', 'master relation content 4']
+
+
+def test_export_ambiguous_master_details(app, client, auth):
+    with app.app_context():
+        db = get_db()
+        db.executemany("INSERT INTO master_details (id, creator_id, name, description) VALUES (?, 2, ?, '')", ((4, 'master detail name 1'), (5, 'name')))
+        db.executemany('INSERT INTO master_list_detail_relations (master_list_id, master_detail_id) VALUES (1, ?)', ((4,), (5,)))
+        db.executemany("INSERT INTO master_item_detail_relations (master_item_id, master_detail_id, master_content) VALUES (1, ?, ?)", ((4, 'same name'), (5, 'reserved name')))
+        db.commit()
+    auth.login()
+    # details sharing a name, or named like an item field, are told apart by their ids
+    rows = list(csv.reader(io.StringIO(client.get('/master-lists/1/export.csv').get_data(as_text=True))))
+    assert rows[0] == ['id', 'name', 'created', 'master detail name 1 #1', 'master detail name 2', 'master detail name 1 #4', 'name #5']
+    rows = [json.loads(line) for line in client.get('/master-lists/1/export.ndjson').get_data(as_text=True).splitlines()]
+    assert rows[0]['name'] == 'master item name 1'
+    assert (rows[0]['master detail name 1 #1'], rows[0]['master detail name 1 #4'], rows[0]['name #5']) == (
+        'master relation content 1', 'same name', 'reserved name'
+    )
+    # and imported back into the same details
+    response = client.post(
+        '/master-lists/1/import',
+        data={'file': (io.BytesIO(client.get('/master-lists/1/export.csv').data), 'items.csv')},
+        content_type='multipart/form-data'
+    )
+    assert response.status_code == 302
+    with app.app_context():
+        master_list = get_master_list(1, check_access=False)
+        assert len(master_list['master_details']) == 4
+        assert master_list['master_items'][2]['name'] == 'master item name 1'
+        assert master_list['master_items'][2]['master_contents'] == [
+            'master relation content 1', 'master relation content 2', 'same name', 'reserved name'
+        ]
+
+
+def test_sparse_master_contents(app, client, auth):
+    auth.login()
+    with app.app_context():
+        db = get_db()
+        cell_count = db.execute('SELECT COUNT(*) FROM master_item_detail_relations').fetchone()[0]
+        # adding a detail doesn't write a cell per item
+        client.post('/master-lists/1/master-details/new', data={'name': 'master detail name 4', 'description': ''})
+        assert db.execute('SELECT COUNT(*) FROM master_item_detail_relations').fetchone()[0] == cell_count
+        master_list = get_master_list(1, check_access=False)
+        assert master_list['master_items'][0]['master_contents'] == ['master relation content 1', 'master relation content 2', '']
+        assert b'master detail name 4' in client.get('/master-lists/1/master-items/1/edit').data
+        # editing fills in the missing cell and drops emptied ones
+        client.post(
+            '/master-lists/1/master-items/1/edit',
+            data={'name': 'master item name 1', '1': '', '2': 'master relation content 2', '4': 'master relation content 6'}
+        )
+        master_contents = db.execute(
+            'SELECT master_detail_id, master_content FROM master_item_detail_relations WHERE master_item_id = 1 ORDER BY master_detail_id'
+        ).fetchall()
+        assert [tuple(master_content) for master_content in master_contents] == [
+            (2, 'master relation content 2'), (4, 'master relation content 6')
+        ]
+        # new items only store filled cells
+        client.post('/master-lists/1/master-items/new', data={'name': 'master item name 4', '1': '', '2': 'x', '4': ''})
+        assert db.execute('SELECT COUNT(*) FROM master_item_detail_relations WHERE master_item_id = 4').fetchone()[0] == 1
+    response = client.get('/master-lists/1/master-items/4/view')
+    assert response.status_code == 200
+    assert b'master detail name 4' in response.data
+
+
+def test_search_master_list(app, client, auth):
+    # user must be logged in
+    response = client.get('/master-lists/1/search?q=content')
+    assert response.status_code == 302
+    assert response.headers['Location'] == '/auth/login'
+    # user must be master list creator
+    auth.login('other', 'other')
+    assert client.get('/master-lists/1/search?q=content').status_code == 403
+    auth.login()
+    assert client.get('/master-lists/1/search').status_code == 200
+    assert client.get('/master-lists/3/search?q=content').status_code == 404
+    # cells and names of this list match, other lists' don't
+    response = client.get('/master-lists/1/search?q=relation+content')
+    assert b'4 hits' in response.data
+    assert b'master <mark>relation</mark> <mark>content</mark> 3' in response.data
+    assert b'master relation content 5' not in response.data
+    response = client.get('/master-lists/1/search?q=name+2')
+    assert b'1 hits' in response.data
+    assert b'master item <mark>name</mark> <mark>2</mark>' in response.data
+    # prefixes match and fts syntax is taken literally
+    assert b'4 hits' in client.get('/master-lists/1/search?q=relat').data
+    assert b'0 hits' in client.get('/master-lists/1/search?q=ma').data # too short to be a prefix
+    assert b'0 hits' in client.get('/master-lists/1/search?q=%22content+OR').data
+    # the index follows edits and deletes
+    client.post(
+        '/master-lists/1/master-items/1/edit',
+        data={'name': 'master item name 1', '1': 'needle <b>', '2': 'master relation content 2'}
+    )
+    response = client.get('/master-lists/1/search?q=needle')
+    assert b'1 hits' in response.data
+    assert b'<mark>needle</mark> &lt;b&gt;' in response.data
+    client.post('/master-lists/1/master-items/1/delete')
+    assert b'0 hits' in client.get('/master-lists/1/search?q=needle').data
+    # hits are paginated
+    app.config['SEARCH_RESULTS_PER_PAGE'] = 2
+    response = client.get('/master-lists/1/search?q=master') # item 2's name and its two cells
+    assert b'3 hits' in response.data
+    assert b'page=2' in response.data
+    response = client.get('/master-lists/1/search?q=master&page=2')
+    assert b'page=1' in response.data
+    assert b'page=3' not in response.data
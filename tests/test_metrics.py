@@ -0,0 +1,13 @@
+def test_metrics(app, client, auth):
+    assert client.get('/metrics').headers['Location'] == '/auth/login'
+    auth.login('other', 'other')
+    assert client.get('/metrics').status_code == 403
+
+    auth.login()
+    client.post('/master-lists/1/master-details/new', data={'name': 'detail', 'description': ''})
+    response = client.get('/metrics')
+    assert response.mimetype == 'text/plain'
+    lines = response.get_data(as_text=True).splitlines()
+    assert 'db_writes_total 1' in lines
+    assert 'login_attempts_total 2' in lines
+    assert 'login_throttle_burst{bucket="ip"} 20' in lines
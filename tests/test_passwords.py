@@ -0,0 +1,51 @@
+import pytest
+from incontext.db import get_db
+from incontext.passwords import get_password_hasher
+
+
+def get_password(app, username='test'):
+    with app.app_context():
+        return get_db().execute('SELECT password FROM users WHERE username = ?', (username,)).fetchone()[0]
+
+
+def test_rehash_on_login(app, auth):
+    old_hash = get_password(app)
+    app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:1000'
+    assert b'Incorrect password' in auth.login('test', 'wrong').data
+    assert get_password(app) == old_hash
+
+    assert auth.login().headers['Location'] == '/'
+    assert get_password(app).startswith('pbkdf2:sha256:1000$')
+    assert auth.login().headers['Location'] == '/'
+
+
+@pytest.fixture
+def pooled_app(app):
+    app.config['PASSWORD_HASH_WORKERS'] = 1
+    yield app
+    with app.app_context():
+        get_password_hasher().shutdown()
+
+
+def test_hashing_pool(pooled_app, client, auth):
+    app = pooled_app
+    app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:1000'
+    assert client.post('/auth/register', data={'username': 'a', 'password': 'a'}).status_code == 302
+    assert get_password(app, 'a').startswith('pbkdf2:sha256:1000$')
+    assert auth.login('a', 'a').headers['Location'] == '/'
+    assert auth.login().headers['Location'] == '/'
+    assert get_password(app).startswith('pbkdf2:sha256:1000$') # rehashed in the pool
+    assert b'Incorrect password' in auth.login('a', 'b').data
+
+    # a hash that takes too long: the rehash with scrypt
+    app.config['PASSWORD_HASH_METHOD'] = 'scrypt:32768:8:1'
+    with app.app_context():
+        get_password_hasher().timeout = 0.01
+    response = auth.login()
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+
+
+def test_hashing_queue_limit(pooled_app, auth):
+    pooled_app.config['PASSWORD_HASH_QUEUE'] = 0
+    assert auth.login().status_code == 503
@@ -0,0 +1,123 @@
+import re
+import time
+
+from incontext.db import get_db
+from incontext.querylog import QueryLog, normalize, read_slow_query_log, summarize_slow_queries
+from flask import g
+
+
+def test_normalize():
+    assert normalize("SELECT * FROM users\n WHERE id = 12 AND username = 'o''brien'") == 'SELECT * FROM users WHERE id = ? AND username = ?'
+    assert normalize('SELECT t1.id FROM t1 WHERE id IN (1, 2, 3)') == normalize('SELECT t1.id FROM t1 WHERE id IN (4, 5)')
+    assert normalize('SELECT x FROM t WHERE y > -1.5e3') == 'SELECT x FROM t WHERE y > ?'
+
+
+def test_query_log(app):
+    with app.test_request_context(method='GET'):
+        g.query_log = QueryLog()
+        db = get_db()
+        for user_id in (1, 2, 3):
+            db.execute('SELECT username FROM users WHERE id = ?', (user_id,)).fetchone()
+        assert [row['id'] for row in db.execute('SELECT id FROM users ORDER BY id')] == [1, 2, 3]
+        # the same statement with its values inlined counts as the same
+        db.execute('SELECT username FROM users WHERE id = 4').fetchall()
+        stats = g.query_log.statements
+        assert stats['SELECT username FROM users WHERE id = ?'][0] == 4
+        assert stats['SELECT username FROM users WHERE id = ?'][2] == 3 # rows fetched
+        assert stats['SELECT id FROM users ORDER BY id'][2] == 3
+        executions, seconds, rows = g.query_log.totals()
+        assert (executions, rows) == (5, 6)
+        assert seconds > 0
+        assert g.query_log.repeated(3) == [('SELECT username FROM users WHERE id = ?', 4)]
+
+    # writes count the rows they change
+    with app.test_request_context(method='POST'):
+        g.query_log = QueryLog()
+        get_db().execute("UPDATE users SET password = ''")
+        assert g.query_log.totals()[2] == 3
+
+
+def test_sampled_requests(app, client, auth, caplog):
+    auth.login()
+    app.config['QUERY_LOG_SAMPLE_RATE'] = 0
+    assert 'Server-Timing' not in client.get('/master-lists/1/view').headers
+
+    app.config['QUERY_LOG_SAMPLE_RATE'] = 1
+    response = client.get('/master-lists/1/view')
+    assert response.status_code == 200
+    match = re.fullmatch(r'db;dur=[\d.]+;desc="(\d+) queries, (\d+) rows, 0 repeated"', response.headers['Server-Timing'])
+    assert int(match[1]) > 1
+    # a connection taken back from the pool by an unsampled request logs nothing
+    app.config['QUERY_LOG_SAMPLE_RATE'] = 0
+    with app.test_request_context(method='GET'):
+        assert get_db().query_log is None
+
+    # statements repeated within a request are logged
+    app.config['QUERY_LOG_SAMPLE_RATE'] = 1
+    app.config['QUERY_LOG_REPEAT_THRESHOLD'] = 1
+    response = client.get('/master-lists/1/view')
+    assert 'repeated"' in response.headers['Server-Timing']
+    assert 'ran this 1 times: SELECT' in caplog.text
+
+
+def test_slow_query_log(app, client, auth, runner, tmp_path):
+    app.config['SLOW_QUERY_LOG'] = str(tmp_path / 'slow.log')
+    app.config['SLOW_QUERY_LOG_MAX_BYTES'] = 2000
+    app.config['USER_CACHE_TTL'] = 0 # both requests read the user
+    auth.login()
+    app.config['SLOW_QUERY_THRESHOLD'] = 0 # every statement is slow
+    client.get('/master-lists/1/view')
+    client.get('/master-lists/1/view')
+    app.config['SLOW_QUERY_THRESHOLD'] = None
+    client.get('/master-lists/1/view')
+
+    assert (tmp_path / 'slow.log.1').exists() # rotated
+    with app.app_context():
+        entries = list(read_slow_query_log(app.config['SLOW_QUERY_LOG'], app.config['SLOW_QUERY_LOG_BACKUPS']))
+    entry = next(entry for entry in entries if entry['sql'].startswith('SELECT id, created, name, description, creator_id FROM master_lists'))
+    assert entry['request'] == 'GET /master-lists/1/view'
+    assert entry['parameters'] == [1]
+    assert entry['fingerprint'] == normalize(entry['sql'])
+    assert entry['rows'] == 0 # logged as soon as it crossed the threshold, before any rows were fetched
+    assert entry['plan'] == ['SEARCH master_lists USING INTEGER PRIMARY KEY (rowid=?)']
+    # but not the values of statements on users
+    entry = next(entry for entry in entries if ' FROM users ' in entry['sql'])
+    assert entry['parameters'] == [None]
+    assert entry['plan'] == ['SEARCH users USING INTEGER PRIMARY KEY (rowid=?)']
+
+    # the command sums up the log, including the rotated files, by statement
+    statements = summarize_slow_queries(entries)
+    assert {statement['count'] for statement in statements} == {2}
+    result = runner.invoke(args=['slow-queries', '--limit', '1'])
+    assert 'SEARCH' in result.output or 'SCAN' in result.output
+    assert result.output.startswith(f"2 x, {statements[0]['seconds']:.3f} s total")
+    assert result.output.count(' x, ') == 1
+
+
+def test_slow_queries_command(runner, app, tmp_path):
+    app.config['SLOW_QUERY_LOG'] = str(tmp_path / 'slow.log')
+    result = runner.invoke(args=['slow-queries'])
+    assert 'No slow queries logged.' in result.output
+    with app.app_context():
+        db = get_db()
+        db.slow_query_threshold = 0
+        db.execute("SELECT * FROM master_item_detail_relations WHERE master_content = 'x'").fetchall()
+    result = runner.invoke(args=['slow-queries'])
+    assert "1 x" in result.output
+    assert "  ! SCAN master_item_detail_relations" in result.output # flagged: no index on the content alone
+
+
+def test_slow_query_read_by_iteration(app, tmp_path):
+    app.config['SLOW_QUERY_LOG'] = str(tmp_path / 'slow.log')
+    app.config['SLOW_QUERY_THRESHOLD'] = 0.05
+    sql = 'WITH RECURSIVE n (i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 600) SELECT slowly(i) FROM n'
+    with app.app_context():
+        db = get_db()
+        db.create_function('slowly', 1, lambda i: time.sleep(0.0002) or i) # about 0.12 seconds in all, of which executing is a row's worth
+        cur = db.execute(sql)
+        assert cur.seconds < 0.05
+        assert sum(1 for _ in cur) == 600
+        entries = list(read_slow_query_log(app.config['SLOW_QUERY_LOG'], 0))
+    assert [entry['sql'] for entry in entries] == [sql]
+    assert entries[0]['seconds'] >= 0.05
+    assert entries[0]['rows'] >= 256 # crossed while iterating, not executing
@@ -0,0 +1,57 @@
+import sqlite3
+
+from incontext.throttle import ThrottleStore, take_token
+
+
+def test_take_token(tmp_path):
+    path = str(tmp_path / 'throttle.sqlite')
+    db, other = ThrottleStore().connect(path), ThrottleStore().connect(path) # like two worker processes
+    assert take_token(db, 'ip:a', 0.5, 2, now=100) is None
+    assert take_token(other, 'ip:a', 0.5, 2, now=100) is None
+    assert take_token(db, 'ip:a', 0.5, 2, now=100) == 2 # seconds until the next token
+    assert take_token(other, 'ip:a', 0.5, 2, now=101) == 1 # half a token back, not charged for the last attempt
+    assert take_token(db, 'ip:b', 0.5, 2, now=101) is None
+    assert take_token(db, 'ip:a', 0.5, 2, now=102) is None
+    # refilled up to the burst only
+    assert take_token(db, 'ip:a', 0.5, 2, now=1000) is None
+    assert take_token(db, 'ip:a', 0.5, 2, now=1000) is None
+    assert take_token(db, 'ip:a', 0.5, 2, now=1000) is not None
+
+
+def test_login_throttle(app, client, auth, monkeypatch):
+    app.config['LOGIN_THROTTLE'] = {'ip': (0.001, 4), 'username': (0.001, 2)}
+    assert b'Incorrect password' in auth.login('test', 'a').data
+    assert b'Incorrect password' in auth.login('test', 'b').data
+
+    # rejected before the password is checked
+    monkeypatch.setattr('incontext.auth.verify_password', lambda pwhash, password: 1 / 0)
+    response = auth.login('test', 'test')
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) > 0
+    assert b'Too many login attempts' in response.data
+    monkeypatch.undo()
+
+    # another username from the same address still can, until the address runs out
+    assert auth.login('other', 'other').status_code == 302
+    assert auth.login('other', 'other').status_code == 429
+    # another address, as resolved by ProxyFix
+    response = client.post(
+        '/auth/login', data={'username': 'other', 'password': 'other'}, headers={'X-Forwarded-For': '203.0.113.7'}
+    )
+    assert response.status_code == 302
+
+    metrics = app.extensions['incontext.metrics'].snapshot()
+    assert metrics['login_throttled_total{bucket="username"}'] == 1
+    assert metrics['login_throttled_total{bucket="ip"}'] == 1
+    assert metrics['login_attempts_total'] == 4
+
+
+def test_register_throttle(app, client):
+    app.config['LOGIN_THROTTLE'] = {'ip': (0.001, 1)}
+    assert client.post('/auth/register', data={'username': 'a', 'password': 'a'}).status_code == 302
+    assert client.post('/auth/register', data={'username': 'b', 'password': 'b'}).status_code == 429
+    # validation errors cost nothing
+    assert client.post('/auth/register', data={'username': '', 'password': 'b'}).status_code == 200
+    db = sqlite3.connect(app.config['LOGIN_THROTTLE_DATABASE'])
+    assert db.execute('SELECT key FROM buckets').fetchall() == [('ip:127.0.0.1',)]
+    db.close()
@@ -0,0 +1,80 @@
+import re
+
+from incontext.db import get_db
+from flask import g
+
+
+def make_token(client, auth, **form):
+    auth.login()
+    response = client.post('/auth/tokens', data={'name': 'script', 'scopes': ['read', 'write'], **form})
+    auth.logout()
+    return re.search(r'<code>(ic_[\w-]+)</code>', response.get_data(as_text=True))[1]
+
+
+def bearer(token):
+    return {'Authorization': f'Bearer {token}'}
+
+
+def test_tokens(app, client, auth):
+    token = make_token(client, auth)
+    with app.app_context():
+        api_token = get_db().execute('SELECT * FROM api_tokens').fetchone()
+        assert (api_token['user_id'], api_token['scopes'], api_token['last_used']) == (2, 'read write', None)
+        assert api_token['secret_hash'] not in token # only the keyed hash is stored
+
+    with client:
+        assert client.get('/', headers=bearer(token)).status_code == 200
+        assert g.user['username'] == 'test'
+        assert g.token_scopes == ['read', 'write']
+    assert client.post('/master-lists/1/master-details/new', data={'name': 'd', 'description': ''}, headers=bearer(token)).status_code == 302
+    with app.app_context():
+        last_used = get_db().execute('SELECT last_used FROM api_tokens').fetchone()['last_used']
+        assert last_used is not None
+    client.get('/', headers=bearer(token))
+    with app.app_context():
+        assert get_db().execute('SELECT last_used FROM api_tokens').fetchone()['last_used'] == last_used # not written again so soon
+
+    # a token can't manage tokens
+    assert client.get('/auth/tokens', headers=bearer(token)).status_code == 403
+
+    for invalid in (token[:-1] + ('a' if token[-1] != 'a' else 'b'), 'ic_nope_nope', 'x'):
+        response = client.get('/', headers=bearer(invalid))
+        assert response.status_code == 401
+        assert response.headers['WWW-Authenticate'].lower() == 'bearer'
+
+    with app.app_context():
+        get_db().execute("UPDATE api_tokens SET expires = '2000-01-01 00:00:00'")
+        get_db().commit()
+    assert client.get('/', headers=bearer(token)).status_code == 401
+
+
+def test_token_scopes(app, client, auth):
+    token = make_token(client, auth, scopes=['read'], expires_in_days='30')
+    assert client.get('/master-lists/1/view', headers=bearer(token)).status_code == 200
+    assert client.post('/master-lists/1/delete', headers=bearer(token)).status_code == 403
+
+
+def test_tokens_group_commit(app, client, auth):
+    app.config['DATABASE_GROUP_COMMIT'] = True
+    token = make_token(client, auth) # created on the group commit thread
+    assert client.get('/', headers=bearer(token)).status_code == 200
+    with app.app_context():
+        assert get_db().execute('SELECT last_used FROM api_tokens').fetchone()['last_used'] is not None
+
+
+def test_new_token_validate_input(client, auth):
+    auth.login()
+    assert b'Name is required.' in client.post('/auth/tokens', data={'name': '', 'scopes': ['read']}).data
+    assert b'At least one scope' in client.post('/auth/tokens', data={'name': 'a'}).data
+    assert b'Expiry must be' in client.post('/auth/tokens', data={'name': 'a', 'scopes': ['read'], 'expires_in_days': 'x'}).data
+    assert b'<p>Empty</p>' in client.get('/auth/tokens').data
+
+
+def test_revoke_token(app, client, auth):
+    token = make_token(client, auth)
+    auth.login('other', 'other')
+    assert client.post('/auth/tokens/1/revoke').status_code == 404 # not theirs
+    auth.login()
+    assert b'ic_' in client.get('/auth/tokens').data
+    assert client.post('/auth/tokens/1/revoke').headers['Location'] == '/auth/tokens'
+    assert client.get('/', headers=bearer(token)).status_code == 401